@@ -9,14 +9,204 @@ class Settings(BaseSettings):
     app_name: str = "Unified AI Backend"
     log_file: str = "backend_app.log"
 
+    # Logging: JSON lines written by a background thread, rotated at
+    # log_max_bytes; records are dropped if log_queue_size are waiting.
+    # log_rotation "size" rotates in the process, "external" leaves it to
+    # logrotate and reopens the moved file; "auto" uses "external" when the
+    # app runs in several processes sharing the file (WEB_CONCURRENCY > 1,
+    # gunicorn or uvicorn --workers). An empty log_file logs to stdout only.
+    log_level: str = "INFO"
+    log_rotation: str = "auto"
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backup_count: int = 5
+    log_queue_size: int = 10_000
+
     # API Keys for different LLM providers
     together_api_key: str | None = None
     google_api_key: str | None = None
 
+    # Default Gemini model used by the debugger
+    default_model: str = "gemini-1.5-pro"
+    # How long the router's circuit breaker skips a failing target
+    model_fallback_ttl_seconds: float = 300.0
+
+    # Together AI (tutor) upstream settings
+    together_base_url: str = "https://api.together.xyz/v1"
+    tutor_model: str = "mistralai/Mixtral-8x7B-Instruct-v0.1"
+    # Tutor answers that are not valid JSON are repaired locally (code fences,
+    # truncation); only an answer that cannot be repaired is re-requested, up
+    # to this many times, before its text is returned as the explanation
+    tutor_parse_retries: int = 1
+
+    # Provider routing: comma-separated "provider:model" targets, most
+    # preferred first. Empty uses tutor_model on Together for the tutor and
+    # default_model then the Flash fallback on Gemini for the debugger.
+    tutor_targets: str = ""
+    debugger_targets: str = ""
+    # Targets slower than this p95 are only used when all are
+    router_slow_p95_ms: float = 10_000.0
+    # Circuit breaker; an open circuit is retried after model_fallback_ttl_seconds
+    router_failure_threshold: int = 5
+    router_error_rate_threshold: float = 0.5
+    # Hedging: re-send a request that is slower than the primary's percentile latency
+    router_hedge_enabled: bool = False
+    router_hedge_percentile: float = 95.0
+    router_hedge_min_delay_ms: float = 100.0
+
+    # Batch-capable model server: an OpenAI-compatible /completions endpoint
+    # that takes a list of prompts (vLLM, TGI, ...). Used by "batch:<model>"
+    # targets; requests are gathered for batch_window_ms or batch_max_size,
+    # with at most batch_max_concurrency batches in flight.
+    batch_base_url: str | None = None
+    batch_api_key: str | None = None
+    batch_window_ms: float = 5.0
+    batch_max_size: int = 32
+    batch_max_concurrency: int = 4
+
+    # Local CPU inference (optional, requires llama-cpp-python): a GGUF model
+    # loaded once per process with memory-mapped weights. When set, a local
+    # target joins both routers; queries of up to local_max_query_tokens are
+    # sent to it first, and it is the last-resort fallback for the rest.
+    local_model_path: str | None = None
+    local_n_ctx: int = 4096
+    local_n_threads: int | None = None
+    local_max_tokens: int = 512
+    local_max_query_tokens: int = 48
+
+    # LLM request limits
+    llm_timeout_seconds: float = 30.0
+    llm_max_concurrency: int = 16
+
+    # Upstream HTTP: one transport shared by the Together and batch clients,
+    # with a keep-alive pool per origin (upstream_pool_size connections,
+    # default llm_max_concurrency; "host=size,host:port=size,..." in
+    # upstream_host_pool_sizes overrides it), HTTP/2 where the server offers
+    # it (requires h2), and DNS answers reused for upstream_dns_ttl_seconds.
+    # upstream_ca_bundle verifies upstreams against a custom CA, e.g. a local
+    # test server's certificate.
+    upstream_pool_size: int | None = None
+    upstream_host_pool_sizes: str = ""
+    upstream_keepalive_expiry_seconds: float = 60.0
+    upstream_http2: bool = True
+    upstream_dns_ttl_seconds: float = 300.0
+    upstream_ca_bundle: str | None = None
+
+    # Batch chat API: queries per /api/batch request, run concurrently and
+    # each admitted like a single request, and messages per bulk append
+    chat_batch_max_queries: int = 8
+    chat_batch_max_messages: int = 200
+
+    # Rate limiting for the LLM endpoints: a token bucket per session (or
+    # client IP), shared across workers when limiter_backend is "redis"
+    rate_limit_enabled: bool = True
+    rate_limit_per_minute: float = 30.0
+    rate_limit_burst: int = 10
+    limiter_backend: str = "memory"
+
+    # Adaptive (AIMD) concurrency cap per upstream provider, between
+    # limiter_min_concurrency and llm_max_concurrency, applied to each call
+    # the router sends. Queued calls that cannot start within
+    # limiter_queue_timeout_seconds fail over to another target, or are shed with a 503.
+    limiter_min_concurrency: int = 1
+    limiter_latency_tolerance: float = 2.0
+    limiter_backoff: float = 0.7
+    limiter_queue_timeout_seconds: float = 5.0
+
+    # In-memory session store limits
+    session_max_count: int = 10_000
+    session_ttl_seconds: float = 3600.0
+    session_max_messages: int = 100
+    session_max_bytes: int = 256 * 1024
+    # When set, turns older than the newest session_hot_messages are kept
+    # compressed (zstd if zstandard is installed, otherwise zlib)
+    session_hot_messages: int | None = None
+    error_context_ttl_seconds: float = 600.0
+
+    # LLM response cache; the similarity tier is disabled unless a threshold is set
+    response_cache_enabled: bool = True
+    response_cache_max_entries: int = 5000
+    response_cache_ttl_seconds: float = 3600.0
+    response_cache_similarity_threshold: float | None = None
+
+    # Error fix index: validated tutor answers keyed by a fingerprint of the
+    # error and question (paths, line numbers and values stripped), served
+    # for recurring errors without calling the model. "memory" keeps it per
+    # worker; "mongo" persists it and shares it between workers. Entries
+    # unused for fix_index_ttl_seconds expire.
+    fix_index_enabled: bool = True
+    fix_index_backend: str = "memory"
+    fix_index_max_entries: int = 10000
+    fix_index_ttl_seconds: float = 30 * 86400.0
+
+    # Local embeddings; embedding_model names a sentence-transformers model,
+    # otherwise a hashing embedder of embedding_dim dimensions is used
+    embedding_model: str | None = None
+    embedding_dim: int = 512
+    embedding_batch_size: int = 64
+
+    # RAG index
+    rag_source_dir: str = "docs"
+    rag_index_dir: str = "rag_index"
+    rag_ingest_workers: int = 4
+    rag_file_extensions: str = ".md,.txt,.rst"
+    rag_chunk_size: int = 800
+    rag_chunk_overlap: int = 100
+    rag_top_k: int = 5
+    rag_nprobe: int = 8
+
+    # Hybrid retrieval: candidates per retriever, reciprocal-rank-fusion constant,
+    # and an optional cross-encoder re-rank stage bounded by a latency budget
+    rag_candidates: int = 50
+    rag_rrf_k: int = 60
+    rag_reranker_model: str | None = None
+    rag_rerank_budget_ms: float = 50.0
+
+    # Prompt assembly: token budget per model (falls back to prompt_token_budget),
+    # share of it given to retrieved context, and size of the history summary
+    prompt_token_budget: int = 4000
+    prompt_token_budgets: dict[str, int] = {}
+    prompt_context_share: float = 0.3
+    prompt_summary_tokens: int = 300
+    rag_context_enabled: bool = True
+
+    # Observability: Prometheus metrics at /metrics, event-loop lag sampled
+    # every loop_lag_interval_seconds, and optional OpenTelemetry traces
+    # (requires opentelemetry-sdk and the OTLP exporter) sent to otel_endpoint
+    metrics_enabled: bool = True
+    loop_lag_interval_seconds: float = 0.5
+    otel_enabled: bool = False
+    otel_endpoint: str = "http://localhost:4317"
+
+    # Startup warm-up: build provider clients, the debugger chain, the RAG
+    # index mapping and the local model's prefix caches before serving
+    warmup_enabled: bool = False
+
     # Database settings
     mongo_uri: str = "mongodb://localhost:27017/"
     mongo_db_name: str = "ai_assistant_db"
 
+    # Session persistence: "memory" keeps history in-process only, "mongo"
+    # persists it with write-behind batching behind a per-worker cache, and
+    # "redis" shares history and error context between workers. While Mongo
+    # is unreachable, failed writes are retried with exponential backoff and
+    # at most history_max_pending_writes are kept, dropping the oldest
+    session_backend: str = "memory"
+    history_flush_interval_seconds: float = 0.5
+    history_flush_max_batch: int = 500
+    history_max_pending_writes: int = 50_000
+
+    # Shared state for multi-worker deployments: a server speaking the Redis
+    # protocol, used by the "redis" session, cache and limiter backends
+    redis_url: str = "redis://localhost:6379/0"
+    cache_backend: str = "memory"
+
+    # Lifecycle: on SIGTERM readiness fails at once and the worker keeps
+    # serving for shutdown_drain_delay_seconds, so load balancers stop sending
+    # traffic, before it stops accepting and drains in-flight requests.
+    # Dependency checks for /health time out after health_check_timeout_seconds.
+    shutdown_drain_delay_seconds: float = 0.0
+    health_check_timeout_seconds: float = 1.0
+
     # Model configuration for pydantic-settings
     model_config = SettingsConfigDict(
         env_file=".env",
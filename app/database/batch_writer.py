@@ -0,0 +1,112 @@
+import asyncio
+import time
+from typing import Callable
+from app.logger import logger
+
+# Duplicate key: a document of a retried batch that the failed call had already written
+_DUPLICATE_KEY = 11000
+# Smallest first retry delay, so a zero flush interval cannot retry in a loop
+_MIN_BACKOFF = 0.5
+
+class BatchWriter:
+    """
+    Write-behind buffer for a MongoDB collection.
+    Documents are queued in memory and written with a single insert_many
+    every flush_interval seconds, or as soon as max_batch documents are waiting.
+
+    A failed batch is put back and retried after a delay that doubles with
+    each consecutive failure, up to max_backoff seconds. While the database
+    is down at most max_pending documents are kept: the oldest are dropped
+    and counted, so memory stays bounded.
+
+    stop() lets a write in progress finish, then writes what is left.
+    """
+
+    def __init__(self, get_collection: Callable, flush_interval: float, max_batch: int, max_pending: int, max_backoff: float = 60.0):
+        self._get_collection = get_collection
+        self._flush_interval = flush_interval
+        self._max_batch = max_batch
+        self._max_pending = max_pending
+        self._max_backoff = max_backoff
+        self._buffer: list[dict] = []
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self._failures = 0
+        self._retry_at = 0.0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def add(self, document: dict):
+        self._buffer.append(document)
+        self._trim()
+        # A full batch is written at once, unless the writer is backing off
+        if len(self._buffer) >= self._max_batch and time.monotonic() >= self._retry_at:
+            self._wakeup.set()
+
+    def discard(self, predicate: Callable[[dict], bool]):
+        """Drops queued documents that have not been written yet."""
+        self._buffer = [doc for doc in self._buffer if not predicate(doc)]
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Cancelling the task mid-write would lose the batch it holds
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+
+    async def flush(self):
+        while self._buffer:
+            batch, self._buffer = self._buffer[:self._max_batch], self._buffer[self._max_batch:]
+            try:
+                await self._get_collection().insert_many(batch, ordered=False)
+            except asyncio.CancelledError:
+                # Written or not, keep the batch; a rewritten document is a duplicate key
+                self._buffer[:0] = batch
+                raise
+            except Exception as e:
+                # Put back what was not written so the next flush retries it
+                self._buffer[:0] = _unwritten(batch, e)
+                self._trim()
+                self._failures += 1
+                delay = min(self._max_backoff, max(self._flush_interval, _MIN_BACKOFF) * 2 ** (self._failures - 1))
+                self._retry_at = time.monotonic() + delay
+                logger.error(f"Failed to flush {len(batch)} documents, retrying in {delay:.1f}s ({self.dropped} dropped so far): {e}")
+                return
+            self._failures = 0
+            self._retry_at = 0.0
+
+    async def _run(self):
+        while not self._stopping:
+            timeout = max(self._flush_interval, self._retry_at - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._stopping and time.monotonic() >= self._retry_at:
+                await self.flush()
+
+    def _trim(self):
+        excess = len(self._buffer) - self._max_pending
+        if excess > 0:
+            del self._buffer[:excess]
+            self.dropped += excess
+
+def _unwritten(batch: list[dict], error: Exception) -> list[dict]:
+    """The documents of a failed insert_many that were not written."""
+    # A BulkWriteError lists the failed documents; the others are stored
+    details = getattr(error, "details", None)
+    if not isinstance(details, dict) or "writeErrors" not in details:
+        return batch
+    return [batch[e["index"]] for e in details["writeErrors"] if e.get("code") != _DUPLICATE_KEY]
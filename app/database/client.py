@@ -1,12 +1,17 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from typing import TYPE_CHECKING
 from app.config import settings
 from app.logger import logger
 
+if TYPE_CHECKING:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
 class DatabaseClient:
-    _client: AsyncIOMotorClient | None = None
+    _client: "AsyncIOMotorClient | None" = None
 
-    def get_client(self) -> AsyncIOMotorClient:
+    def get_client(self) -> "AsyncIOMotorClient":
         if self._client is None:
+            # Motor is imported on first use; only the "mongo" backends need it
+            from motor.motor_asyncio import AsyncIOMotorClient
             logger.info(f"Connecting to MongoDB at {settings.mongo_uri}...")
             self._client = AsyncIOMotorClient(settings.mongo_uri)
             logger.info("MongoDB client initialized.")
@@ -23,8 +28,14 @@ class DatabaseClient:
 
 db_client = DatabaseClient()
 
+def mongo_in_use() -> bool:
+    """True when any store is configured to persist its state in MongoDB."""
+    return settings.session_backend == "mongo" or (settings.fix_index_enabled and settings.fix_index_backend == "mongo")
+
 async def connect_to_mongo():
-    db_client.get_client()
+    # Without a Mongo backend the client is created on first use, if ever
+    if mongo_in_use():
+        db_client.get_client()
 
 async def close_mongo_connection():
     await db_client.close_connection()
@@ -0,0 +1,36 @@
+from typing import TYPE_CHECKING
+from app.config import settings
+from app.logger import logger
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+class RedisClient:
+    """
+    Process-wide connection pool to a server speaking the Redis protocol
+    (Redis, Valkey, KeyDB, Dragonfly). Requires the `redis` package, which
+    is imported on first use.
+    """
+    _client: "Redis | None" = None
+
+    def get_client(self) -> "Redis":
+        if self._client is None:
+            import redis.asyncio as redis
+            logger.info(f"Connecting to Redis at {settings.redis_url}...")
+            self._client = redis.from_url(settings.redis_url)
+        return self._client
+
+    async def close_connection(self):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+            logger.info("Redis connection closed.")
+
+redis_client = RedisClient()
+
+def redis_in_use() -> bool:
+    """True when any store is configured to share its state through Redis."""
+    return "redis" in (settings.session_backend, settings.cache_backend, settings.limiter_backend)
+
+async def close_redis_connection():
+    await redis_client.close_connection()
@@ -0,0 +1,260 @@
+import asyncio
+import importlib.util
+import socket
+import ssl
+import time
+from typing import AsyncIterator, Callable
+import httpcore
+import httpx
+from app.config import settings
+from app.logger import logger
+
+# --- DNS cache ---
+class CachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    Network backend that resolves each host once per ttl_seconds and counts
+    the connections it opens per "host:port". TLS still verifies and sends SNI for
+    the host name: the pool passes it to start_tls separately.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self._backend = httpcore.AnyIOBackend()
+        self._ttl_seconds = ttl_seconds
+        self._addresses: dict[tuple[str, int], tuple[list[str], float]] = {}
+        self._resolving: dict[tuple[str, int], asyncio.Future] = {}
+        self.opened: dict[str, int] = {}
+        self.lookups = 0
+        self.cached_lookups = 0
+
+    async def connect_tcp(self, host: str, port: int, timeout: float | None = None, local_address: str | None = None, socket_options=None) -> httpcore.AsyncNetworkStream:
+        addresses = await self._resolve(host, port, timeout)
+        for i, address in enumerate(addresses):
+            try:
+                stream = await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+                break
+            except (httpcore.ConnectError, httpcore.ConnectTimeout):
+                if i == len(addresses) - 1:
+                    # The host may have moved; resolve it again for the next connection
+                    self._addresses.pop((host, port), None)
+                    raise
+        address = f"{host}:{port}"
+        self.opened[address] = self.opened.get(address, 0) + 1
+        return stream
+
+    async def connect_unix_socket(self, path: str, timeout: float | None = None, socket_options=None) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float):
+        await self._backend.sleep(seconds)
+
+    async def _resolve(self, host: str, port: int, timeout: float | None) -> list[str]:
+        cached = self._addresses.get((host, port))
+        if cached is not None and cached[1] > time.monotonic():
+            self.cached_lookups += 1
+            return cached[0]
+        # Connections opened together to a new host share one lookup
+        pending = self._resolving.get((host, port))
+        if pending is not None:
+            self.cached_lookups += 1
+            return await asyncio.shield(pending)
+        pending = self._resolving[(host, port)] = asyncio.ensure_future(self._lookup(host, port, timeout))
+        # Retrieve the error even when every waiter was cancelled
+        pending.add_done_callback(lambda future: future.cancelled() or future.exception())
+        return await asyncio.shield(pending)
+
+    async def _lookup(self, host: str, port: int, timeout: float | None) -> list[str]:
+        self.lookups += 1
+        try:
+            infos = await asyncio.wait_for(
+                asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM), timeout
+            )
+        except asyncio.TimeoutError as e:
+            raise httpcore.ConnectTimeout(f"Timed out resolving {host}") from e
+        except OSError as e:
+            raise httpcore.ConnectError(f"Could not resolve {host}: {e}") from e
+        finally:
+            self._resolving.pop((host, port), None)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        self._addresses[(host, port)] = (addresses, time.monotonic() + self._ttl_seconds)
+        return addresses
+
+# --- Shared transport ---
+class _TrackedStream(httpx.AsyncByteStream):
+    """Response body that reports when it is closed, so in-flight requests can be counted."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+class UpstreamTransport(httpx.AsyncBaseTransport):
+    """
+    Connection pools to the upstream APIs, one per host, shared by every
+    provider client in the process so concurrent calls reuse warm TLS
+    connections instead of each paying a handshake. HTTP/2 is negotiated
+    where the server offers it (requires `h2`): requests to an origin are
+    then multiplexed over a few connections. There is one pool per origin
+    (scheme, host and port), holding up to pool_size connections, or the
+    entry for "host:port" or host in host_pool_sizes.
+
+    Clients built on the transport do not close it; close_upstream_transport
+    does, at shutdown.
+
+    httpx has no option for the network backend, so the DNS cache and the
+    pool statistics reach into its connection pool. If an httpx release
+    changes that, the transport still works, without either of them.
+    """
+
+    def __init__(self, pool_size: int, host_pool_sizes: dict[str, int], keepalive_expiry: float, http2: bool, dns_ttl_seconds: float, verify: ssl.SSLContext | bool = True):
+        self.pool_size = pool_size
+        self.host_pool_sizes = host_pool_sizes
+        self.http2 = http2
+        self._keepalive_expiry = keepalive_expiry
+        self._verify = verify
+        self._backend = CachingNetworkBackend(dns_ttl_seconds)
+        self._pools: dict[str, tuple[httpx.AsyncHTTPTransport, httpcore.AsyncConnectionPool | None]] = {}
+        self._in_flight: dict[str, int] = {}
+        self._requests: dict[str, int] = {}
+
+    def _size(self, origin: str) -> int:
+        address = origin.partition("://")[2]
+        return self.host_pool_sizes.get(address, self.host_pool_sizes.get(address.rpartition(":")[0], self.pool_size))
+
+    def _pool(self, origin: str) -> httpx.AsyncHTTPTransport:
+        entry = self._pools.get(origin)
+        if entry is None:
+            size = self._size(origin)
+            transport = httpx.AsyncHTTPTransport(
+                verify=self._verify,
+                http2=self.http2,
+                limits=httpx.Limits(max_connections=size, max_keepalive_connections=size, keepalive_expiry=self._keepalive_expiry),
+            )
+            entry = self._pools[origin] = (transport, self._install_backend(transport))
+        return entry[0]
+
+    def _install_backend(self, transport: httpx.AsyncHTTPTransport) -> httpcore.AsyncConnectionPool | None:
+        """Gives the transport's pool the DNS-caching backend; returns the pool, or None if it is not reachable."""
+        pool = getattr(transport, "_pool", None)
+        if isinstance(pool, httpcore.AsyncConnectionPool) and hasattr(pool, "_network_backend"):
+            pool._network_backend = self._backend
+            return pool
+        logger.warning(f"httpx {httpx.__version__} keeps its connection pool elsewhere; upstream DNS caching and pool stats are off.")
+        return None
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        origin = _origin(request.url)
+        transport = self._pool(origin)
+        self._requests[origin] = self._requests.get(origin, 0) + 1
+        self._in_flight[origin] = self._in_flight.get(origin, 0) + 1
+        try:
+            response = await transport.handle_async_request(request)
+        except BaseException:
+            self._release(origin)
+            raise
+        response.stream = _TrackedStream(response.stream, lambda: self._release(origin))
+        return response
+
+    def _release(self, origin: str):
+        self._in_flight[origin] -= 1
+
+    async def aclose(self):
+        # Shared by every provider client; closed once by close_upstream_transport
+        pass
+
+    async def close(self):
+        for transport, _ in self._pools.values():
+            await transport.aclose()
+        self._pools.clear()
+
+    def stats(self) -> dict:
+        origins = {}
+        for origin, (_, pool) in self._pools.items():
+            requests = self._requests.get(origin, 0)
+            origins[origin] = {
+                "max_connections": self._size(origin),
+                "connections": None,
+                "idle": None,
+                "http2": None,
+                "in_flight": self._in_flight.get(origin, 0),
+                "requests": requests,
+                "connections_opened": None,
+                "reuse_ratio": None,
+            }
+            if pool is not None:
+                connections = [connection for connection in pool.connections if not connection.is_closed()]
+                opened = self._backend.opened.get(origin.partition("://")[2], 0)
+                origins[origin].update({
+                    "connections": len(connections),
+                    "idle": sum(connection.is_idle() for connection in connections),
+                    "http2": sum(", HTTP/2," in connection.info() for connection in connections),
+                    "connections_opened": opened,
+                    "reuse_ratio": round(1 - opened / requests, 3) if requests else 0.0,
+                })
+        return {
+            "http2": self.http2,
+            "dns_lookups": self._backend.lookups,
+            "dns_cached_lookups": self._backend.cached_lookups,
+            "origins": origins,
+        }
+
+def _origin(url: httpx.URL) -> str:
+    """scheme://host:port, with the scheme's default port filled in."""
+    port = url.port or (443 if url.scheme == "https" else 80)
+    return f"{url.scheme}://{url.host}:{port}"
+
+def _host_pool_sizes(spec: str) -> dict[str, int]:
+    """Parses "host=size,host:port=size"."""
+    sizes = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        host, _, size = item.rpartition("=")
+        sizes[host.strip()] = int(size)
+    return sizes
+
+_transport: UpstreamTransport | None = None
+
+def get_upstream_transport() -> UpstreamTransport:
+    """Returns the process-wide upstream transport, creating it on first use."""
+    global _transport
+    if _transport is None:
+        http2 = settings.upstream_http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("h2 is not installed; upstream connections use HTTP/1.1.")
+            http2 = False
+        verify = ssl.create_default_context(cafile=settings.upstream_ca_bundle) if settings.upstream_ca_bundle else True
+        _transport = UpstreamTransport(
+            pool_size=settings.upstream_pool_size or settings.llm_max_concurrency,
+            host_pool_sizes=_host_pool_sizes(settings.upstream_host_pool_sizes),
+            keepalive_expiry=settings.upstream_keepalive_expiry_seconds,
+            http2=http2,
+            dns_ttl_seconds=settings.upstream_dns_ttl_seconds,
+            verify=verify,
+        )
+        logger.info(f"Upstream HTTP transport ready (HTTP/2 {'on' if http2 else 'off'}).")
+    return _transport
+
+def get_upstream_stats() -> dict:
+    """Pool state of the upstream transport; empty until the first upstream request or startup."""
+    if _transport is None:
+        return {"http2": None, "dns_lookups": 0, "dns_cached_lookups": 0, "origins": {}}
+    return _transport.stats()
+
+async def start_upstream_transport():
+    get_upstream_transport()
+
+async def close_upstream_transport():
+    global _transport
+    if _transport is not None:
+        await _transport.close()
+        _transport = None
+        logger.info("Upstream HTTP transport closed.")
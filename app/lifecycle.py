@@ -0,0 +1,128 @@
+import asyncio
+import os
+import signal
+import time
+from app.config import settings
+from app.logger import logger
+from app.database.client import db_client, mongo_in_use
+from app.database.redis_client import redis_client, redis_in_use
+from app.metrics import last_loop_lag
+from app.services import rag
+from app.services.provider_router import debugger_router, tutor_router
+
+# --- Worker state ---
+# starting -> ready once the startup hooks have run -> draining on SIGTERM/SIGINT
+_state = "starting"
+_started_at = time.time()
+_previous_handlers: dict = {}
+
+def state() -> str:
+    return _state
+
+async def mark_ready():
+    """Last startup hook: the worker accepts traffic once everything before it has run."""
+    global _state
+    _state = "ready"
+    _install_signal_handlers()
+    logger.info(f"Worker {os.getpid()} is ready.")
+
+async def mark_draining():
+    global _state
+    _state = "draining"
+
+def _install_signal_handlers():
+    # The server installs its own handlers before the startup hooks run; ours
+    # wrap them, and the server restores its originals when it exits
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+        try:
+            signal.signal(sig, lambda signum, frame: _on_signal(loop, signum, frame))
+        except ValueError:
+            return  # not the main thread, e.g. under a test client
+        _previous_handlers[sig] = previous
+
+def _on_signal(loop: asyncio.AbstractEventLoop, signum: int, frame):
+    global _state
+    previous = _previous_handlers[signum]
+    delay = settings.shutdown_drain_delay_seconds
+    # A second signal skips the delay
+    if _state == "draining" or delay <= 0:
+        _state = "draining"
+        previous(signum, frame)
+        return
+    _state = "draining"
+    logger.info(f"Worker {os.getpid()} draining; stopping in {delay:.1f}s.")
+    loop.call_soon_threadsafe(loop.call_later, delay, previous, signum, frame)
+
+# --- Dependency checks ---
+_checked_at = 0.0
+_checks: dict = {}
+_check_lock = asyncio.Lock()
+
+async def _ping(name: str, ping) -> tuple[str, dict]:
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(ping(), settings.health_check_timeout_seconds)
+    except Exception as e:
+        return name, {"status": "error", "error": str(e) or type(e).__name__}
+    return name, {"status": "ok", "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+async def check_dependencies() -> dict:
+    """
+    Pings the configured shared stores. Results are reused for a second, so
+    frequent probes from several load balancers cost one round trip.
+    """
+    global _checked_at, _checks
+    async with _check_lock:
+        if time.monotonic() - _checked_at >= 1.0:
+            pings = []
+            if mongo_in_use():
+                pings.append(_ping("mongo", lambda: db_client.get_client().admin.command("ping")))
+            if redis_in_use():
+                pings.append(_ping("redis", lambda: redis_client.get_client().ping()))
+            _checks = dict(await asyncio.gather(*pings))
+            _checked_at = time.monotonic()
+    return _checks
+
+def _providers() -> dict:
+    return {
+        router.name: {
+            "configured": router.available(),
+            "available": any(target.accepts() for target in router.targets),
+            "targets": {target.name: target.state for target in router.targets},
+        }
+        for router in (tutor_router, debugger_router)
+    }
+
+async def readiness() -> tuple[bool, dict]:
+    """Ready when started, not draining, and every configured dependency answers."""
+    dependencies = await check_dependencies()
+    ready = _state == "ready" and all(check["status"] == "ok" for check in dependencies.values())
+    return ready, {"status": "ready" if ready else "unavailable", "state": _state, "pid": os.getpid(), "dependencies": dependencies}
+
+def liveness() -> dict:
+    lag = last_loop_lag()
+    return {
+        "status": "ok",
+        "state": _state,
+        "pid": os.getpid(),
+        "uptime_seconds": round(time.time() - _started_at, 1),
+        "loop_lag_ms": None if lag is None else round(lag * 1000, 1),
+    }
+
+async def health_report() -> dict:
+    """Full status of this worker: lifecycle, dependencies, provider circuits and the RAG index."""
+    ready, report = await readiness()
+    providers = _providers()
+    degraded = not ready or any(router["configured"] and not router["available"] for router in providers.values())
+    return {
+        **liveness(),
+        "status": "degraded" if degraded else "ok",
+        "ready": ready,
+        "dependencies": report["dependencies"],
+        "providers": providers,
+        "rag": {"generation": rag.loaded_generation()},
+    }
@@ -1,16 +1,205 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
 import sys
+from datetime import datetime, timezone
 from app.config import settings
 
-# Configure a shared logger for the application
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - [%(module)s:%(lineno)d] - %(message)s',
-    handlers=[
-        logging.FileHandler(settings.log_file),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(module)s:%(lineno)d] - %(message)s'
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, so the log file can be filtered without parsing free text."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread. The message is resolved here, as
+    its arguments may change after the call; the traceback is left for the
+    listener to format. When the queue is full the record is dropped rather
+    than blocking the event loop.
+    """
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+class _AppendFileHandler(logging.handlers.WatchedFileHandler):
+    """
+    Appends each record to the log file with a single write, so several
+    processes can share the file without interleaving lines, and reopens the
+    file when an external tool (logrotate) has moved it away.
+    """
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.reopenIfNeeded()
+            if self.stream is None:
+                self.stream = self._open()
+            data = (self.format(record) + self.terminator).encode(self.encoding or "utf-8")
+            # The file is opened for appending, so each write lands whole at the end
+            os.write(self.stream.fileno(), data)
+        except Exception:
+            self.handleError(record)
+
+def _rotates_in_process() -> bool:
+    """
+    Size-based rotation renames the file under the other processes writing
+    to it, so "auto" only uses it in a lone process. Worker processes are
+    recognized by WEB_CONCURRENCY above 1 (read by uvicorn and gunicorn), by
+    a gunicorn command line (its workers are forked, not spawned), or by a
+    multiprocessing parent (uvicorn --workers, the RAG ingest pool). Several
+    independently started servers sharing one file cannot be told apart:
+    they need LOG_ROTATION=external.
+    """
+    if settings.log_rotation != "auto":
+        return settings.log_rotation == "size"
+    if int(os.environ.get("WEB_CONCURRENCY") or 1) > 1:
+        return False
+    if "gunicorn" in os.path.basename(sys.argv[0] if sys.argv else ""):
+        return False
+    return multiprocessing.parent_process() is None
 
+def _configure() -> logging.handlers.QueueListener:
+    handlers = []
+    # An empty log_file logs to stdout only
+    if settings.log_file:
+        if _rotates_in_process():
+            file_handler = logging.handlers.RotatingFileHandler(
+                settings.log_file, maxBytes=settings.log_max_bytes, backupCount=settings.log_backup_count, encoding="utf-8"
+            )
+        else:
+            file_handler = _AppendFileHandler(settings.log_file, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers.append(console_handler)
+
+    # Callers only enqueue; formatting and file/console I/O run on the listener thread
+    log_queue = queue.Queue(maxsize=settings.log_queue_size)
+    root = logging.getLogger()
+    root.setLevel(settings.log_level.upper())
+    root.addHandler(_DroppingQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+    return listener
+
+def stop_logging():
+    """Writes out queued records and stops the listener thread."""
+    if _listener._thread is not None:
+        _listener.stop()
+
+# Configure a shared logger for the application
+_listener = _configure()
 logger = logging.getLogger(__name__)
 
+# --- Log tail ---
+_READ_BLOCK = 64 * 1024
+
+def _log_files() -> list[str]:
+    """The live log file followed by its rotated backups, newest first."""
+    if not settings.log_file:
+        return []
+    paths = [settings.log_file] + [f"{settings.log_file}.{i}" for i in range(1, settings.log_backup_count + 1)]
+    return [path for path in paths if os.path.exists(path)]
+
+def _lines_backwards(f, end: int):
+    """Yields (offset, line) from byte offset `end` towards the start of the file."""
+    buffer, position = b"", end
+    while position > 0:
+        size = min(_READ_BLOCK, position)
+        position -= size
+        f.seek(position)
+        buffer = f.read(size) + buffer
+        lines = buffer.split(b"\n")
+        # The first piece may be the tail of a line that starts in an earlier block
+        buffer = lines.pop(0)
+        offset = position + len(buffer) + 1
+        pieces = []
+        for line in lines:
+            pieces.append((offset, line))
+            offset += len(line) + 1
+        yield from reversed(pieces)
+    if buffer:
+        yield 0, buffer
+
+def _parse(line: bytes) -> dict:
+    text = line.decode("utf-8", errors="replace")
+    try:
+        entry = json.loads(text)
+    except ValueError:
+        entry = None
+    # Lines written before structured logging have no fields to filter on
+    return entry if isinstance(entry, dict) else {"message": text}
+
+def tail_logs(limit: int, cursor: str | None = None, level: str | None = None, contains: str | None = None,
+              logger_name: str | None = None, since: str | None = None, max_scan_bytes: int = 8 * 1024 * 1024) -> dict:
+    """
+    Returns up to `limit` matching entries, oldest first, read backwards from
+    the end of the log without loading the file. The returned next_cursor
+    ("<inode>:<offset>") continues with older entries, into the rotated
+    backups, and is None once the log (or the `since` boundary) is exhausted.
+    A page scans at most max_scan_bytes, so a selective filter may return
+    fewer entries together with a cursor to continue from.
+    """
+    min_level = logging.getLevelName(level.upper()) if level else None
+    needle = contains.lower() if contains else None
+    files = [(path, os.stat(path).st_ino) for path in _log_files()]
+    start, offset = 0, None
+    if cursor:
+        inode, _, position = cursor.partition(":")
+        start = next((i for i, (_, ino) in enumerate(files) if str(ino) == inode), len(files))
+        offset = int(position or 0)
+
+    entries, scanned = [], 0
+    for index in range(start, len(files)):
+        path, inode = files[index]
+        with open(path, "rb") as f:
+            end = f.seek(0, os.SEEK_END) if offset is None else offset
+            offset = None
+            for position, line in _lines_backwards(f, end):
+                scanned += len(line) + 1
+                if not line.strip():
+                    continue
+                entry = _parse(line)
+                if since and "time" in entry and entry["time"] < since:
+                    return {"logs": entries[::-1], "next_cursor": None}
+                if (
+                    (min_level is None or logging.getLevelName(entry.get("level", "NOTSET")) >= min_level)
+                    and (needle is None or needle in entry.get("message", "").lower())
+                    and (logger_name is None or entry.get("logger", "").startswith(logger_name))
+                ):
+                    entries.append(entry)
+                if len(entries) >= limit or scanned >= max_scan_bytes:
+                    next_cursor = f"{inode}:{position}" if position > 0 else (
+                        f"{files[index + 1][1]}:{os.path.getsize(files[index + 1][0])}" if index + 1 < len(files) else None
+                    )
+                    return {"logs": entries[::-1], "next_cursor": next_cursor}
+    return {"logs": entries[::-1], "next_cursor": None}
@@ -1,17 +1,29 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import settings
+from app.middleware import LimiterMiddleware, MetricsMiddleware, rejection_response
 from app.logger import logger
-from app.routers import tutor_router, debugger_router, rag_router, admin_router
+from app.metrics import render_metrics, start_loop_monitor, start_tracing, stop_loop_monitor, stop_tracing
+from app.routers import tutor_router, debugger_router, rag_router, admin_router, batch_router, session_router
 from app.database.client import connect_to_mongo, close_mongo_connection
+from app.database.redis_client import close_redis_connection
+from app.http_transport import close_upstream_transport, start_upstream_transport
+from app.lifecycle import mark_draining, mark_ready
+from app.model_loader import close_batch_client, close_together_ai_client
+from app.memory import start_session_persistence, stop_session_persistence
+from app.services.fix_index import start_fix_index
+from app.services.limiter import AdmissionRejected, close_bucket_store
+from app.services.warmup import warm_up
 
 # Initialize the FastAPI application
 app = FastAPI(
     title=settings.app_name,
     description="A unified backend for AI-powered coding assistance, tutoring, and debugging.",
-    version="2.0.0"
+    version="2.0.0",
+    # Response bodies are serialized with orjson
+    default_response_class=ORJSONResponse,
 )
 
 # Configure CORS (Cross-Origin Resource Sharing) middleware
@@ -23,9 +35,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Add startup and shutdown event handlers for database connections
+# Rate limiting for the LLM endpoints; /api/batch limits each of its queries the same way.
+# Concurrency is admitted per upstream call by the provider router
+app.add_middleware(LimiterMiddleware, prefixes=("/api/tutor/", "/api/debugger/"))
+
+# Request latency metrics and tracing; added last so it also times rejected requests
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
+# Add startup and shutdown event handlers for database and upstream connections
 app.add_event_handler("startup", connect_to_mongo)
+app.add_event_handler("startup", start_session_persistence)
+app.add_event_handler("startup", start_fix_index)
+app.add_event_handler("startup", start_loop_monitor)
+app.add_event_handler("startup", start_tracing)
+app.add_event_handler("startup", start_upstream_transport)
+app.add_event_handler("startup", warm_up)
+app.add_event_handler("startup", mark_ready)
+app.add_event_handler("shutdown", mark_draining)
+app.add_event_handler("shutdown", stop_session_persistence)
 app.add_event_handler("shutdown", close_mongo_connection)
+app.add_event_handler("shutdown", close_together_ai_client)
+app.add_event_handler("shutdown", close_batch_client)
+app.add_event_handler("shutdown", close_upstream_transport)
+app.add_event_handler("shutdown", close_bucket_store)
+app.add_event_handler("shutdown", close_redis_connection)
+app.add_event_handler("shutdown", stop_loop_monitor)
+app.add_event_handler("shutdown", stop_tracing)
 
 
 # Include the API routers from the 'routers' module
@@ -33,6 +69,14 @@ app.include_router(admin_router.router, prefix="/api/admin", tags=["Admin"])
 app.include_router(tutor_router.router, prefix="/api/tutor", tags=["AI Tutor"])
 app.include_router(debugger_router.router, prefix="/api/debugger", tags=["AI Debugger"])
 app.include_router(rag_router.router, prefix="/api/rag", tags=["RAG"])
+app.include_router(batch_router.router, prefix="/api/batch", tags=["Batch"])
+app.include_router(session_router.router, prefix="/api/sessions", tags=["Sessions"])
+
+# An upstream call shed by its provider's concurrency limiter
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    logger.info("Shed request on %s: %s", request.url.path, exc.detail)
+    return rejection_response(exc)
 
 # Global exception handler to ensure consistent error responses
 @app.exception_handler(Exception)
@@ -48,3 +92,10 @@ async def read_root():
     """A simple root endpoint to confirm the API is running."""
     return {"message": f"Welcome to the {settings.app_name}!"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint."""
+    if not settings.metrics_enabled:
+        return JSONResponse(status_code=404, content={"detail": "Metrics are disabled."})
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
@@ -1,39 +1,530 @@
+import asyncio
+import json
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable
+from app.config import settings
 from app.logger import logger
-from langchain_community.chat_message_histories import ChatMessageHistory
+from app.database.batch_writer import BatchWriter
+from app.database.client import db_client
+from app.database.redis_client import redis_client
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, message_to_dict, messages_from_dict
 
-# In-memory stores that can be replaced by a database layer
-_error_context_store = {}
-_session_store = {}
+# --- Compact history ---
+# One byte per turn for its role; chunk types are stored as their full message
+_ROLE_CODES = {"human": 0, "ai": 1, "system": 2, "HumanMessageChunk": 0, "AIMessageChunk": 1, "SystemMessageChunk": 2}
+_ROLE_TYPES = ("human", "ai", "system")
+COLD_BLOCK_SIZE = 16
+
+_codec = None
+
+def _cold_codec():
+    """(compress, decompress) for cold turns: zstd when zstandard is installed, otherwise zlib."""
+    global _codec
+    if _codec is None:
+        try:
+            import zstandard
+            compressor, decompressor = zstandard.ZstdCompressor(level=3), zstandard.ZstdDecompressor()
+            # The copy releases the worst-case buffer the compressor allocates for its output
+            _codec = (lambda data: bytes(memoryview(compressor.compress(data))), decompressor.decompress)
+        except ImportError:
+            logger.warning("zstandard is not installed; compressing cold chat turns with zlib.")
+            _codec = (zlib.compress, zlib.decompress)
+    return _codec
+
+class BoundedChatMessageHistory(BaseChatMessageHistory):
+    """
+    Chat history that keeps at most max_messages messages and max_bytes of
+    message text, dropping the oldest turns first.
+
+    Turns are not kept as LangChain messages: each is a role byte and an end
+    offset into one UTF-8 byte arena per session. With hot_messages set,
+    turns older than the newest hot_messages are packed into compressed
+    blocks of COLD_BLOCK_SIZE. Messages are built only when read, and prompt
+    assembly reads just the turns that fit (see prompt_builder.fit_history).
+    The history also carries the running summary of turns that fell out of
+    the prompt window.
+    """
+
+    def __init__(self, max_messages: int = 100, max_bytes: int = 256 * 1024, hot_messages: int | None = None):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.hot_messages = hot_messages
+        self.summary = ""
+        self.summary_upto = 0
+        self._reset()
+
+    def _reset(self):
+        self._roles = bytearray()
+        self._ends = array("I")
+        self._arena = bytearray()
+        self._head = 0  # first live turn in the arena
+        self._cold: list[tuple[bytes, bytes, array]] = []  # (compressed text, roles, ends) per block
+        self._cold_skip = 0  # turns trimmed from the first cold block
+        self._cold_cache: tuple[bytes, bytes] | None = None
+        self._bytes = 0
+        self._dropped = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    @property
+    def resident_bytes(self) -> int:
+        """Bytes held by the turn buffers, after compression."""
+        cold = sum(len(text) + len(roles) + ends.itemsize * len(ends) for text, roles, ends in self._cold)
+        return len(self._arena) + len(self._roles) + self._ends.itemsize * len(self._ends) + cold
+
+    @property
+    def dropped(self) -> int:
+        """Number of messages trimmed from the front since the history was created."""
+        return self._dropped
+
+    def __len__(self) -> int:
+        return len(self._cold) * COLD_BLOCK_SIZE - self._cold_skip + len(self._roles) - self._head
+
+    def turn(self, index: int) -> tuple[str, str]:
+        """(type, content) of the index-th message, without building a message object."""
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        position = index + self._cold_skip
+        block = position // COLD_BLOCK_SIZE
+        if block < len(self._cold):
+            text, roles, ends = self._cold[block]
+            offset = position % COLD_BLOCK_SIZE
+            if self._cold_cache is None or self._cold_cache[0] is not text:
+                self._cold_cache = (text, _cold_codec()[1](text))
+            start = ends[offset - 1] if offset else 0
+            return _ROLE_TYPES[roles[offset]], self._cold_cache[1][start:ends[offset]].decode("utf-8")
+        i = position - len(self._cold) * COLD_BLOCK_SIZE + self._head
+        start = self._ends[i - 1] if i else 0
+        return _ROLE_TYPES[self._roles[i]], self._arena[start:self._ends[i]].decode("utf-8")
+
+    def message_range(self, start: int, stop: int | None = None) -> list:
+        """Builds LangChain messages for turns start..stop only."""
+        stop = len(self) if stop is None else stop
+        return [_message(*self.turn(i)) for i in range(start, stop)]
+
+    @property
+    def messages(self) -> list:
+        return self.message_range(0)
+
+    async def aget_messages(self) -> list:
+        await self.aload()
+        return self.messages
+
+    async def aload(self) -> None:
+        """Brings the turns up to date with the backing store; in-process histories always are."""
+
+    def add_message(self, message) -> None:
+        code = _ROLE_CODES.get(message.type)
+        if code is None:
+            raise ValueError(f"Unsupported message type '{message.type}' in chat history.")
+        data = str(message.content).encode("utf-8")
+        self._arena += data
+        self._ends.append(len(self._arena))
+        self._roles.append(code)
+        self._bytes += len(data)
+        while len(self) > 1 and (len(self) > self.max_messages or self._bytes > self.max_bytes):
+            self._drop_oldest()
+        if self.hot_messages is not None and len(self._roles) - self._head >= self.hot_messages + COLD_BLOCK_SIZE:
+            self._freeze()
+        elif self._head >= COLD_BLOCK_SIZE and self._head * 2 >= len(self._roles):
+            self._compact()
+
+    async def aadd_messages(self, messages) -> None:
+        self.add_messages(messages)
+
+    def clear(self) -> None:
+        self._reset()
+        self.summary, self.summary_upto = "", 0
+
+    async def aclear(self) -> None:
+        self.clear()
+
+    def _drop_oldest(self):
+        if self._cold:
+            _, _, ends = self._cold[0]
+            offset = self._cold_skip
+            self._bytes -= ends[offset] - (ends[offset - 1] if offset else 0)
+            self._cold_skip += 1
+            if self._cold_skip == COLD_BLOCK_SIZE:
+                self._cold.pop(0)
+                self._cold_skip = 0
+        else:
+            i = self._head
+            self._bytes -= self._ends[i] - (self._ends[i - 1] if i else 0)
+            self._head += 1
+        self._dropped += 1
+
+    def _freeze(self):
+        # Moves the oldest hot turns into a compressed block
+        head, stop = self._head, self._head + COLD_BLOCK_SIZE
+        base = self._ends[head - 1] if head else 0
+        ends = array("I", (end - base for end in self._ends[head:stop]))
+        text = _cold_codec()[0](bytes(self._arena[base:self._ends[stop - 1]]))
+        self._cold.append((text, bytes(self._roles[head:stop]), ends))
+        self._head = stop
+        self._compact()
+
+    def _compact(self):
+        # Releases the arena space of trimmed or frozen turns
+        if not self._head:
+            return
+        # Slicing copies into right-sized buffers; deleting in place would keep the capacity
+        base = self._ends[self._head - 1]
+        self._arena = self._arena[base:]
+        self._ends = array("I", (end - base for end in self._ends[self._head:]))
+        self._roles = self._roles[self._head:]
+        self._head = 0
+
+def _message(message_type: str, content: str):
+    return _MESSAGE_CLASSES[message_type](content=content)
+
+_MESSAGE_CLASSES = {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}
+
+# --- MongoDB persistence ---
+MESSAGES_COLLECTION = "chat_messages"
+ERROR_CONTEXT_COLLECTION = "error_contexts"
+
+def _collection(name: str):
+    return db_client.get_database()[name]
+
+_history_writer = BatchWriter(
+    lambda: _collection(MESSAGES_COLLECTION),
+    flush_interval=settings.history_flush_interval_seconds,
+    max_batch=settings.history_flush_max_batch,
+    max_pending=settings.history_max_pending_writes,
+)
+
+def _use_mongo() -> bool:
+    return settings.session_backend == "mongo"
+
+class MongoChatMessageHistory(BoundedChatMessageHistory):
+    """
+    Hot in-process cache over the chat_messages collection.
+    The last max_messages turns are loaded on the first async read, and new
+    messages are queued on the write-behind writer instead of written inline.
+    Concurrent first reads share one load.
+    """
+    def __init__(self, session_id: str, **limits):
+        super().__init__(**limits)
+        self.session_id = session_id
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    async def aload(self) -> None:
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if not self._loaded:
+                await self._load()
+
+    async def aadd_messages(self, messages) -> None:
+        await self.aload()
+        self.add_messages(messages)
+
+    def add_message(self, message) -> None:
+        super().add_message(message)
+        _history_writer.add({
+            "session_id": self.session_id,
+            "ts": time.time_ns(),
+            "type": message.type,
+            "content": message.content,
+        })
+
+    def clear(self) -> None:
+        super().clear()
+        self._loaded = True
+        _history_writer.discard(lambda doc: doc["session_id"] == self.session_id)
+
+    async def aclear(self) -> None:
+        self.clear()
+        await _collection(MESSAGES_COLLECTION).delete_many({"session_id": self.session_id})
+
+    async def _load(self):
+        # Capped projection: only the newest turns, served by the (session_id, ts) index
+        cursor = (
+            _collection(MESSAGES_COLLECTION)
+            .find({"session_id": self.session_id}, projection={"_id": 0, "type": 1, "content": 1})
+            .sort("ts", -1)
+            .limit(self.max_messages)
+        )
+        docs = await cursor.to_list(length=self.max_messages)
+        if self._loaded:
+            # Cleared while the query ran
+            return
+        stored = messages_from_dict([
+            {"type": doc["type"], "data": {"content": doc["content"]}} for doc in reversed(docs)
+        ])
+        pending = self.messages
+        self._reset()
+        for message in stored + pending:
+            BoundedChatMessageHistory.add_message(self, message)
+        self._loaded = True
+
+# --- Redis persistence ---
+def _use_redis() -> bool:
+    return settings.session_backend == "redis"
+
+class RedisChatMessageHistory(BoundedChatMessageHistory):
+    """
+    Chat history shared by every worker through Redis.
+    Each session is a capped list of JSON messages plus a counter of all
+    messages ever added, so `dropped` (and with it the summary window) agrees
+    across workers. Reads reload the list, since another worker may have
+    added to it, and writes go through in one transaction. Both keys expire
+    after session_ttl_seconds of inactivity.
+    """
+    def __init__(self, session_id: str, **limits):
+        super().__init__(**limits)
+        self.session_id = session_id
+        self._pending = []
+
+    @property
+    def _keys(self) -> tuple[str, str]:
+        return f"session:{self.session_id}:messages", f"session:{self.session_id}:total"
+
+    async def aload(self) -> None:
+        await self._flush()
+        messages_key, total_key = self._keys
+        async with redis_client.get_client().pipeline(transaction=True) as pipe:
+            stored, total = await pipe.lrange(messages_key, 0, -1).get(total_key).execute()
+        self._reset()
+        self._dropped = max(int(total or 0) - len(stored), 0)
+        for message in messages_from_dict([json.loads(raw) for raw in stored]):
+            BoundedChatMessageHistory.add_message(self, message)
+
+    async def aadd_messages(self, messages) -> None:
+        self._pending.extend(messages)
+        await self._flush()
+        for message in messages:
+            BoundedChatMessageHistory.add_message(self, message)
+
+    def add_message(self, message) -> None:
+        # Synchronous callers cannot reach Redis; the message is written on the next async call
+        super().add_message(message)
+        self._pending.append(message)
+
+    async def aclear(self) -> None:
+        self.clear()
+        self._pending.clear()
+        await redis_client.get_client().delete(*self._keys)
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        messages, self._pending = self._pending, []
+        messages_key, total_key = self._keys
+        ttl = int(settings.session_ttl_seconds)
+        async with redis_client.get_client().pipeline(transaction=True) as pipe:
+            pipe.rpush(messages_key, *(json.dumps(message_to_dict(message)) for message in messages))
+            pipe.ltrim(messages_key, -self.max_messages, -1)
+            pipe.incrby(total_key, len(messages))
+            pipe.expire(messages_key, ttl).expire(total_key, ttl)
+            await pipe.execute()
+
+async def start_session_persistence():
+    """Connects the shared session backend; for Mongo, creates indexes and starts the write-behind writer."""
+    if _use_redis():
+        # Fails startup if the redis package is missing rather than the first request
+        redis_client.get_client()
+        logger.info("Redis session persistence started.")
+    if not _use_mongo():
+        return
+    await _collection(MESSAGES_COLLECTION).create_index([("session_id", 1), ("ts", -1)])
+    await _collection(ERROR_CONTEXT_COLLECTION).create_index("session_id", unique=True)
+    await _collection(ERROR_CONTEXT_COLLECTION).create_index(
+        "created_at", expireAfterSeconds=int(settings.error_context_ttl_seconds)
+    )
+    _history_writer.start()
+    logger.info("MongoDB session persistence started.")
+
+async def stop_session_persistence():
+    """Flushes queued history writes before shutdown."""
+    if _use_mongo():
+        await _history_writer.stop()
+        logger.info("MongoDB session persistence stopped.")
+
+class SessionStore:
+    """
+    Mapping of session_id -> value with LRU and idle-TTL eviction.
+    Entries are kept in access order, so expired and least-recently-used
+    entries are always at the front and eviction is amortized O(1).
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl_seconds: float, on_evict: Callable[[str, Any], None] | None = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._on_evict = on_evict
+        self._entries: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self.evictions = 0
+
+    def __contains__(self, key: str) -> bool:
+        self._evict_expired()
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, default=None):
+        self._evict_expired()
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        self._entries[key] = (entry[0], time.monotonic())
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        self._evict_expired()
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+
+    def pop(self, key: str, default=None):
+        self._evict_expired()
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def items(self):
+        """Yields (key, value, idle_seconds) for every live entry."""
+        self._evict_expired()
+        now = time.monotonic()
+        for key, (value, last_access) in self._entries.items():
+            yield key, value, now - last_access
+
+    def _evict_expired(self):
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._entries:
+            key, (_, last_access) = next(iter(self._entries.items()))
+            if last_access > deadline:
+                break
+            self._evict(key)
+
+    def _evict(self, key: str):
+        value, _ = self._entries.pop(key)
+        self.evictions += 1
+        if self._on_evict:
+            self._on_evict(key, value)
+
+# Bounded in-memory stores that can be replaced by a database layer
+_error_context_store = SessionStore(
+    "error_context",
+    max_entries=settings.session_max_count,
+    ttl_seconds=settings.error_context_ttl_seconds,
+)
+_session_store = SessionStore(
+    "session_history",
+    max_entries=settings.session_max_count,
+    ttl_seconds=settings.session_ttl_seconds,
+    on_evict=lambda session_id, history: logger.debug("Evicted chat history for session '%s'.", session_id),
+)
 
 # --- Tutor Error Context ---
-def store_error_context(session_id: str, context: dict):
-    _error_context_store[session_id] = context
-    logger.info(f"Stored error context for session '{session_id}'.")
+async def store_error_context(session_id: str, context: dict):
+    if _use_redis():
+        await redis_client.get_client().set(
+            f"errorctx:{session_id}", json.dumps(context), ex=int(settings.error_context_ttl_seconds)
+        )
+        logger.debug("Stored error context for session '%s'.", session_id)
+        return
+    _error_context_store.set(session_id, context)
+    if _use_mongo():
+        await _collection(ERROR_CONTEXT_COLLECTION).replace_one(
+            {"session_id": session_id},
+            {"session_id": session_id, "context": context, "created_at": datetime.now(timezone.utc)},
+            upsert=True,
+        )
+    logger.debug("Stored error context for session '%s'.", session_id)
 
-def pop_error_context(session_id: str) -> dict | None:
-    context = _error_context_store.pop(session_id, None)
+async def pop_error_context(session_id: str) -> dict | None:
+    if _use_redis():
+        # Read and delete in one transaction, so only one worker consumes the context
+        key = f"errorctx:{session_id}"
+        async with redis_client.get_client().pipeline(transaction=True) as pipe:
+            raw, _ = await pipe.get(key).delete(key).execute()
+        context = json.loads(raw) if raw else None
+    else:
+        context = _error_context_store.pop(session_id, None)
+    if _use_mongo():
+        # Always delete the persisted copy; another worker may have stored it
+        doc = await _collection(ERROR_CONTEXT_COLLECTION).find_one_and_delete({"session_id": session_id})
+        if context is None and doc is not None:
+            context = doc["context"]
     if context:
-        logger.info(f"Retrieved and cleared error context for session '{session_id}'.")
+        logger.debug("Retrieved and cleared error context for session '%s'.", session_id)
     return context
 
 # --- Debugger Session History ---
-def get_session_history(session_id: str) -> ChatMessageHistory:
-    """Gets or creates a LangChain ChatMessageHistory object for a session."""
-    if session_id not in _session_store:
-        logger.info(f"Creating new chat history for session '{session_id}'.")
-        _session_store[session_id] = ChatMessageHistory()
-    return _session_store[session_id]
+def get_session_history(session_id: str) -> BoundedChatMessageHistory:
+    """Gets or creates the chat history of a session."""
+    history = _session_store.get(session_id)
+    if history is None:
+        logger.debug("Creating new chat history for session '%s'.", session_id)
+        limits = {
+            "max_messages": settings.session_max_messages,
+            "max_bytes": settings.session_max_bytes,
+            "hot_messages": settings.session_hot_messages,
+        }
+        if _use_redis():
+            history = RedisChatMessageHistory(session_id=session_id, **limits)
+        elif _use_mongo():
+            history = MongoChatMessageHistory(session_id=session_id, **limits)
+        else:
+            history = BoundedChatMessageHistory(**limits)
+        _session_store.set(session_id, history)
+    return history
 
 def get_active_sessions() -> dict:
-    """Returns information about active sessions."""
+    """Returns information about active sessions, including their memory footprint."""
     return {
-        session_id: {"message_count": len(history.messages)}
-        for session_id, history in _session_store.items()
+        session_id: {
+            "message_count": len(history),
+            "bytes": history.size_bytes,
+            "resident_bytes": history.resident_bytes,
+            "idle_seconds": round(idle, 1),
+        }
+        for session_id, history, idle in _session_store.items()
     }
 
-def clear_session_history(session_id: str):
-    """Clears the history for a specific session."""
-    if session_id in _session_store:
-        _session_store[session_id].clear()
-        logger.info(f"Cleared chat history for session '{session_id}'.")
+def get_session_stats() -> dict:
+    """Returns aggregate size and eviction counters for this worker's in-memory stores."""
+    sessions = list(_session_store.items())
+    return {
+        "sessions": len(sessions),
+        "max_sessions": _session_store.max_entries,
+        "messages": sum(len(history) for _, history, _ in sessions),
+        "bytes": sum(history.size_bytes for _, history, _ in sessions),
+        "resident_bytes": sum(history.resident_bytes for _, history, _ in sessions),
+        "evictions": _session_store.evictions,
+        "error_contexts": len(_error_context_store),
+        "pending_writes": _history_writer.pending,
+        "dropped_writes": _history_writer.dropped,
+    }
 
+# Roles used by the VS Code extension, as LangChain message types
+ROLE_TYPES = {"user": "human", "bot": "ai", "system": "system"}
+
+async def append_session_messages(session_id: str, messages: list[tuple[str, str]]):
+    """
+    Appends (role, content) pairs to a session's history in one write:
+    one queued batch for Mongo, one transaction for Redis.
+    """
+    history = get_session_history(session_id)
+    await history.aadd_messages(messages_from_dict([
+        {"type": ROLE_TYPES[role], "data": {"content": content}} for role, content in messages
+    ]))
+
+async def clear_session_history(session_id: str):
+    """Clears the history for a specific session."""
+    history = _session_store.get(session_id)
+    if history is not None:
+        await history.aclear()
+        logger.debug("Cleared chat history for session '%s'.", session_id)
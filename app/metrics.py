@@ -0,0 +1,229 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from app.config import settings
+from app.http_transport import get_upstream_stats
+from app.logger import logger
+from app.memory import get_session_stats
+from app.services.cache import response_cache
+from app.services.fix_index import fix_index
+from app.services.limiter import get_limiter_stats
+from app.services.single_flight import llm_flights
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# --- Request and stage latency ---
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency per route template, to the end of the response body.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+stage_duration = Histogram(
+    "request_stage_duration_seconds",
+    "Time spent in each stage of a request (memory, retrieval, prompt, llm, parse).",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# --- Upstream LLM calls ---
+llm_time_to_first_token = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from opening an upstream stream to its first chunk.",
+    ["provider", "model"],
+    buckets=LATENCY_BUCKETS,
+)
+llm_request_duration = Histogram(
+    "llm_request_duration_seconds",
+    "Total upstream call time, to the last chunk for streams.",
+    ["provider", "model", "kind", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+llm_tokens = Counter(
+    "llm_tokens",
+    "Estimated prompt (in) and completion (out) tokens of successful upstream calls.",
+    ["provider", "model", "direction"],
+)
+
+# --- Structured output ---
+structured_output = Counter(
+    "llm_structured_output",
+    "Tutor JSON answers by parse outcome: valid, repaired locally, retried upstream, or kept as text (fallback).",
+    ["outcome"],
+)
+
+event_loop_lag = Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop woke a periodic timer.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+def observe_request(method: str, route: str, status: int, duration: float):
+    http_request_duration.labels(method, route, str(status)).observe(duration)
+
+def observe_llm(provider: str, model: str, kind: str, outcome: str, duration: float, tokens_in: int = 0, tokens_out: int = 0):
+    llm_request_duration.labels(provider, model, kind, outcome).observe(duration)
+    if tokens_in:
+        llm_tokens.labels(provider, model, "in").inc(tokens_in)
+    if tokens_out:
+        llm_tokens.labels(provider, model, "out").inc(tokens_out)
+
+def observe_structured_output(outcome: str):
+    structured_output.labels(outcome).inc()
+
+def observe_first_token(provider: str, model: str, latency: float):
+    llm_time_to_first_token.labels(provider, model).observe(latency)
+
+# --- Store sizes and hit rates, read at scrape time ---
+class _StateCollector:
+    """Exposes the counters the in-process stores already keep, without double bookkeeping."""
+
+    def collect(self):
+        sessions = get_session_stats()
+        yield GaugeMetricFamily("session_store_sessions", "Sessions held in memory.", value=sessions["sessions"])
+        yield GaugeMetricFamily("session_store_messages", "Chat messages held in memory.", value=sessions["messages"])
+        yield GaugeMetricFamily("session_store_bytes", "Chat message text held in memory.", value=sessions["bytes"])
+        yield CounterMetricFamily("session_store_evictions", "Sessions evicted by LRU or idle TTL.", value=sessions["evictions"])
+        yield GaugeMetricFamily("session_history_pending_writes", "Chat messages queued for MongoDB.", value=sessions["pending_writes"])
+        yield CounterMetricFamily("session_history_dropped_writes", "Queued chat messages dropped while MongoDB was unreachable.", value=sessions["dropped_writes"])
+
+        cache = response_cache.stats()
+        lookups = CounterMetricFamily("response_cache_lookups", "Response cache lookups by result.", labels=["result"])
+        for result in ("hits", "similar_hits", "misses", "bypassed"):
+            lookups.add_metric([result], cache[result])
+        yield lookups
+        yield GaugeMetricFamily("response_cache_entries", "Entries in the response cache.", value=cache["entries"])
+        yield GaugeMetricFamily("response_cache_hit_ratio", "Exact and similar hits over all lookups since start.", value=cache["hit_rate"])
+
+        fixes = fix_index.stats()
+        fix_lookups = CounterMetricFamily("error_fix_index_lookups", "Error fix index lookups by result.", labels=["result"])
+        for result in ("hits", "misses"):
+            fix_lookups.add_metric([result], fixes[result])
+        yield fix_lookups
+
+        upstream = get_upstream_stats()["origins"]
+        connections = GaugeMetricFamily("upstream_http_connections", "Open upstream connections per origin, by state.", labels=["origin", "state"])
+        pool_size = GaugeMetricFamily("upstream_http_pool_max_connections", "Connection pool size per upstream origin.", labels=["origin"])
+        upstream_in_flight = GaugeMetricFamily("upstream_http_in_flight", "Upstream requests awaiting or streaming a response, per origin.", labels=["origin"])
+        upstream_requests = CounterMetricFamily("upstream_http_requests", "Upstream HTTP requests per origin.", labels=["origin"])
+        opened = CounterMetricFamily("upstream_http_connections_opened", "Upstream connections opened per origin; the rest of the requests reused one.", labels=["origin"])
+        for origin, stats in upstream.items():
+            pool_size.add_metric([origin], stats["max_connections"])
+            upstream_in_flight.add_metric([origin], stats["in_flight"])
+            upstream_requests.add_metric([origin], stats["requests"])
+            # Connection counts are None when the httpx pool cannot be inspected
+            if stats["connections"] is not None:
+                connections.add_metric([origin, "active"], stats["connections"] - stats["idle"])
+                connections.add_metric([origin, "idle"], stats["idle"])
+                opened.add_metric([origin], stats["connections_opened"])
+        yield from (connections, pool_size, upstream_in_flight, upstream_requests, opened)
+
+        flights = llm_flights.stats()
+        yield CounterMetricFamily("llm_coalesced_requests", "Requests served by an identical in-flight call.", value=flights["coalesced"])
+
+        limit = GaugeMetricFamily("llm_concurrency_limit", "Adaptive concurrency limit per provider.", labels=["provider"])
+        in_flight = GaugeMetricFamily("llm_in_flight", "Admitted requests per provider.", labels=["provider"])
+        shed = CounterMetricFamily("llm_shed_requests", "Requests shed by the concurrency limiter.", labels=["provider"])
+        for provider, stats in get_limiter_stats()["providers"].items():
+            limit.add_metric([provider], stats["limit"])
+            in_flight.add_metric([provider], stats["in_flight"])
+            shed.add_metric([provider], stats["shed"])
+        yield from (limit, in_flight, shed)
+
+_state_collector = _StateCollector()
+REGISTRY.register(_state_collector)
+
+def render_metrics() -> tuple[bytes, str]:
+    """
+    Returns the Prometheus text exposition and its content type.
+    With several workers, PROMETHEUS_MULTIPROC_DIR must name a directory
+    shared by them (emptied before they start); the histograms and counters
+    are then summed over all workers, while the store gauges are those of
+    the worker that served the scrape.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_state_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+# --- Event-loop lag ---
+_lag_monitor: asyncio.Task | None = None
+_last_lag: float | None = None
+
+async def _monitor_loop_lag(interval: float):
+    global _last_lag
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        _last_lag = max(0.0, loop.time() - started - interval)
+        event_loop_lag.observe(_last_lag)
+
+def last_loop_lag() -> float | None:
+    """The most recent event-loop lag sample in seconds, or None before the first."""
+    return _last_lag
+
+async def start_loop_monitor():
+    global _lag_monitor
+    if settings.metrics_enabled and _lag_monitor is None:
+        _lag_monitor = asyncio.create_task(_monitor_loop_lag(settings.loop_lag_interval_seconds))
+
+async def stop_loop_monitor():
+    global _lag_monitor
+    if _lag_monitor is not None:
+        _lag_monitor.cancel()
+        _lag_monitor = None
+
+# --- Tracing ---
+_tracer = None
+_tracer_provider = None
+
+def start_tracing():
+    """Exports spans to the OTLP collector at otel_endpoint when otel_enabled is set."""
+    global _tracer, _tracer_provider
+    if not settings.otel_enabled or _tracer is not None:
+        return
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("opentelemetry-sdk or the OTLP exporter is not installed; tracing is disabled.")
+        return
+    _tracer_provider = TracerProvider(resource=Resource.create({"service.name": settings.app_name}))
+    _tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=settings.otel_endpoint, insecure=True)))
+    _tracer = _tracer_provider.get_tracer("app")
+    logger.info(f"Exporting traces to {settings.otel_endpoint}")
+
+def stop_tracing():
+    """Flushes buffered spans to the collector."""
+    global _tracer, _tracer_provider
+    if _tracer_provider is not None:
+        _tracer_provider.shutdown()
+    _tracer = _tracer_provider = None
+
+def span(name: str):
+    """A tracing span that becomes the parent of spans opened inside it; a no-op when tracing is off."""
+    return _tracer.start_as_current_span(name) if _tracer is not None else nullcontext()
+
+@contextmanager
+def stage(name: str):
+    """
+    Times one stage of a request into request_stage_duration_seconds and,
+    with tracing on, a child span of the request. Do not hold it across a
+    `yield` in an async generator: the span context would leak to the consumer.
+    """
+    started = time.perf_counter()
+    try:
+        with span(name):
+            yield
+    finally:
+        stage_duration.labels(name).observe(time.perf_counter() - started)
@@ -0,0 +1,112 @@
+import json
+import math
+import time
+from fastapi.responses import JSONResponse
+from app.config import settings
+from app.logger import logger
+from app.metrics import observe_request, span
+from app.services.limiter import AdmissionRejected, admit, client_key
+
+class LimiterMiddleware:
+    """
+    ASGI middleware that rate-limits requests to the LLM endpoints under
+    the given path prefixes. Each request takes a token from its session's
+    bucket (429 when empty). The concurrency slots are taken later, per
+    upstream call, by the provider router from the limiter of the provider
+    it calls; the request's session is the key those calls queue under.
+    """
+
+    def __init__(self, app, prefixes: tuple[str, ...]):
+        self.app = app
+        self.prefixes = prefixes
+
+    async def __call__(self, scope, receive, send):
+        if not self._limited(scope) or not settings.rate_limit_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        body, receive = await _buffer_body(receive)
+        key = _client_key(scope, body)
+        try:
+            await admit(key)
+        except AdmissionRejected as e:
+            logger.info("Rate limited %s on %s", key, scope["path"])
+            await rejection_response(e)(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    def _limited(self, scope) -> bool:
+        return scope["type"] == "http" and scope["method"] == "POST" and scope["path"].startswith(self.prefixes)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records each request's latency per route template,
+    to the end of the response body so streams are timed in full, and with
+    tracing on opens the request span that stage spans nest under.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with span(f"{scope['method']} {scope['path']}") as request_span:
+            try:
+                await self.app(scope, receive, send_status)
+            finally:
+                # The router stores the matched route in the scope; label by
+                # its template so path parameters do not explode the series
+                route = getattr(scope.get("route"), "path", "unmatched")
+                observe_request(scope["method"], route, status, time.perf_counter() - started)
+                if request_span is not None:
+                    request_span.update_name(f"{scope['method']} {route}")
+                    request_span.set_attribute("http.status_code", status)
+
+async def _buffer_body(receive):
+    """Reads the request body and returns it with a receive() that replays it."""
+    chunks, more_body = [], True
+    while more_body:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    body = b"".join(chunks)
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Later calls wait for the disconnect message, as streams rely on it
+        return await receive()
+    return body, replay
+
+def _client_key(scope, body: bytes) -> str:
+    try:
+        session_id = json.loads(body).get("session_id")
+    except (ValueError, AttributeError):
+        session_id = None
+    client = scope.get("client")
+    return client_key(session_id, client[0] if client else None)
+
+def rejection_response(e: AdmissionRejected) -> JSONResponse:
+    """The 429 or 503 response for a rejected request, with its Retry-After."""
+    return JSONResponse(
+        status_code=e.status_code,
+        content={"detail": e.detail},
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+    )
@@ -1,24 +1,475 @@
-import google.generativeai as genai
+import asyncio
+import importlib.util
+import orjson
+import os
+import threading
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable
+import httpx
 from app.config import settings
+from app.http_transport import get_upstream_transport
 from app.logger import logger
+from app.services.batcher import BatchScheduler
+from app.services.limiter import get_provider_limiter
 
-genai.configure(api_key=settings.GOOGLE_API_KEY)
+if TYPE_CHECKING:
+    import google.generativeai as genai
+    from langchain_core.runnables import RunnableLambda
+
+FALLBACK_MODEL = "gemini-1.5-flash"
+
+# The Gemini SDK takes most of a second to import; it is loaded on first use
+_genai = None
+
+def _gemini_sdk():
+    """Imports and configures google.generativeai once."""
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        genai.configure(api_key=settings.google_api_key)
+        _genai = genai
+    return _genai
+
+# --- Gemini model registry ---
+class ModelRegistry:
+    """
+    Process-wide cache of Gemini model objects.
+    active_model is the preferred debugger model; failover between models is
+    handled by the provider router (app/services/provider_router.py).
+
+    The registry used to build a debugger chain per (model, mode) as well,
+    and remember a failed Pro model for model_fallback_ttl_seconds. Since
+    requests are routed, the chain no longer depends on the model: there is
+    one per mode, built once in app/services/debugger.py, and the router's
+    circuit breaker (open for model_fallback_ttl_seconds) takes the place of
+    the remembered fallback.
+    """
+
+    def __init__(self, default_model: str):
+        self.active_model = default_model
+        self._models: dict[str, "genai.GenerativeModel"] = {}
+
+    def get_model(self, model: str | None = None) -> "genai.GenerativeModel":
+        model_name = model or self.active_model
+        if model_name not in self._models:
+            logger.info(f"Loading Gemini model: {model_name}")
+            self._models[model_name] = _gemini_sdk().GenerativeModel(model_name)
+        return self._models[model_name]
+
+    def swap_model(self, model_name: str):
+        """Makes model_name the active model and reloads it on next use."""
+        self._models.pop(model_name, None)
+        self.active_model = model_name
+        logger.info(f"Active Gemini model switched to {model_name}")
+
+    def status(self) -> dict:
+        return {
+            "active_model": self.active_model,
+            "fallback_model": FALLBACK_MODEL,
+            "loaded_models": sorted(self._models),
+        }
+
+model_registry = ModelRegistry(default_model=settings.default_model)
 
 def get_gemini_model(model: str = None):
+    """Returns a cached Gemini model; defaults to the active model."""
+    return model_registry.get_model(model)
+
+def as_runnable(stream: Callable[..., AsyncIterator[str]]) -> "RunnableLambda":
+    """
+    Wraps a prompt -> text stream function (such as ProviderRouter.stream) so
+    it can be piped after a LangChain prompt. ainvoke() aggregates the chunks.
+    The last message (the user's question) is passed on as the route_hint.
+    """
+    from langchain_core.messages import AIMessageChunk
+    from langchain_core.runnables import RunnableLambda
+
+    async def _generate(prompt_value) -> AsyncIterator[AIMessageChunk]:
+        question = str(prompt_value.to_messages()[-1].content)
+        async for text in stream(prompt_value.to_string(), route_hint=question):
+            yield AIMessageChunk(content=text)
+    return RunnableLambda(_generate)
+
+# --- Local CPU inference ---
+_prompt_prefixes: list[str] = []
+
+def register_prompt_prefix(prefix: str):
+    """Registers a static prompt prefix whose KV cache the local model keeps warm."""
+    if prefix and prefix not in _prompt_prefixes:
+        _prompt_prefixes.append(prefix)
+
+class LocalModel:
+    """
+    A GGUF model run on CPU with llama-cpp-python, loaded once per process.
+    Weights are memory-mapped, so workers on one host share them through the
+    page cache. The KV cache of each registered prompt prefix is computed once
+    and restored before every request that starts with it, so only the
+    request-specific tail is evaluated. Generation runs one request at a time
+    in a worker thread.
+    """
+
+    def __init__(self, model_path: str, n_ctx: int, n_threads: int | None):
+        from llama_cpp import Llama
+        self.name = os.path.splitext(os.path.basename(model_path))[0]
+        self._llama = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, use_mmap=True, verbose=False)
+        self._lock = threading.Lock()
+        self._prefix_states: dict[str, Any] = {}
+        self._json_grammar = None
+        self.prefix_hits = 0
+
+    async def stream(self, prompt: str, max_tokens: int, json_mode: bool = False) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def generate():
+            try:
+                with self._lock:
+                    self._restore_prefix(prompt)
+                    for chunk in self._llama.create_completion(
+                        prompt, max_tokens=max_tokens, stream=True, grammar=self._grammar() if json_mode else None
+                    ):
+                        if stop.is_set():
+                            break
+                        loop.call_soon_threadsafe(queue.put_nowait, chunk["choices"][0]["text"])
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        loop.run_in_executor(None, generate)
+        try:
+            while (item := await queue.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # The worker thread stops at its next token
+            stop.set()
+
+    def warm_prefixes(self):
+        """Computes the KV state of every registered prefix ahead of the first request."""
+        with self._lock:
+            for prefix in _prompt_prefixes:
+                if prefix not in self._prefix_states:
+                    self._prefix_state(prefix)
+
+    def _restore_prefix(self, prompt: str):
+        prefix = max((p for p in _prompt_prefixes if prompt.startswith(p)), key=len, default=None)
+        if prefix is None:
+            return
+        state = self._prefix_states.get(prefix)
+        if state is None:
+            state = self._prefix_state(prefix)
+        else:
+            self.prefix_hits += 1
+        # create_completion reuses the restored tokens as a matching prefix
+        self._llama.load_state(state)
+
+    def _prefix_state(self, prefix: str):
+        self._llama.reset()
+        self._llama.eval(self._llama.tokenize(prefix.encode("utf-8")))
+        self._prefix_states[prefix] = self._llama.save_state()
+        return self._prefix_states[prefix]
+
+    def _grammar(self):
+        if self._json_grammar is None:
+            from llama_cpp import LlamaGrammar
+            from llama_cpp.llama_grammar import JSON_GBNF
+            self._json_grammar = LlamaGrammar.from_string(JSON_GBNF, verbose=False)
+        return self._json_grammar
+
+_local_model: LocalModel | None = None
+_local_model_lock = asyncio.Lock()
+
+async def get_local_model() -> LocalModel:
+    """Returns the process-wide local model, loading it in a thread on first use."""
+    global _local_model
+    async with _local_model_lock:
+        if _local_model is None:
+            logger.info(f"Loading local model: {settings.local_model_path}")
+            _local_model = await asyncio.to_thread(
+                LocalModel, settings.local_model_path, settings.local_n_ctx, settings.local_n_threads
+            )
+    return _local_model
+
+# --- Together AI (Tutor) ---
+class TogetherAIClient:
+    """
+    Async client for the Together AI chat completions API.
+    Sends over the shared upstream transport's pooled connections and caps
+    the number of in-flight upstream requests.
+    """
+
+    def __init__(self, api_key: str, base_url: str, timeout: float, max_concurrency: int, transport: httpx.AsyncBaseTransport):
+        self._timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=httpx.Timeout(timeout),
+            transport=transport,
+        )
+
+    async def chat_completion(self, model: str, messages: list[dict], timeout: float | None = None, **params) -> str:
+        """Sends a chat completion request and returns the first choice's content."""
+        payload = {"model": model, "messages": messages, **params}
+        async with self._semaphore:
+            response = await self._http.post(
+                "/chat/completions",
+                json=payload,
+                timeout=timeout or self._timeout,
+            )
+        _check_status(response)
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def stream_chat_completion(self, model: str, messages: list[dict], **params) -> AsyncIterator[str]:
+        """
+        Streams a chat completion, yielding content deltas as they arrive.
+        Closing the generator early closes the upstream connection.
+        """
+        payload = {"model": model, "messages": messages, "stream": True, **params}
+        async with self._semaphore:
+            async with self._http.stream("POST", "/chat/completions", json=payload) as response:
+                _check_status(response)
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        # Read on to the end of the body, so the connection goes back to the pool
+                        continue
+                    delta = orjson.loads(data)["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+
+    async def aclose(self):
+        await self._http.aclose()
+
+def _check_status(response: httpx.Response, provider: str = "together"):
+    if response.status_code == 429:
+        get_provider_limiter(provider).record_overload()
+    response.raise_for_status()
+
+_together_client: TogetherAIClient | None = None
+
+def get_together_ai_client() -> TogetherAIClient | None:
+    """Returns the process-wide Together AI client, or None if no API key is set."""
+    global _together_client
+    if not settings.together_api_key:
+        return None
+    if _together_client is None:
+        logger.info(f"Initializing Together AI client for {settings.together_base_url}")
+        _together_client = TogetherAIClient(
+            api_key=settings.together_api_key,
+            base_url=settings.together_base_url,
+            timeout=settings.llm_timeout_seconds,
+            max_concurrency=settings.llm_max_concurrency,
+            transport=get_upstream_transport(),
+        )
+    return _together_client
+
+async def close_together_ai_client():
+    global _together_client
+    if _together_client is not None:
+        await _together_client.aclose()
+        _together_client = None
+        logger.info("Together AI client closed.")
+
+# --- Batch-capable model server ---
+class BatchCompletionsClient:
     """
-    Loads Gemini model with fallback support.
-    If Pro model fails, switches to Flash variant automatically.
+    Async client for an OpenAI-compatible /completions endpoint that accepts
+    a list of prompts per request (vLLM, TGI and most local model servers).
     """
-    model_name = model or settings.DEFAULT_MODEL
-    try:
-        logger.info(f"Loading Gemini model: {model_name}")
-        return genai.GenerativeModel(model_name)
-    except Exception as e:
-        logger.warning(f"Primary model failed ({model_name}): {e}")
+
+    def __init__(self, base_url: str, api_key: str | None, timeout: float, transport: httpx.AsyncBaseTransport):
+        self._timeout = timeout
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"} if api_key else {},
+            timeout=httpx.Timeout(timeout),
+            transport=transport,
+        )
+
+    async def completions(self, model: str, prompts: list[str], timeout: float | None = None, **params) -> list[str]:
+        """Completes all prompts in one request; results are in prompt order."""
+        response = await self._http.post(
+            "/completions",
+            json={"model": model, "prompt": prompts, **params},
+            timeout=timeout or self._timeout,
+        )
+        _check_status(response, "batch")
+        choices = sorted(response.json()["choices"], key=lambda choice: choice["index"])
+        return [choice["text"] for choice in choices]
+
+    async def stream_completion(self, model: str, prompt: str, **params) -> AsyncIterator[str]:
+        payload = {"model": model, "prompt": prompt, "stream": True, **params}
+        async with self._http.stream("POST", "/completions", json=payload) as response:
+            _check_status(response, "batch")
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    continue
+                text = orjson.loads(data)["choices"][0].get("text")
+                if text:
+                    yield text
+
+    async def aclose(self):
+        await self._http.aclose()
+
+_batch_client: BatchCompletionsClient | None = None
+
+def get_batch_client() -> BatchCompletionsClient:
+    global _batch_client
+    if _batch_client is None:
+        logger.info(f"Initializing batch completions client for {settings.batch_base_url}")
+        _batch_client = BatchCompletionsClient(
+            base_url=settings.batch_base_url,
+            api_key=settings.batch_api_key,
+            timeout=settings.llm_timeout_seconds,
+            transport=get_upstream_transport(),
+        )
+    return _batch_client
+
+async def close_batch_client():
+    global _batch_client
+    if _batch_client is not None:
+        await _batch_client.aclose()
+        _batch_client = None
+        logger.info("Batch completions client closed.")
+
+# --- Providers used by the provider router ---
+class GeminiProvider:
+    """
+    Gemini does not go through the upstream HTTP transport: google.generativeai
+    creates one async client per process, and every GenerativeModel sends
+    through it, so all Gemini calls share its single gRPC (HTTP/2) channel.
+    The provider holds that client to report the channel's state.
+    """
+
+    name = "gemini"
+    local = False
+
+    def __init__(self):
+        self._client = None
+        self.requests = 0
+
+    @property
+    def available(self) -> bool:
+        return bool(settings.google_api_key)
+
+    async def stream(self, model: str, prompt: str, json_mode: bool = False) -> AsyncIterator[str]:
+        generation_config = {"response_mime_type": "application/json"} if json_mode else None
+        if _genai is None:
+            # Keep the first request from blocking the event loop on the SDK import
+            await asyncio.to_thread(_gemini_sdk)
+        if self._client is None:
+            from google.generativeai import client
+            self._client = client.get_default_generative_async_client()
+        self.requests += 1
         try:
-            fallback_model = "gemini-1.5-flash"
-            logger.info(f"Switching to fallback model: {fallback_model}")
-            return genai.GenerativeModel(fallback_model)
-        except Exception as e2:
-            logger.error(f"Both Gemini models failed: {e2}")
-            raise RuntimeError("Gemini model initialization failed.")
+            response = await model_registry.get_model(model).generate_content_async(
+                prompt, stream=True, generation_config=generation_config
+            )
+            async for chunk in response:
+                yield chunk.text
+        except Exception as e:
+            # google.api_core's ResourceExhausted carries the HTTP status
+            if getattr(e, "code", None) == 429:
+                get_provider_limiter(self.name).record_overload()
+            raise
+
+    async def complete(self, model: str, prompt: str, json_mode: bool = False) -> str:
+        return "".join([chunk async for chunk in self.stream(model, prompt, json_mode)])
+
+    def stats(self) -> dict:
+        """State of the shared channel (None before the first call) and the calls sent over it."""
+        state = self._client.transport.grpc_channel.get_state().name if self._client is not None else None
+        return {"channel": state, "requests": self.requests}
+
+class TogetherProvider:
+    name = "together"
+    local = False
+
+    @property
+    def available(self) -> bool:
+        return bool(settings.together_api_key)
+
+    async def stream(self, model: str, prompt: str, json_mode: bool = False) -> AsyncIterator[str]:
+        async for token in get_together_ai_client().stream_chat_completion(
+            model=model, messages=[{"role": "user", "content": prompt}], **self._params(json_mode)
+        ):
+            yield token
+
+    async def complete(self, model: str, prompt: str, json_mode: bool = False) -> str:
+        return await get_together_ai_client().chat_completion(
+            model=model, messages=[{"role": "user", "content": prompt}], **self._params(json_mode)
+        )
+
+    @staticmethod
+    def _params(json_mode: bool) -> dict:
+        return {"response_format": {"type": "json_object"}} if json_mode else {}
+
+class BatchServerProvider:
+    """
+    Completions are micro-batched per (model, json_mode) and sent to the
+    batch server together; streams are sent one by one.
+    """
+
+    name = "batch"
+    local = False
+
+    def __init__(self):
+        self.schedulers: dict[tuple[str, bool], BatchScheduler] = {}
+
+    @property
+    def available(self) -> bool:
+        return bool(settings.batch_base_url)
+
+    async def complete(self, model: str, prompt: str, json_mode: bool = False) -> str:
+        scheduler = self.schedulers.get((model, json_mode))
+        if scheduler is None:
+            params = self._params(json_mode)
+
+            async def send_batch(prompts: list[str], timeout: float) -> list[str]:
+                return await get_batch_client().completions(model, prompts, timeout=timeout, **params)
+
+            scheduler = self.schedulers[(model, json_mode)] = BatchScheduler(
+                f"batch:{model}", send_batch, settings.batch_window_ms, settings.batch_max_size,
+                settings.batch_max_concurrency,
+            )
+        return await scheduler.submit(prompt, settings.llm_timeout_seconds)
+
+    async def stream(self, model: str, prompt: str, json_mode: bool = False) -> AsyncIterator[str]:
+        async for text in get_batch_client().stream_completion(model, prompt, **self._params(json_mode)):
+            yield text
+
+    @staticmethod
+    def _params(json_mode: bool) -> dict:
+        return {"response_format": {"type": "json_object"}} if json_mode else {}
+
+    def stats(self) -> dict:
+        return {scheduler.name: scheduler.stats() for scheduler in self.schedulers.values()}
+
+class LocalProvider:
+    name = "local"
+    local = True
+
+    @property
+    def available(self) -> bool:
+        return bool(settings.local_model_path) and importlib.util.find_spec("llama_cpp") is not None
+
+    async def stream(self, model: str, prompt: str, json_mode: bool = False) -> AsyncIterator[str]:
+        local_model = await get_local_model()
+        async for text in local_model.stream(prompt, settings.local_max_tokens, json_mode):
+            yield text
+
+    async def complete(self, model: str, prompt: str, json_mode: bool = False) -> str:
+        return "".join([chunk async for chunk in self.stream(model, prompt, json_mode)])
+
+PROVIDERS = {
+    provider.name: provider
+    for provider in (GeminiProvider(), TogetherProvider(), BatchServerProvider(), LocalProvider())
+}
@@ -1,23 +1,118 @@
-from fastapi import APIRouter
+import asyncio
+from typing import Any, Literal
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from app import lifecycle
 from app.config import settings
-from app.logger import logger
+from app.http_transport import get_upstream_stats
+from app.logger import logger, tail_logs
+from app.memory import get_session_stats
+from app.model_loader import PROVIDERS, model_registry
+from app.services.cache import response_cache
+from app.services.fix_index import error_signature, fingerprint, fix_index
+from app.services.limiter import get_limiter_stats
+from app.services.provider_router import debugger_router, tutor_router
+from app.services.single_flight import llm_flights
 
 router = APIRouter()
 
 @router.get("/health", summary="Health Check")
 async def health_check():
     return {
-        "status": "ok",
+        **await lifecycle.health_report(),
         "service_name": settings.app_name,
         "version": "2.0.0"
     }
 
+@router.get("/health/ready", summary="Readiness Probe")
+async def readiness_check():
+    # 503 while starting, draining, or when a shared store is unreachable
+    ready, report = await lifecycle.readiness()
+    return JSONResponse(status_code=200 if ready else 503, content=report)
+
+@router.get("/health/live", summary="Liveness Probe")
+async def liveness_check():
+    return lifecycle.liveness()
+
 @router.get("/logs", summary="Get Recent Application Logs")
-async def get_logs():
-    try:
-        with open(settings.log_file, 'r') as f:
-            lines = f.readlines()
-            return {"logs": lines[-100:]} # Return last 100 lines
-    except FileNotFoundError:
-        return {"logs": ["Log file not found."]}
+async def get_logs(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = Query(None, description="next_cursor of the previous page, for older entries"),
+    level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] | None = Query(None, description="Minimum level"),
+    contains: str | None = Query(None, description="Case-insensitive substring of the message"),
+    logger_name: str | None = Query(None, alias="logger", description="Logger name prefix"),
+    since: str | None = Query(None, description="ISO 8601 UTC time of the oldest entry to return"),
+):
+    # Reads backwards from the end of the file in a worker thread
+    return await asyncio.to_thread(tail_logs, limit, cursor, level, contains, logger_name, since)
+
+
+class ModelSwapInput(BaseModel):
+    model: str
+
+def _model_status() -> dict:
+    return {
+        **model_registry.status(),
+        "routing": {"tutor": tutor_router.stats(), "debugger": debugger_router.stats()},
+        "batching": PROVIDERS["batch"].stats(),
+        "upstream_http": {**get_upstream_stats(), "gemini": PROVIDERS["gemini"].stats()},
+    }
+
+@router.get("/models", summary="Get Loaded Models and Provider Routing State")
+async def get_models():
+    return _model_status()
+
+@router.post("/models", summary="Hot-swap the Active Debugger Model")
+async def swap_model(payload: ModelSwapInput):
+    model_registry.swap_model(payload.model)
+    debugger_router.prefer("gemini", payload.model)
+    return _model_status()
+
+@router.get("/sessions", summary="Get Session Store Statistics")
+async def get_sessions():
+    return get_session_stats()
+
+@router.get("/cache", summary="Get Response Cache Statistics")
+async def get_cache_stats():
+    return response_cache.stats()
+
+@router.delete("/cache", summary="Clear the Response Cache")
+async def clear_cache():
+    await response_cache.aclear()
+    return response_cache.stats()
+
+@router.get("/fixes", summary="List Indexed Error Fixes, Most Used First")
+async def list_fixes(limit: int = Query(50, ge=1, le=500), skip: int = Query(0, ge=0)):
+    return {**fix_index.stats(), "fixes": await fix_index.entries(limit, skip)}
+
+@router.post("/fixes/lookup", summary="Fingerprint an Error Context and Question and Show the Indexed Fix")
+async def lookup_fix(context: dict[str, Any], question: str = Query(..., min_length=1)):
+    signature = error_signature(context, question)
+    key = fingerprint(signature)
+    return {"fingerprint": key, "signature": signature, "fix": await fix_index.get(key)}
+
+@router.get("/fixes/{key}", summary="Get an Indexed Error Fix")
+async def get_fix(key: str):
+    entry = await fix_index.get(key)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"No fix indexed for '{key}'.")
+    return entry
+
+@router.delete("/fixes/{key}", summary="Invalidate an Indexed Error Fix")
+async def invalidate_fix(key: str):
+    if not await fix_index.invalidate(key):
+        raise HTTPException(status_code=404, detail=f"No fix indexed for '{key}'.")
+    return {"fingerprint": key, "invalidated": True}
+
+@router.delete("/fixes", summary="Invalidate All Indexed Error Fixes")
+async def clear_fixes():
+    return {"invalidated": await fix_index.clear()}
+
+@router.get("/inflight", summary="Get Request Coalescing Statistics")
+async def get_inflight_stats():
+    return llm_flights.stats()
 
+@router.get("/limits", summary="Get Rate Limit and Concurrency Limiter State")
+async def get_limits():
+    return get_limiter_stats()
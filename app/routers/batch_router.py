@@ -0,0 +1,60 @@
+from typing import Literal
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from app.config import settings
+from app.memory import append_session_messages
+from app.routers.session_router import SessionMessage
+from app.services.limiter import client_key
+from app.services.llm_service import query_batch, stream_batch
+from app.services.services import SSE_HEADERS
+
+router = APIRouter()
+
+class BatchQuery(BaseModel):
+    query: str
+    mode: Literal["tutor", "debugger"] = "tutor"
+    id: str | None = None
+    no_cache: bool = False
+    # Append the question and reply to the session history (the debugger always does)
+    record: bool = False
+
+class BatchInput(BaseModel):
+    session_id: str = "default"
+    # Appended to the session history, in order, before the queries run
+    messages: list[SessionMessage] = Field(default_factory=list, max_length=settings.chat_batch_max_messages)
+    queries: list[BatchQuery] = Field(default_factory=list, max_length=settings.chat_batch_max_queries)
+
+async def _prepare(payload: BatchInput) -> list[dict]:
+    items = [
+        {
+            "id": query.id or str(index),
+            "query": query.query,
+            "mode": query.mode,
+            "use_cache": not query.no_cache,
+            "record": query.record,
+        }
+        for index, query in enumerate(payload.queries)
+    ]
+    if len({item["id"] for item in items}) != len(items):
+        raise HTTPException(status_code=422, detail="Query ids must be unique within a batch.")
+    if payload.messages:
+        await append_session_messages(payload.session_id, [(m.role, m.content) for m in payload.messages])
+    return items
+
+@router.post("", summary="Run Several Queries and Message Appends in One Request")
+async def batch(payload: BatchInput, request: Request):
+    items = await _prepare(payload)
+    key = client_key(payload.session_id, request.client.host if request.client else None)
+    results = await query_batch(payload.session_id, items, key)
+    return {"session_id": payload.session_id, "appended": len(payload.messages), "results": results}
+
+@router.post("/stream", summary="Stream Several Queries in One Request")
+async def batch_stream(payload: BatchInput, request: Request):
+    items = await _prepare(payload)
+    key = client_key(payload.session_id, request.client.host if request.client else None)
+    return StreamingResponse(
+        stream_batch(payload.session_id, items, key, request),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
@@ -1,12 +1,24 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.services.llm_service import query_llm
+from app.services.llm_service import query_llm, stream_llm
+from app.services.services import SSE_HEADERS
 
-router = APIRouter(prefix="/debugger", tags=["Debugger"])
+router = APIRouter()
 
 class DebuggerInput(BaseModel):
     query: str
+    session_id: str = "default"
+    no_cache: bool = False
 
 @router.post("/chat")
 async def debug_chat(payload: DebuggerInput):
-    return await query_llm(payload.query, "debugger")
+    return await query_llm(payload.query, "debugger", payload.session_id, not payload.no_cache)
+
+@router.post("/chat/stream")
+async def debug_chat_stream(payload: DebuggerInput, request: Request):
+    return StreamingResponse(
+        stream_llm(payload.query, "debugger", payload.session_id, request),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
@@ -1,10 +1,26 @@
-from fastapi import APIRouter
+import time
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from app.services import rag
+from app.services.services import SSE_HEADERS, format_sse
 
 router = APIRouter()
 
 @router.get("/query", summary="Query the RAG knowledge base")
-async def query_documents(q: str):
-    results = await rag.query_rag(q)
-    return {"query": q, "results": results}
+async def query_documents(q: str, k: int = Query(5, ge=1, le=50)):
+    started = time.perf_counter()
+    results = await rag.query_rag(q, k)
+    took_ms = round((time.perf_counter() - started) * 1000, 2)
+    return {"query": q, "results": results, "took_ms": took_ms}
 
+@router.post("/ingest", summary="Incrementally re-index the RAG source documents")
+async def ingest_documents():
+    # Started before the response, so a concurrent request gets its 409 instead of a broken stream
+    events = rag.start_ingest()
+    if events is None:
+        raise HTTPException(status_code=409, detail="An ingestion is already running.")
+    return StreamingResponse(_ingest_stream(events), media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def _ingest_stream(events):
+    async for event in events:
+        yield format_sse("progress" if event["stage"] not in ("done", "error") else event["stage"], event)
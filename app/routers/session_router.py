@@ -0,0 +1,34 @@
+from typing import Any, Literal
+from fastapi import APIRouter
+from pydantic import BaseModel, Field
+from app.config import settings
+from app.memory import append_session_messages, clear_session_history, store_error_context
+from app.services.fix_index import error_signature
+
+router = APIRouter()
+
+class SessionMessage(BaseModel):
+    role: Literal["user", "bot", "system"]
+    content: str
+
+class SessionMessages(BaseModel):
+    messages: list[SessionMessage] = Field(min_length=1, max_length=settings.chat_batch_max_messages)
+
+@router.post("/{session_id}/messages", summary="Append Messages to a Session")
+async def append_messages(session_id: str, payload: SessionMessages | SessionMessage):
+    # One message or a list of them, written to the session store in one batch
+    messages = payload.messages if isinstance(payload, SessionMessages) else [payload]
+    await append_session_messages(session_id, [(message.role, message.content) for message in messages])
+    return {"session_id": session_id, "appended": len(messages)}
+
+@router.delete("/{session_id}/messages", summary="Clear a Session's History")
+async def clear_messages(session_id: str):
+    await clear_session_history(session_id)
+    return {"session_id": session_id, "cleared": True}
+
+@router.put("/{session_id}/error-context", summary="Set the Error for the Next Tutor Question")
+async def set_error_context(session_id: str, context: dict[str, Any]):
+    # Consumed by the session's next tutor question; recurring errors are answered from the fix index.
+    # The index keys on the error and the question, so only the normalized error is known here
+    await store_error_context(session_id, context)
+    return {"session_id": session_id, "error_signature": error_signature(context)}
@@ -1,12 +1,24 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.services.llm_service import query_llm
+from app.services.llm_service import query_llm, stream_llm
+from app.services.services import SSE_HEADERS
 
-router = APIRouter(prefix="/tutor", tags=["Tutor"])
+router = APIRouter()
 
 class TutorInput(BaseModel):
     query: str
+    session_id: str = "default"
+    no_cache: bool = False
 
 @router.post("/chat")
 async def tutor_chat(payload: TutorInput):
-    return await query_llm(payload.query, "tutor")
+    return await query_llm(payload.query, "tutor", payload.session_id, not payload.no_cache)
+
+@router.post("/chat/stream")
+async def tutor_chat_stream(payload: TutorInput, request: Request):
+    return StreamingResponse(
+        stream_llm(payload.query, "tutor", payload.session_id, request),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
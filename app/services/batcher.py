@@ -0,0 +1,139 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+from app.logger import logger
+
+class _Pending:
+    __slots__ = ("prompt", "future", "arrived", "deadline")
+
+    def __init__(self, prompt: str, future: asyncio.Future, deadline: float):
+        self.prompt = prompt
+        self.future = future
+        self.arrived = time.monotonic()
+        self.deadline = deadline
+
+class BatchScheduler:
+    """
+    Micro-batches independent prompts into one upstream call.
+
+    Requests are gathered for up to window_ms after the first one arrives,
+    or until max_size are waiting, then sent together with
+    send_batch(prompts, timeout) and the results are fanned back out in order.
+    At most max_concurrency batches are in flight; while they are, new
+    requests keep queueing, so batches grow with load. A batch is flushed
+    early when waiting longer would make one of its requests miss its
+    deadline, given the recent batch latency; requests already past their
+    deadline are failed instead of being sent. A caller that gives up
+    before dispatch is removed from the batch.
+    """
+
+    def __init__(self, name: str, send_batch: Callable[[list[str], float], Awaitable[list[str]]], window_ms: float, max_size: int, max_concurrency: int):
+        self.name = name
+        self._send_batch = send_batch
+        self._window = window_ms / 1000
+        self._max_size = max(1, max_size)
+        self._max_concurrency = max(1, max_concurrency)
+        self._queue: list[_Pending] = []
+        self._flush_at: float | None = None
+        self._flusher: asyncio.Task | None = None
+        self._batch_latency = 0.0
+        self._sending: set[asyncio.Task] = set()
+        self.batches = 0
+        self.requests = 0
+        self.expired = 0
+
+    async def submit(self, prompt: str, timeout: float) -> str:
+        item = _Pending(prompt, asyncio.get_running_loop().create_future(), time.monotonic() + timeout)
+        self._queue.append(item)
+        self.requests += 1
+        if len(self._queue) >= self._max_size and len(self._sending) < self._max_concurrency:
+            self._dispatch()
+        else:
+            self._schedule()
+        try:
+            return await item.future
+        except asyncio.CancelledError:
+            if item in self._queue:
+                self._queue.remove(item)
+            item.future.cancel()
+            raise
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": round((self.requests - self.expired) / self.batches, 2) if self.batches else 0.0,
+            "expired": self.expired,
+            "queued": len(self._queue),
+            "batch_latency_ms": round(self._batch_latency * 1000, 1),
+        }
+
+    def _schedule(self):
+        # With every slot busy, the next dispatch happens when a batch returns
+        if not self._queue or len(self._sending) >= self._max_concurrency:
+            return
+        flush_at = min(
+            self._queue[0].arrived + self._window,
+            min(item.deadline for item in self._queue) - self._batch_latency,
+        )
+        if self._flusher is not None and self._flush_at is not None and self._flush_at <= flush_at:
+            return
+        if self._flusher is not None:
+            self._flusher.cancel()
+        self._flush_at = flush_at
+        self._flusher = asyncio.create_task(self._flush_later(flush_at))
+
+    async def _flush_later(self, flush_at: float):
+        await asyncio.sleep(max(0.0, flush_at - time.monotonic()))
+        self._flusher = None
+        self._flush_at = None
+        self._dispatch()
+
+    def _dispatch(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+            self._flush_at = None
+        while self._queue and len(self._sending) < self._max_concurrency:
+            batch, self._queue = self._queue[:self._max_size], self._queue[self._max_size:]
+            now = time.monotonic()
+            live = []
+            for item in batch:
+                if item.future.done():
+                    continue
+                if item.deadline <= now:
+                    self.expired += 1
+                    item.future.set_exception(asyncio.TimeoutError(f"Deadline passed before the {self.name} batch was sent."))
+                else:
+                    live.append(item)
+            if live:
+                self.batches += 1
+                task = asyncio.create_task(self._send(live))
+                self._sending.add(task)
+                task.add_done_callback(self._sent)
+            # A partial batch left over waits for its own window
+            if len(self._queue) < self._max_size:
+                break
+        self._schedule()
+
+    def _sent(self, task: asyncio.Task):
+        self._sending.discard(task)
+        self._schedule()
+
+    async def _send(self, batch: list[_Pending]):
+        started = time.monotonic()
+        try:
+            results = await self._send_batch([item.prompt for item in batch], max(item.deadline for item in batch) - started)
+            if len(results) != len(batch):
+                raise ValueError(f"Batch returned {len(results)} results for {len(batch)} prompts.")
+        except Exception as e:
+            logger.warning(f"{self.name} batch of {len(batch)} failed: {e}")
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        finally:
+            self._batch_latency += 0.2 * (time.monotonic() - started - self._batch_latency)
+        for item, result in zip(batch, results):
+            if not item.future.done():
+                item.future.set_result(result)
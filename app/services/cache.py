@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import json
+import re
+import numpy as np
+from app.config import settings
+from app.logger import logger
+from app.database.redis_client import redis_client
+from app.memory import SessionStore
+from app.services.embeddings import get_embedder
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapses whitespace. Case is kept: code and error text are case-sensitive."""
+    return _WHITESPACE_RE.sub(" ", prompt).strip()
+
+class SimilarityIndex:
+    """
+    Fixed-capacity in-memory vector index searched by brute-force dot product.
+    Freed slots are reused, so the matrix never grows past max_entries rows.
+    """
+
+    def __init__(self, dim: int, capacity: int):
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._keys: list[str | None] = [None] * capacity
+        self._slots: dict[str, int] = {}
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def add(self, key: str, vector: np.ndarray):
+        if key in self._slots or not self._free:
+            return
+        slot = self._free.pop()
+        self._vectors[slot] = vector
+        self._keys[slot] = key
+        self._slots[key] = slot
+
+    def remove(self, key: str):
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self._vectors[slot] = 0.0
+            self._keys[slot] = None
+            self._free.append(slot)
+
+    def search(self, vector: np.ndarray) -> tuple[str | None, float]:
+        if not self._slots:
+            return None, 0.0
+        scores = self._vectors @ vector
+        slot = int(np.argmax(scores))
+        return self._keys[slot], float(scores[slot])
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM responses.
+    The exact tier is keyed by a hash of (mode, model, normalized prompt).
+    The optional similarity tier embeds similar_text (usually the bare user
+    question, without prompt boilerplate) and returns the closest cached entry
+    in the same (mode, model) namespace when its cosine similarity is at least
+    similarity_threshold. Lookups without similar_text only use the exact tier.
+    Both tiers share one LRU/TTL store, so evicting an entry removes its vector.
+
+    With the "redis" backend the exact tier lives in Redis and is shared by
+    every worker; use the async methods. The local store then only tracks
+    which keys this worker has vectors for, and a similar match whose entry
+    has expired or been cleared in Redis counts as a miss. An unreachable
+    Redis also counts as a miss rather than failing the request.
+
+    The async methods embed similar_text in a worker thread, off the event loop.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float | None = None, backend: str = "memory"):
+        self._entries = SessionStore("response_cache", max_entries, ttl_seconds, on_evict=self._on_evict)
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._shared = backend == "redis"
+        self._threshold = similarity_threshold
+        self._indexes: dict[tuple[str, str], SimilarityIndex] = {}
+        self._namespaces: dict[str, tuple[str, str]] = {}
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.errors = 0
+
+    @staticmethod
+    def make_key(mode: str, model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{mode}\0{model}\0{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    def get(self, mode: str, model: str, prompt: str, similar_text: str | None = None):
+        key = self.make_key(mode, model, prompt)
+        value = self._entries.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        index = self._indexes.get((mode, model))
+        if self._threshold is not None and similar_text and index is not None:
+            similar_key, score = index.search(self._embed(similar_text))
+            if similar_key is not None and score >= self._threshold:
+                value = self._entries.get(similar_key)
+                if value is not None:
+                    self.similar_hits += 1
+                    logger.debug("Similarity cache hit (%.3f) for %s/%s", score, mode, model)
+                    return value
+
+        self.misses += 1
+        return None
+
+    async def aget(self, mode: str, model: str, prompt: str, similar_text: str | None = None):
+        key = self.make_key(mode, model, prompt)
+        value = await self._fetch(key) if self._shared else self._entries.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        index = self._indexes.get((mode, model))
+        if self._threshold is not None and similar_text and index is not None:
+            vector = await asyncio.to_thread(self._embed, similar_text)
+            similar_key, score = index.search(vector)
+            if similar_key is not None and score >= self._threshold:
+                value = await self._fetch(similar_key) if self._shared else self._entries.get(similar_key)
+                if value is not None:
+                    self.similar_hits += 1
+                    logger.debug("Similarity cache hit (%.3f) for %s/%s", score, mode, model)
+                    return value
+                if self._shared:
+                    self._entries.pop(similar_key)
+                    self._on_evict(similar_key, None)
+
+        self.misses += 1
+        return None
+
+    async def aset(self, mode: str, model: str, prompt: str, value, similar_text: str | None = None):
+        key = self.make_key(mode, model, prompt)
+        if self._shared:
+            try:
+                await redis_client.get_client().set(f"respcache:{key}", json.dumps(value), ex=int(self._ttl_seconds))
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Response cache store unavailable, not caching: {e}")
+                return
+            # Locally only the key is tracked, for its vector
+            value = True
+        if self._threshold is not None and similar_text:
+            self._index(mode, model, key, await asyncio.to_thread(self._embed, similar_text), value)
+        else:
+            self._entries.set(key, value)
+
+    async def aclear(self):
+        self.clear()
+        if self._shared:
+            client = redis_client.get_client()
+            keys = [key async for key in client.scan_iter(match="respcache:*", count=500)]
+            for start in range(0, len(keys), 500):
+                await client.delete(*keys[start:start + 500])
+
+    def set(self, mode: str, model: str, prompt: str, value, similar_text: str | None = None):
+        key = self.make_key(mode, model, prompt)
+        if self._threshold is not None and similar_text:
+            self._index(mode, model, key, self._embed(similar_text), value)
+        else:
+            self._entries.set(key, value)
+
+    def _index(self, mode: str, model: str, key: str, vector: np.ndarray, value):
+        self._entries.set(key, value)
+        if key not in self._entries:
+            return
+        namespace = (mode, model)
+        index = self._indexes.get(namespace)
+        if index is None:
+            index = self._indexes[namespace] = SimilarityIndex(len(vector), self._max_entries)
+        index.add(key, vector)
+        self._namespaces[key] = namespace
+
+    def record_bypass(self):
+        self.bypassed += 1
+
+    def clear(self):
+        for key, _, _ in list(self._entries.items()):
+            self._entries.pop(key)
+            self._on_evict(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.similar_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self._max_entries,
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self._entries.evictions,
+            "errors": self.errors,
+            "hit_rate": round((self.hits + self.similar_hits) / lookups, 3) if lookups else 0.0,
+            "similarity_threshold": self._threshold,
+            "backend": "redis" if self._shared else "memory",
+        }
+
+    async def _fetch(self, key: str):
+        try:
+            raw = await redis_client.get_client().get(f"respcache:{key}")
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Response cache store unavailable, treating as a miss: {e}")
+            return None
+        return None if raw is None else json.loads(raw)
+
+    def _embed(self, text: str) -> np.ndarray:
+        # Loads the embedding model on first use
+        return get_embedder().embed([normalize_prompt(text)])[0]
+
+    def _on_evict(self, key: str, value):
+        namespace = self._namespaces.pop(key, None)
+        if namespace is not None:
+            self._indexes[namespace].remove(key)
+
+response_cache = ResponseCache(
+    max_entries=settings.response_cache_max_entries,
+    ttl_seconds=settings.response_cache_ttl_seconds,
+    similarity_threshold=settings.response_cache_similarity_threshold,
+    backend=settings.cache_backend,
+)
@@ -1,43 +1,205 @@
+import asyncio
+import hashlib
+from typing import AsyncIterator
+from app.config import settings
 from app.logger import logger
-from app.model_loader import get_gemini_model
-from app.memory import get_session_history
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables.history import RunnableWithMessageHistory
+from app.model_loader import model_registry, as_runnable, register_prompt_prefix
+from app.memory import BoundedChatMessageHistory, get_session_history
+from app.metrics import stage
+from app.services.cache import response_cache
+from app.services.limiter import AdmissionRejected
+from app.services.prompt_builder import estimate_tokens, fetch_context, fit_history, token_budget
+from app.services.provider_router import debugger_router
+from app.services.single_flight import llm_flights
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
 
 # System prompt from the original Flask backend
 SYSTEM_PROMPT = (
     "You are a professional Coding Assistant powered by Gemini 2.0 Flash. "
-    "Your expertise includes writing clean code, debugging, code review, API development, and more. "
-    "Question: {question}"
+    "Your expertise includes writing clean code, debugging, code review, API development, and more."
 )
 
-prompt_template = ChatPromptTemplate.from_template(SYSTEM_PROMPT)
+# Rendered prompts start with "System: " + SYSTEM_PROMPT; keep it warm in the local model
+register_prompt_prefix(f"System: {SYSTEM_PROMPT}")
 
-async def get_chat_response(session_id: str, user_message: str) -> dict:
-    """Handles the chat logic using LangChain for the debugger."""
-    model = get_gemini_model()
-    if not model:
-        return {"response": "Mock response: Debugger model is not configured."}
+def _fit_prompt():
+    """
+    Prompt assembly stage: keeps only the history turns that fit in the
+    model's token budget after the system prompt, retrieved context and
+    question, and replaces older turns with the session's running summary.
+    """
+    from langchain_core.runnables import RunnableLambda
 
-    try:
-        # Create a conversation chain with memory for each request
-        conversation_with_history = RunnableWithMessageHistory(
-            prompt_template | model,
-            get_session_history,
+    def fit(inputs: dict, config) -> dict:
+        history = get_session_history(config["configurable"]["session_id"])
+        budget = token_budget(model_registry.active_model)
+        fixed = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(inputs["question"]) + estimate_tokens(inputs["context"])
+        with stage("prompt"):
+            recent, summary = fit_history(history, max(0, budget - fixed - settings.prompt_summary_tokens))
+        return {
+            **inputs,
+            "history": recent,
+            "context": f"\n\nReference material:\n{inputs['context']}" if inputs["context"] else "",
+            "summary": f"\n\nEarlier in this conversation:\n{summary}" if summary else "",
+        }
+    return RunnableLambda(fit)
+
+class _ChainHistory(BaseChatMessageHistory):
+    """
+    A session's history as the chain sees it. _fit_prompt supplies the turns
+    that fit the prompt, building messages for those only, so reads here are
+    empty; the turns the chain adds are written through to the session.
+    """
+
+    def __init__(self, session_id: str):
+        self.history = get_session_history(session_id)
+
+    @property
+    def messages(self) -> list:
+        return []
+
+    async def aget_messages(self) -> list:
+        return []
+
+    def add_messages(self, messages) -> None:
+        self.history.add_messages(messages)
+
+    async def aadd_messages(self, messages) -> None:
+        await self.history.aadd_messages(messages)
+
+    def clear(self) -> None:
+        self.history.clear()
+
+    async def aclear(self) -> None:
+        await self.history.aclear()
+
+_chain = None
+
+def get_chain():
+    """
+    Builds the conversation chain on first use, as LangChain's runnables are
+    slow to import. The provider router picks the model per request and fails
+    over between models, so this one chain replaces the per-model chains
+    ModelRegistry used to keep.
+    """
+    global _chain
+    if _chain is None:
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        from langchain_core.runnables.history import RunnableWithMessageHistory
+        prompt_template = ChatPromptTemplate.from_messages([
+            ("system", SYSTEM_PROMPT + "{context}{summary}"),
+            MessagesPlaceholder("history"),
+            ("human", "{question}"),
+        ])
+        _chain = RunnableWithMessageHistory(
+            _fit_prompt() | prompt_template | as_runnable(debugger_router.stream),
+            _ChainHistory,
             input_messages_key="question",
             history_messages_key="history",
         )
+    return _chain
 
-        # Invoke the chain
-        response = await conversation_with_history.ainvoke(
-            {"question": user_message},
-            config={"configurable": {"session_id": session_id}}
-        )
+async def _load_chain():
+    # The first build imports LangChain; keep it off the event loop
+    return _chain if _chain is not None else await asyncio.to_thread(get_chain)
+
+async def _chain_inputs(session_id: str, user_message: str) -> dict:
+    # Loads persisted history up front, so the chain reads it from memory
+    with stage("memory"):
+        await get_session_history(session_id).aload()
+    budget = token_budget(model_registry.active_model)
+    context = await fetch_context(user_message, int(budget * settings.prompt_context_share))
+    return {"question": user_message, "context": context}
 
-        bot_reply = getattr(response, "content", str(response))
-        return {"response": bot_reply, "session_id": session_id}
+def _flight_key(session_id: str, user_message: str) -> str:
+    return response_cache.make_key("debugger", model_registry.active_model, f"{session_id}\0{user_message}")
 
+def _cache_prompt(history: BoundedChatMessageHistory, user_message: str) -> tuple[str, str | None]:
+    """
+    Cache key text and similarity text for a debugger turn. Replies depend on
+    the conversation so far, so the key carries a digest of the session's
+    summary and turns; only a session's first question, which has no history,
+    may be answered from a similar question.
+    """
+    if not len(history) and not history.summary:
+        return user_message, user_message
+    digest = hashlib.sha256(history.summary.encode("utf-8"))
+    for i in range(len(history)):
+        message_type, content = history.turn(i)
+        digest.update(f"\0{message_type}\0{content}".encode("utf-8"))
+    return f"{digest.hexdigest()}\0{user_message}", None
+
+async def get_chat_response(session_id: str, user_message: str, use_cache: bool = True) -> dict:
+    """Handles the chat logic using LangChain for the debugger."""
+    if not debugger_router.available():
+        return {"response": "Mock response: Debugger model is not configured."}
+
+    # A cached reply is still recorded in the session history
+    use_cache = use_cache and settings.response_cache_enabled
+    cache_prompt = similar_text = None
+    if use_cache:
+        history = get_session_history(session_id)
+        with stage("memory"):
+            await history.aload()
+        # Taken before the chain adds this turn to the history
+        cache_prompt, similar_text = _cache_prompt(history, user_message)
+        cached = await response_cache.aget("debugger", model_registry.active_model, cache_prompt, similar_text)
+        if cached is not None:
+            await history.aadd_messages(
+                [HumanMessage(content=user_message), AIMessage(content=cached)]
+            )
+            return {"response": cached, "session_id": session_id}
+    else:
+        response_cache.record_bypass()
+
+    # The prompt includes the session history, so only duplicate submissions
+    # from the same session share an in-flight call
+    key = _flight_key(session_id, user_message)
+    return await llm_flights.do(key, lambda: _invoke_chain(session_id, user_message, cache_prompt, similar_text))
+
+async def _invoke_chain(session_id: str, user_message: str, cache_prompt: str | None, similar_text: str | None) -> dict:
+    inputs = await _chain_inputs(session_id, user_message)
+    try:
+        chain = await _load_chain()
+        response = await chain.ainvoke(
+            inputs,
+            config={"configurable": {"session_id": session_id}}
+        )
+    except AdmissionRejected:
+        # Shed by the provider's concurrency limiter; answered with a 503
+        raise
     except Exception as e:
         logger.error(f"Error invoking debugger chain: {e}", exc_info=True)
         raise Exception("Failed to communicate with the Debugger AI model.") from e
 
+    bot_reply = getattr(response, "content", str(response))
+    if cache_prompt is not None:
+        await response_cache.aset("debugger", model_registry.active_model, cache_prompt, bot_reply, similar_text)
+    return {"response": bot_reply, "session_id": session_id}
+
+async def stream_chat_response(session_id: str, user_message: str) -> AsyncIterator[str]:
+    """Streams the debugger reply token by token; history is updated when it completes."""
+    if not debugger_router.available():
+        yield "Mock response: Debugger model is not configured."
+        return
+
+    key = _flight_key(session_id, user_message)
+    async for token in llm_flights.stream(key, lambda: _stream_chain(session_id, user_message)):
+        yield token
+
+async def _stream_chain(session_id: str, user_message: str) -> AsyncIterator[str]:
+    inputs = await _chain_inputs(session_id, user_message)
+    try:
+        chain = await _load_chain()
+        async for chunk in chain.astream(
+            inputs,
+            config={"configurable": {"session_id": session_id}}
+        ):
+            yield getattr(chunk, "content", str(chunk))
+    except AdmissionRejected:
+        # Shed by the provider's concurrency limiter; answered with a 503
+        raise
+    except Exception as e:
+        logger.error(f"Error streaming debugger chain: {e}", exc_info=True)
+        raise Exception("Failed to communicate with the Debugger AI model.") from e
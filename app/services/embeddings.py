@@ -0,0 +1,76 @@
+import re
+import threading
+import zlib
+import numpy as np
+from app.config import settings
+from app.logger import logger
+
+_TOKEN_RE = re.compile(r"\w+")
+
+class HashingEmbedder:
+    """
+    Dependency-free local embedder.
+    Hashes word unigrams and character trigrams into a fixed-size signed
+    vector and L2-normalizes it, so dot products are cosine similarities.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def _features(self, text: str) -> list[str]:
+        words = _TOKEN_RE.findall(text.lower())
+        features = list(words)
+        for word in words:
+            padded = f"#{word}#"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+class SentenceTransformerEmbedder:
+    """Embeds text with a local sentence-transformers model on CPU."""
+
+    def __init__(self, model_name: str, batch_size: int):
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self._batch_size = batch_size
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        return self._model.encode(
+            texts,
+            batch_size=self._batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+        ).astype(np.float32)
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+def get_embedder():
+    """
+    Returns the process-wide embedder.
+    Uses the configured sentence-transformers model if it is installed,
+    otherwise falls back to the hashing embedder.
+    """
+    global _embedder
+    if _embedder is None:
+        # Retrieval runs in worker threads: load the model once
+        with _embedder_lock:
+            if _embedder is None:
+                embedder = None
+                if settings.embedding_model:
+                    try:
+                        embedder = SentenceTransformerEmbedder(settings.embedding_model, settings.embedding_batch_size)
+                        logger.info(f"Loaded embedding model: {settings.embedding_model}")
+                    except ImportError:
+                        logger.warning("sentence-transformers is not installed; using the hashing embedder.")
+                _embedder = embedder or HashingEmbedder(settings.embedding_dim)
+    return _embedder
@@ -0,0 +1,244 @@
+import hashlib
+import re
+from datetime import datetime, timezone
+from app.config import settings
+from app.logger import logger
+from app.database.client import db_client
+from app.memory import SessionStore
+from app.services.cache import normalize_prompt
+
+# --- Error fingerprints ---
+# Fields that describe the error itself; other context (code, workspace) varies per user
+_ERROR_FIELDS = ("language", "type", "errortype", "name", "error", "message", "errormessage", "stack", "stacktrace", "traceback")
+
+# Quoted identifiers are kept: modules, attributes, keys and type names tell
+# errors apart ('numpy' from 'pandas', 'int' and 'str' from 'int' and
+# 'NoneType'). So are HTTP statuses ('404 Not Found'); other quoted text is a
+# literal value
+_KEEP_QUOTED = re.compile(r"[A-Za-z_][\w.]*|[1-5]\d\d(?: [A-Za-z][\w -]*)?")
+_NORMALIZERS = (
+    (re.compile(r"\b[a-z][a-z0-9+.-]*://\S+", re.IGNORECASE), "<url>"),
+    (re.compile(r"(?:[A-Za-z]:)?(?:[\\/][\w.@~+-]+)+[\\/]?|(?:[\w.@~+-]+[\\/])+[\w.@~+-]+"), "<path>"),
+    (re.compile(r"\b0x[0-9a-fA-F]+\b"), "<addr>"),
+    (re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"), "<id>"),
+)
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+# A three-digit number after "HTTP", "status" or "code", or before a reason phrase, is a status code
+_STATUS_BEFORE_RE = re.compile(r"\b(?:HTTP(?:/[\d.]+)?|status(?: code)?|code|error)[\s:=]*$", re.IGNORECASE)
+_STATUS_AFTER_RE = re.compile(r" (?:[A-Z][a-z]+|[A-Z]{2,})\b")
+_QUOTED_RE = re.compile(r"'([^'\n]*)'|\"([^\"\n]*)\"")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def _quoted(match: re.Match) -> str:
+    value = match.group(1) if match.group(1) is not None else match.group(2)
+    return match.group(0) if _KEEP_QUOTED.fullmatch(value) else "<str>"
+
+def _number(match: re.Match) -> str:
+    value = match.group(0)
+    if len(value) == 3 and "100" <= value <= "599":
+        line = match.string
+        if _STATUS_BEFORE_RE.search(line, 0, match.start()) or _STATUS_AFTER_RE.match(line, match.end()):
+            return value
+    return "<n>"
+
+def _normalize_line(line: str) -> str:
+    line = _QUOTED_RE.sub(_quoted, line)
+    for pattern, replacement in _NORMALIZERS:
+        line = pattern.sub(replacement, line)
+    line = _NUMBER_RE.sub(_number, line)
+    return _WHITESPACE_RE.sub(" ", line).strip()
+
+def error_signature(context: dict, question: str | None = None) -> str:
+    """
+    Normalizes an error context, and the question asked about it, into the
+    text its fingerprint is taken from. Only the error fields are used (all
+    string values if there are none), with paths, line and other numbers,
+    addresses and quoted literal values replaced by placeholders, so the same
+    error from different users and projects gives the same signature. Module,
+    attribute and key names and HTTP status codes are kept. Repeated lines,
+    as in a recursion trace, are kept once.
+    """
+    fields = [(key.lower(), value) for key, value in context.items() if key.lower() in _ERROR_FIELDS]
+    if not fields:
+        fields = [(key.lower(), value) for key, value in context.items() if isinstance(value, str)]
+    lines = []
+    # Sorted by key, so clients sending the fields in another order get the same signature
+    for _, value in sorted(fields, key=lambda field: field[0]):
+        text = "\n".join(map(str, value)) if isinstance(value, list) else str(value)
+        for line in text.splitlines():
+            line = _normalize_line(line)
+            if line and (not lines or lines[-1] != line):
+                lines.append(line)
+    # The same error asked about differently needs a different answer
+    if question is not None:
+        lines.append(f"question: {normalize_prompt(question)}")
+    return "\n".join(lines)
+
+def fingerprint(signature: str) -> str:
+    return hashlib.sha256(signature.encode("utf-8")).hexdigest()[:32]
+
+# --- Fix index ---
+FIXES_COLLECTION = "error_fixes"
+
+class FixIndex:
+    """
+    Fingerprint -> validated tutor answer for errors seen before, so a
+    recurring error is answered without calling the model.
+    The "memory" backend keeps entries per worker in an LRU with idle TTL;
+    "mongo" keeps them in the error_fixes collection, shared by every worker
+    and kept across restarts, and expires entries unused for ttl_seconds.
+    An unreachable database counts as a miss rather than failing the request.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, backend: str = "memory", enabled: bool = True):
+        self._entries = SessionStore("fix_index", max_entries, ttl_seconds)
+        self._ttl_seconds = ttl_seconds
+        self._persistent = backend == "mongo"
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.invalidated = 0
+        self.errors = 0
+
+    async def start(self):
+        if self.enabled and self._persistent:
+            await _collection().create_index("last_used_at", expireAfterSeconds=int(self._ttl_seconds))
+            logger.info("Error fix index stored in MongoDB.")
+
+    async def lookup(self, signature: str) -> dict | None:
+        """Returns the indexed answer for an error signature, counting the hit."""
+        if not self.enabled:
+            return None
+        key = fingerprint(signature)
+        if self._persistent:
+            try:
+                doc = await _collection().find_one_and_update(
+                    {"_id": key},
+                    {"$inc": {"hits": 1}, "$set": {"last_used_at": _now()}},
+                    projection={"_id": 0, "response": 1},
+                )
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Error fix index unavailable, treating as a miss: {e}")
+                return None
+            response = None if doc is None else doc["response"]
+        else:
+            entry = self._entries.get(key)
+            response = None
+            if entry is not None:
+                entry["hits"] += 1
+                entry["last_used_at"] = _now()
+                response = entry["response"]
+        if response is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        logger.debug("Error fix index hit for %s", key)
+        return dict(response)
+
+    async def record(self, signature: str, response: dict):
+        """Indexes a validated answer, replacing any earlier one for the same error."""
+        if not self.enabled:
+            return
+        key, now = fingerprint(signature), _now()
+        if self._persistent:
+            try:
+                await _collection().update_one(
+                    {"_id": key},
+                    {
+                        "$set": {"signature": signature, "response": response, "last_used_at": now},
+                        "$setOnInsert": {"created_at": now, "hits": 0},
+                    },
+                    upsert=True,
+                )
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Error fix index unavailable, not indexing: {e}")
+                return
+        else:
+            previous = self._entries.get(key)
+            self._entries.set(key, {
+                "fingerprint": key,
+                "signature": signature,
+                "response": response,
+                "hits": previous["hits"] if previous else 0,
+                "created_at": previous["created_at"] if previous else now,
+                "last_used_at": now,
+            })
+        self.stored += 1
+
+    async def get(self, key: str) -> dict | None:
+        """Returns the entry for a fingerprint, without counting a hit."""
+        if self._persistent:
+            doc = await _collection().find_one({"_id": key})
+            return None if doc is None else _entry(doc)
+        entry = self._entries.get(key)
+        return None if entry is None else dict(entry)
+
+    async def entries(self, limit: int, skip: int = 0) -> list[dict]:
+        """Entries by hit count, most used first."""
+        if self._persistent:
+            cursor = _collection().find().sort([("hits", -1), ("_id", 1)]).skip(skip).limit(limit)
+            return [_entry(doc) for doc in await cursor.to_list(length=limit)]
+        entries = sorted((entry for _, entry, _ in self._entries.items()), key=lambda entry: (-entry["hits"], entry["fingerprint"]))
+        return [dict(entry) for entry in entries[skip:skip + limit]]
+
+    async def invalidate(self, key: str) -> bool:
+        """Removes one entry; the next occurrence of the error is answered by the model again."""
+        if self._persistent:
+            removed = (await _collection().delete_one({"_id": key})).deleted_count > 0
+        else:
+            removed = self._entries.pop(key) is not None
+        self.invalidated += removed
+        return removed
+
+    async def clear(self) -> int:
+        if self._persistent:
+            removed = (await _collection().delete_many({})).deleted_count
+        else:
+            removed = len(self._entries)
+            for key, _, _ in list(self._entries.items()):
+                self._entries.pop(key)
+        self.invalidated += removed
+        return removed
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "backend": "mongo" if self._persistent else "memory",
+            "entries": None if self._persistent else len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stored": self.stored,
+            "invalidated": self.invalidated,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+def _collection():
+    return db_client.get_database()[FIXES_COLLECTION]
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _entry(doc: dict) -> dict:
+    return {
+        "fingerprint": doc["_id"],
+        "signature": doc.get("signature"),
+        "response": doc.get("response"),
+        "hits": doc.get("hits", 0),
+        "created_at": doc.get("created_at"),
+        "last_used_at": doc.get("last_used_at"),
+    }
+
+fix_index = FixIndex(
+    max_entries=settings.fix_index_max_entries,
+    ttl_seconds=settings.fix_index_ttl_seconds,
+    backend=settings.fix_index_backend,
+    enabled=settings.fix_index_enabled,
+)
+
+async def start_fix_index():
+    await fix_index.start()
@@ -0,0 +1,145 @@
+import json
+import os
+import re
+from collections import Counter
+import numpy as np
+from app.logger import logger
+
+_TOKEN_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+_SUBWORD_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lowercased identifier-aware tokens.
+    Identifiers are kept whole (NullPointerException, E0425, get_user) and
+    also split into their camelCase / snake_case parts.
+    """
+    tokens = []
+    for word in _TOKEN_RE.findall(text):
+        tokens.append(word.lower())
+        parts = _SUBWORD_RE.findall(word)
+        if len(parts) > 1:
+            tokens.extend(part.lower() for part in parts)
+    return tokens
+
+class LexicalIndex:
+    """
+    BM25 inverted index stored as compact CSR arrays.
+    Postings for term t are posting_docs/posting_tfs[term_offsets[t]:term_offsets[t + 1]],
+    sorted by doc id. The arrays are .npy files opened memory-mapped; only the
+    term -> id lexicon is held in a dict.
+    """
+
+    FILES = ("term_offsets.npy", "posting_docs.npy", "posting_tfs.npy", "doc_lengths.npy")
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, terms: list[str], term_offsets: np.ndarray, posting_docs: np.ndarray, posting_tfs: np.ndarray, doc_lengths: np.ndarray):
+        self.terms = terms
+        self.lexicon = {term: term_id for term_id, term in enumerate(terms)}
+        self.term_offsets = term_offsets
+        self.posting_docs = posting_docs
+        self.posting_tfs = posting_tfs
+        self.doc_lengths = doc_lengths
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    @classmethod
+    def build(cls, doc_count: int, texts: dict[int, str], previous: "LexicalIndex | None" = None, doc_map: np.ndarray | None = None) -> "LexicalIndex":
+        """
+        Builds an index over doc_count documents.
+        Only `texts` (new doc id -> text) are tokenized; postings of the other
+        documents are carried over from `previous`, where doc_map maps each
+        old doc id to its new id (or -1 to drop it).
+        """
+        terms: list[str] = []
+        lexicon: dict[str, int] = {}
+        term_parts, doc_parts, tf_parts = [], [], []
+        doc_lengths = np.zeros(doc_count, dtype=np.int32)
+
+        if previous is not None and doc_map is not None and len(previous.posting_docs):
+            new_docs = doc_map[np.asarray(previous.posting_docs)]
+            keep = new_docs >= 0
+            old_terms = np.repeat(np.arange(len(previous.terms)), np.diff(previous.term_offsets))
+            terms.extend(previous.terms)
+            lexicon.update(previous.lexicon)
+            term_parts.append(old_terms[keep])
+            doc_parts.append(new_docs[keep])
+            tf_parts.append(np.asarray(previous.posting_tfs)[keep])
+            kept_docs = doc_map >= 0
+            doc_lengths[doc_map[kept_docs]] = np.asarray(previous.doc_lengths)[kept_docs]
+
+        for doc_id, text in texts.items():
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            counts = Counter(tokens)
+            term_ids = np.empty(len(counts), dtype=np.int64)
+            for i, term in enumerate(counts):
+                term_id = lexicon.get(term)
+                if term_id is None:
+                    term_id = lexicon[term] = len(terms)
+                    terms.append(term)
+                term_ids[i] = term_id
+            term_parts.append(term_ids)
+            doc_parts.append(np.full(len(counts), doc_id, dtype=np.int64))
+            tf_parts.append(np.fromiter(counts.values(), dtype=np.int64, count=len(counts)))
+
+        term_ids = np.concatenate(term_parts) if term_parts else np.empty(0, dtype=np.int64)
+        doc_ids = np.concatenate(doc_parts) if doc_parts else np.empty(0, dtype=np.int64)
+        tfs = np.concatenate(tf_parts) if tf_parts else np.empty(0, dtype=np.int64)
+
+        # Drop terms that no longer have postings and renumber the rest
+        used, term_ids = np.unique(term_ids, return_inverse=True)
+        terms = [terms[i] for i in used]
+        order = np.lexsort((doc_ids, term_ids))
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=term_offsets[1:])
+        return cls(
+            terms,
+            term_offsets,
+            doc_ids[order].astype(np.int32),
+            np.minimum(tfs[order], np.iinfo(np.uint16).max).astype(np.uint16),
+            doc_lengths,
+        )
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        for name, array in zip(self.FILES, (self.term_offsets, self.posting_docs, self.posting_tfs, self.doc_lengths)):
+            np.save(os.path.join(path, name), array)
+        with open(os.path.join(path, "lexicon.json"), "w", encoding="utf-8") as f:
+            json.dump(self.terms, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex | None":
+        if not os.path.exists(os.path.join(path, "lexicon.json")):
+            return None
+        with open(os.path.join(path, "lexicon.json"), encoding="utf-8") as f:
+            terms = json.load(f)
+        arrays = [np.load(os.path.join(path, name), mmap_mode="r") for name in cls.FILES]
+        index = cls(terms, *arrays)
+        logger.info(f"Loaded lexical index from {path} ({len(terms)} terms, {len(index.posting_docs)} postings)")
+        return index
+
+    def search(self, query: str, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns (doc ids, BM25 scores) of the top-k documents, best first."""
+        doc_count = len(self.doc_lengths)
+        doc_parts, score_parts = [], []
+        for term in set(tokenize(query)):
+            term_id = self.lexicon.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = np.asarray(self.posting_docs[start:end])
+            tfs = np.asarray(self.posting_tfs[start:end], dtype=np.float32)
+            df = end - start
+            idf = np.log(1.0 + (doc_count - df + 0.5) / (df + 0.5))
+            norm = self.K1 * (1 - self.B + self.B * np.asarray(self.doc_lengths[docs]) / max(self.avg_length, 1e-9))
+            doc_parts.append(docs)
+            score_parts.append(idf * tfs * (self.K1 + 1) / (tfs + norm))
+        if not doc_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        docs, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+        top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return docs[top].astype(np.int64), scores[top].astype(np.float32)
@@ -0,0 +1,309 @@
+import asyncio
+import time
+from collections import deque
+from contextvars import ContextVar
+from app.config import settings
+from app.logger import logger
+from app.database.redis_client import redis_client
+from app.memory import SessionStore
+
+# --- Token buckets ---
+class MemoryBucketStore:
+    """In-process token buckets; each worker enforces the limit on its own."""
+
+    def __init__(self, max_entries: int):
+        self._buckets = SessionStore("rate_limit", max_entries, ttl_seconds=3600.0)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """Takes one token; returns 0 if allowed, else the seconds until a token is available."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (float(burst), now))
+        tokens = min(float(burst), tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= 1.0:
+            tokens -= 1.0
+        else:
+            wait = (1.0 - tokens) / rate
+        self._buckets.set(key, (tokens, now))
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def aclose(self):
+        pass
+
+# Refill and take in one atomic step, so concurrent workers cannot overdraw a bucket
+_TAKE_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+class RedisBucketStore:
+    """
+    Token buckets in Redis, or any server speaking the Redis protocol
+    (Valkey, KeyDB, Dragonfly), shared by every worker. Requires `redis`.
+    If the server is unreachable, requests are let through rather than failed.
+    """
+
+    def __init__(self):
+        self._take = redis_client.get_client().register_script(_TAKE_SCRIPT)
+        self.errors = 0
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        try:
+            return float(await self._take(keys=[f"ratelimit:{key}"], args=[rate, burst, time.time()]))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Rate limit store unavailable, allowing request: {e}")
+            return 0.0
+
+    def __len__(self) -> int:
+        return 0
+
+    async def aclose(self):
+        # The connection pool is shared and closed by close_redis_connection
+        pass
+
+_bucket_store: MemoryBucketStore | RedisBucketStore | None = None
+
+def get_bucket_store() -> MemoryBucketStore | RedisBucketStore:
+    global _bucket_store
+    if _bucket_store is None:
+        if settings.limiter_backend == "redis":
+            try:
+                _bucket_store = RedisBucketStore()
+                logger.info(f"Rate limit buckets stored in {settings.redis_url}")
+            except ImportError:
+                logger.warning("redis is not installed; using in-process rate limit buckets.")
+        if _bucket_store is None:
+            _bucket_store = MemoryBucketStore(settings.session_max_count)
+    return _bucket_store
+
+async def close_bucket_store():
+    global _bucket_store
+    if _bucket_store is not None:
+        await _bucket_store.aclose()
+        _bucket_store = None
+
+# --- Adaptive concurrency ---
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one upstream provider.
+
+    Every upstream call that completes within latency_tolerance x the recent
+    minimum latency for its kind (model, and full reply or first token) grows
+    the limit by 1/limit (about +1 per round trip); a slower call or an
+    upstream 429 multiplies it by backoff, at most once per round trip. The
+    provider router takes a slot for each call it sends to the provider and
+    feeds the call's latency back, so replies served from a cache or the fix
+    index neither hold a slot nor lower the baseline. Calls over the limit
+    wait in a fair queue that serves sessions round-robin, and a call whose
+    expected or actual wait runs past its deadline is shed instead of timing
+    out late. The limit is per worker: each worker reacts to the latency it
+    observes.
+    """
+
+    WINDOW = 100  # samples before the minimum-latency baseline is refreshed
+
+    def __init__(self, name: str, min_limit: int, max_limit: int, latency_tolerance: float, backoff: float):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._tolerance = latency_tolerance
+        self._backoff = backoff
+        self._queues: dict[str, deque[asyncio.Future]] = {}
+        self._order: deque[str] = deque()
+        self._baselines: dict[str, list] = {}
+        self._service_time: float | None = None
+        self._last_decrease = 0.0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.overloads = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, key: str, deadline: float) -> bool:
+        """Waits for a slot until the monotonic deadline; returns False if the request is shed."""
+        if self.in_flight < int(self.limit) and not self._queues:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+        # Shed up front when the queue ahead cannot drain before the deadline
+        if self._service_time is not None:
+            expected_wait = (self.waiting + 1) / max(int(self.limit), 1) * self._service_time
+            if time.monotonic() + expected_wait > deadline:
+                self.shed += 1
+                return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        if key not in self._queues:
+            self._queues[key] = deque()
+            self._order.append(key)
+        self._queues[key].append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait({waiter}, timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.CancelledError:
+            if waiter.done():
+                # Cancelled after being granted a slot; hand it back
+                self.release()
+            else:
+                waiter.cancel()
+                self._remove(key, waiter)
+            raise
+        if not waiter.done():
+            waiter.cancel()
+            self._remove(key, waiter)
+            self.shed += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def release(self, held: float | None = None):
+        """Frees a slot; held is how long the request had it, which paces shedding."""
+        self.in_flight -= 1
+        if held is not None:
+            self._service_time = held if self._service_time is None else self._service_time + 0.1 * (held - self._service_time)
+        self._grant()
+
+    def observe(self, latency: float, kind: str = ""):
+        """Feeds one upstream call's latency back into the limit."""
+        baseline = self._baselines.setdefault(kind, [latency, latency, 0])
+        baseline[1] = min(baseline[1], latency)
+        baseline[2] += 1
+        if baseline[2] >= self.WINDOW:
+            baseline[0], baseline[1], baseline[2] = baseline[1], latency, 0
+        baseline[0] = min(baseline[0], latency)
+        if latency > baseline[0] * self._tolerance:
+            self._decrease(latency)
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        self._grant()
+
+    def record_overload(self):
+        """Called by provider clients when the upstream answers 429."""
+        self.overloads += 1
+        self._decrease(self._service_time or 0.0)
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "overloads": self.overloads,
+        }
+
+    def _decrease(self, interval: float):
+        now = time.monotonic()
+        if now - self._last_decrease < interval:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(float(self.min_limit), self.limit * self._backoff)
+        if int(self.limit) < int(previous):
+            logger.info(f"Concurrency limit for {self.name} lowered to {int(self.limit)}")
+
+    def _grant(self):
+        while self._order and self.in_flight < int(self.limit):
+            key = self._order.popleft()
+            queue = self._queues[key]
+            waiter = queue.popleft()
+            if queue:
+                self._order.append(key)
+            else:
+                del self._queues[key]
+            self.in_flight += 1
+            waiter.set_result(True)
+
+    def _remove(self, key: str, waiter: asyncio.Future):
+        queue = self._queues.get(key)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[key]
+            self._order.remove(key)
+
+_limiters: dict[str, AdaptiveLimiter] = {}
+
+def get_provider_limiter(provider: str) -> AdaptiveLimiter:
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        limiter = _limiters[provider] = AdaptiveLimiter(
+            provider,
+            min_limit=settings.limiter_min_concurrency,
+            max_limit=settings.llm_max_concurrency,
+            latency_tolerance=settings.limiter_latency_tolerance,
+            backoff=settings.limiter_backoff,
+        )
+    return limiter
+
+# --- Admission ---
+# Client key of the request being served; its upstream calls queue for slots under it
+admission_key: ContextVar[str] = ContextVar("admission_key", default="ip:unknown")
+
+class AdmissionRejected(Exception):
+    """Raised when a request is rate limited (429) or shed by a provider's concurrency limiter (503)."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+def client_key(session_id: str | None, client_host: str | None) -> str:
+    """Limits by session_id when the request names one, otherwise by client IP."""
+    if isinstance(session_id, str) and session_id and session_id != "default":
+        return f"session:{session_id}"
+    return f"ip:{client_host or 'unknown'}"
+
+async def admit(key: str):
+    """
+    Takes a token from key's rate-limit bucket and makes key the client
+    that the request's upstream calls queue under (see acquire_slot).
+    """
+    retry_after = await get_bucket_store().take(
+        key, settings.rate_limit_per_minute / 60.0, settings.rate_limit_burst
+    )
+    if retry_after > 0:
+        raise AdmissionRejected(429, "Too many requests; slow down.", retry_after)
+    admission_key.set(key)
+
+async def acquire_slot(provider: str) -> AdaptiveLimiter:
+    """
+    Takes a slot from the provider's concurrency limiter for one upstream
+    call. The caller releases it when the call, including a stream, is done.
+    """
+    limiter = get_provider_limiter(provider)
+    if not await limiter.acquire(admission_key.get(), time.monotonic() + settings.limiter_queue_timeout_seconds):
+        raise AdmissionRejected(503, "The AI service is busy; try again shortly.", 1.0)
+    return limiter
+
+def get_limiter_stats() -> dict:
+    store = get_bucket_store()
+    return {
+        "rate_limit_enabled": settings.rate_limit_enabled,
+        "rate_limit_per_minute": settings.rate_limit_per_minute,
+        "rate_limit_burst": settings.rate_limit_burst,
+        "backend": type(store).__name__,
+        "buckets": len(store),
+        "providers": {name: limiter.stats() for name, limiter in _limiters.items()},
+    }
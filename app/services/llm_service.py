@@ -0,0 +1,173 @@
+import asyncio
+import json
+from typing import AsyncIterator
+from fastapi import HTTPException, Request
+from app.config import settings
+from app.logger import logger
+from app.memory import append_session_messages
+from app.metrics import observe_structured_output
+from app.services import tutor, debugger
+from app.services.limiter import AdmissionRejected, admit
+from app.services.services import format_sse
+from app.services.structured_output import TutorResponseParser, fallback_response
+
+async def query_llm(query: str, mode: str, session_id: str = "default", use_cache: bool = True) -> dict:
+    """
+    Routes a query to the tutor or debugger service.
+    The call is bounded by the configured LLM timeout.
+    Set use_cache=False to bypass the response cache for this request.
+    """
+    if mode == "tutor":
+        call = tutor.get_tutor_response(session_id, query, use_cache)
+    elif mode == "debugger":
+        call = debugger.get_chat_response(session_id, query, use_cache)
+    else:
+        raise HTTPException(status_code=400, detail=f"Unknown mode '{mode}'.")
+
+    try:
+        return await asyncio.wait_for(call, timeout=settings.llm_timeout_seconds)
+    except asyncio.TimeoutError:
+        logger.error(f"LLM call timed out after {settings.llm_timeout_seconds}s (mode={mode}).")
+        raise HTTPException(status_code=504, detail="The AI model did not respond in time.")
+
+async def stream_llm(query: str, mode: str, session_id: str = "default", request: Request | None = None) -> AsyncIterator[str]:
+    """
+    Streams a query as Server-Sent Events.
+    Emits one `token` event per text chunk, then a `done` event carrying the
+    assembled response (the parsed JSON object for the tutor), or an `error` event.
+    The tutor's JSON is parsed and validated as it streams, so the `done`
+    event follows the last token without a second pass over the text.
+
+    Tokens are pulled from the upstream only as fast as the response consumes
+    them: a shared (coalesced) stream reads at most a few tokens ahead of its
+    slowest subscriber, so a slow client applies backpressure instead of
+    buffering. If the client disconnects, the upstream stream is closed.
+    """
+    parser = TutorResponseParser() if mode == "tutor" else None
+    tokens = _token_stream(query, mode, session_id, parser)
+    if tokens is None:
+        yield format_sse("error", {"detail": f"Unknown mode '{mode}'."})
+        return
+
+    parts = []
+    try:
+        async for token in tokens:
+            if request is not None and await request.is_disconnected():
+                logger.info(f"Client disconnected; cancelled {mode} stream for session '{session_id}'.")
+                return
+            parts.append(token)
+            yield format_sse("token", {"text": token})
+
+        yield format_sse("done", _final_response(mode, "".join(parts), session_id, parser))
+    except AdmissionRejected as e:
+        logger.info("Shed %s stream for session '%s': %s", mode, session_id, e.detail)
+        yield format_sse("error", {"status": e.status_code, "detail": e.detail})
+    except Exception as e:
+        logger.error(f"Error while streaming {mode} response: {e}", exc_info=True)
+        yield format_sse("error", {"detail": "Failed to stream the AI model response."})
+    finally:
+        await tokens.aclose()
+
+def _token_stream(query: str, mode: str, session_id: str, parser: TutorResponseParser | None = None) -> AsyncIterator[str] | None:
+    if mode == "tutor":
+        return tutor.stream_tutor_response(session_id, query, parser)
+    if mode == "debugger":
+        return debugger.stream_chat_response(session_id, query)
+    return None
+
+def _final_response(mode: str, text: str, session_id: str, parser: TutorResponseParser | None) -> dict:
+    if parser is not None:
+        # Tokens are already sent, so an unrepairable answer is kept as text rather than retried
+        result, outcome = parser.result()
+        if result is None:
+            result, outcome = fallback_response(text), "fallback"
+        observe_structured_output(outcome)
+        return result
+    return {"response": text, "session_id": session_id}
+
+# --- Batches ---
+async def _admit(key: str):
+    # The same rate limit LimiterMiddleware applies to single requests, per query
+    if settings.rate_limit_enabled:
+        await admit(key)
+
+async def _record(session_id: str, mode: str, query: str, response: dict):
+    # The debugger chain already records its turns in the session history
+    if mode == "tutor":
+        reply = response.get("explanation") or json.dumps(response)
+        await append_session_messages(session_id, [("user", query), ("bot", reply)])
+
+async def _batch_query(session_id: str, key: str, item: dict) -> dict:
+    try:
+        await _admit(key)
+        response = await query_llm(item["query"], item["mode"], session_id, item["use_cache"])
+        if item["record"]:
+            await _record(session_id, item["mode"], item["query"], response)
+        return {"id": item["id"], "status": 200, "response": response}
+    except AdmissionRejected as e:
+        return {"id": item["id"], "status": e.status_code, "detail": e.detail, "retry_after": round(e.retry_after, 2)}
+    except HTTPException as e:
+        return {"id": item["id"], "status": e.status_code, "detail": e.detail}
+    except Exception as e:
+        logger.error(f"Error in batch query {item['id']} (mode={item['mode']}): {e}", exc_info=True)
+        return {"id": item["id"], "status": 500, "detail": "An unexpected internal server error occurred."}
+
+async def query_batch(session_id: str, items: list[dict], key: str) -> list[dict]:
+    """
+    Runs a batch of queries concurrently and returns one result per query,
+    in request order. Each item has id, query, mode, use_cache and record
+    (append the exchange to the session history). A failed query gets its
+    status and detail in its result instead of failing the batch.
+    """
+    return await asyncio.gather(*(_batch_query(session_id, key, item) for item in items))
+
+async def stream_batch(session_id: str, items: list[dict], key: str, request: Request | None = None) -> AsyncIterator[str]:
+    """
+    Streams a batch of queries as Server-Sent Events, in the order they are
+    produced: `token` events ({id, text}) as text arrives, then a `result`
+    ({id, status, response}) or `error` ({id, status, detail}) event per
+    query, and a final `done` event. The queries run concurrently; a bounded
+    queue keeps a slow client's backpressure on the upstream streams.
+    """
+    events: asyncio.Queue = asyncio.Queue(maxsize=64)
+
+    async def run(item: dict):
+        try:
+            await _admit(key)
+            parser = TutorResponseParser() if item["mode"] == "tutor" else None
+            tokens = _token_stream(item["query"], item["mode"], session_id, parser)
+            parts = []
+            try:
+                async for token in tokens:
+                    parts.append(token)
+                    await events.put(format_sse("token", {"id": item["id"], "text": token}))
+            finally:
+                await tokens.aclose()
+            response = _final_response(item["mode"], "".join(parts), session_id, parser)
+            if item["record"]:
+                await _record(session_id, item["mode"], item["query"], response)
+            await events.put(format_sse("result", {"id": item["id"], "status": 200, "response": response}))
+        except AdmissionRejected as e:
+            await events.put(format_sse("error", {"id": item["id"], "status": e.status_code, "detail": e.detail}))
+        except Exception as e:
+            logger.error(f"Error while streaming batch query {item['id']} (mode={item['mode']}): {e}", exc_info=True)
+            await events.put(format_sse("error", {"id": item["id"], "status": 500, "detail": "Failed to stream the AI model response."}))
+        await events.put(None)
+
+    tasks = [asyncio.create_task(run(item)) for item in items]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            event = await events.get()
+            if event is None:
+                remaining -= 1
+                continue
+            if request is not None and await request.is_disconnected():
+                logger.info(f"Client disconnected; cancelled batch stream for session '{session_id}'.")
+                return
+            yield event
+        yield format_sse("done", {"count": len(items)})
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
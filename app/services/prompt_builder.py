@@ -0,0 +1,75 @@
+import re
+from app.config import settings
+from app.metrics import stage
+from app.services import rag
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s")
+
+def estimate_tokens(text: str) -> int:
+    """
+    Fast local token estimate: words and punctuation marks, plus a quarter
+    for sub-word splits. Close enough to BPE counts for budgeting.
+    """
+    return int(len(_TOKEN_RE.findall(text)) * 1.25) + 1
+
+def token_budget(model: str) -> int:
+    """Returns the prompt token budget for a model name."""
+    return settings.prompt_token_budgets.get(model.removeprefix("models/"), settings.prompt_token_budget)
+
+def _truncate(text: str, max_tokens: int) -> str:
+    words = text.split()
+    # estimate_tokens counts ~1.25 tokens per word
+    limit = int(max_tokens / 1.25)
+    return text if len(words) <= limit else " ".join(words[:limit]) + " ..."
+
+async def fetch_context(query: str, max_tokens: int) -> str:
+    """Returns retrieved reference chunks that fit in max_tokens, best first."""
+    if not settings.rag_context_enabled or max_tokens <= 0:
+        return ""
+    with stage("retrieval"):
+        results = await rag.query_rag(query)
+    blocks, used = [], 0
+    for result in results:
+        block = f"[{result['source']}]\n{result['content']}"
+        cost = estimate_tokens(block)
+        if used + cost > max_tokens:
+            break
+        blocks.append(block)
+        used += cost
+    return "\n\n".join(blocks)
+
+# --- History budgeting ---
+def _summary_line(message_type: str, content: str) -> str:
+    first_sentence = _SENTENCE_RE.split(content.strip(), maxsplit=1)[0]
+    role = "User" if message_type == "human" else "Assistant"
+    return f"{role}: {_truncate(first_sentence, 40)}"
+
+def fit_history(history, budget: int) -> tuple[list, str]:
+    """
+    Picks the most recent messages of a BoundedChatMessageHistory that fit in
+    `budget` tokens and returns them with a summary of the older turns.
+    The summary is cached on the history and extended incrementally, so each
+    turn only summarizes the messages that just left the window. Turns are
+    read as text, and only the returned ones are built as messages.
+    """
+    count = len(history)
+    start, used = count, 0
+    while start > 0:
+        cost = estimate_tokens(history.turn(start - 1)[1])
+        if used + cost > budget:
+            break
+        used += cost
+        start -= 1
+
+    # Indexes are absolute: `dropped` counts messages trimmed from the front
+    window_start = history.dropped + start
+    if window_start > history.summary_upto:
+        first = max(history.summary_upto - history.dropped, 0)
+        lines = [line for line in history.summary.split("\n") if line]
+        lines.extend(_summary_line(*history.turn(i)) for i in range(first, start))
+        # Keep the newest summary lines within the summary budget
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > settings.prompt_summary_tokens:
+            lines.pop(0)
+        history.summary, history.summary_upto = "\n".join(lines), window_start
+    return history.message_range(start), history.summary
@@ -0,0 +1,357 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable
+from app.config import settings
+from app.logger import logger
+from app.metrics import observe_first_token, observe_llm, stage
+from app.model_loader import FALLBACK_MODEL, PROVIDERS
+from app.services.limiter import AdaptiveLimiter, acquire_slot, get_provider_limiter
+from app.services.prompt_builder import estimate_tokens
+
+class Target:
+    """
+    One (provider, model) pair with its live latency, error rate and circuit breaker.
+
+    The breaker opens after router_failure_threshold consecutive failures or
+    when the error rate over the window reaches router_error_rate_threshold.
+    After model_fallback_ttl_seconds it lets a single probe request through
+    (half-open); the probe's outcome closes or re-opens it.
+    """
+
+    WINDOW = 200
+    MIN_SAMPLES = 5
+
+    def __init__(self, provider, model: str):
+        self.provider = provider
+        self.model = model
+        self.name = f"{provider.name}:{model}"
+        self._latencies = {"complete": deque(maxlen=self.WINDOW), "stream": deque(maxlen=self.WINDOW)}
+        self._outcomes: deque[bool] = deque(maxlen=self.WINDOW)
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._probing = False
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def state(self) -> str:
+        if not self._open_until:
+            return "closed"
+        return "open" if time.monotonic() < self._open_until else "half_open"
+
+    @property
+    def error_rate(self) -> float:
+        return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+    def accepts(self) -> bool:
+        state = self.state
+        return self.provider.available and (state == "closed" or (state == "half_open" and not self._probing))
+
+    def percentile(self, kind: str, q: float) -> float | None:
+        samples = self._latencies[kind]
+        if len(samples) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+    def claim(self):
+        # Taken when the target is picked, before the attempt starts, so
+        # requests ranked in the meantime see the probe as taken
+        if self.state == "half_open":
+            self._probing = True
+
+    def begin(self):
+        self.requests += 1
+
+    def record_success(self, kind: str, latency: float):
+        self._latencies[kind].append(latency)
+        self._outcomes.append(True)
+        self._consecutive_failures = 0
+        self._probing = False
+        if self._open_until:
+            self._open_until = 0.0
+            logger.info(f"Circuit for {self.name} closed")
+
+    def record_failure(self):
+        self.failures += 1
+        self._outcomes.append(False)
+        self._consecutive_failures += 1
+        tripped = (
+            self._probing
+            or self._consecutive_failures >= settings.router_failure_threshold
+            or (len(self._outcomes) >= self.MIN_SAMPLES and self.error_rate >= settings.router_error_rate_threshold)
+        )
+        self._probing = False
+        if tripped:
+            self._open_until = time.monotonic() + settings.model_fallback_ttl_seconds
+            self._outcomes.clear()
+            logger.warning(f"Circuit for {self.name} opened for {settings.model_fallback_ttl_seconds:.0f}s")
+
+    def record_cancel(self):
+        self._probing = False
+
+    def stats(self) -> dict:
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+        return {
+            "state": self.state,
+            "requests": self.requests,
+            "failures": self.failures,
+            "error_rate": round(self.error_rate, 3),
+            **{f"{kind}_p50_ms": ms(self.percentile(kind, 50)) for kind in self._latencies},
+            **{f"{kind}_p95_ms": ms(self.percentile(kind, 95)) for kind in self._latencies},
+        }
+
+class ProviderRouter:
+    """
+    Sends each request to the best healthy target.
+
+    Targets are listed in order of preference. The first healthy target whose
+    p95 latency is within router_slow_p95_ms is used; if all are slower, the
+    fastest healthy one is. A failed request fails over to the remaining
+    targets in turn. With router_hedge_enabled, a request that has not answered after
+    the primary's router_hedge_percentile latency is also sent to the next
+    target (or the same one when it is the only target); the first answer
+    wins and the other request is cancelled. Streams are hedged and failed
+    over only until their first chunk.
+
+    Local targets (in-process CPU models) are tried first for short, simple
+    queries (route_hint) and last otherwise, so they also serve as the
+    fallback when the network providers are down.
+
+    With rate limiting on, every attempt holds a slot of its provider's
+    adaptive limiter, the same limiter its latency is fed back to. An
+    attempt shed by a busy provider fails over like a failed one, without
+    counting against the target's circuit.
+    """
+
+    def __init__(self, name: str, targets: list[Target]):
+        self.name = name
+        self.targets = targets
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.local_routed = 0
+
+    def available(self) -> bool:
+        return any(target.provider.available for target in self.targets)
+
+    def prefer(self, provider: str, model: str):
+        """Moves (provider, model) to the front of the preference order, adding it if needed."""
+        target = next((t for t in self.targets if t.provider.name == provider and t.model == model), None)
+        if target is None:
+            target = Target(PROVIDERS[provider], model)
+        else:
+            self.targets.remove(target)
+        self.targets.insert(0, target)
+
+    async def complete(self, prompt: str, route_hint: str | None = None, **params) -> str:
+        async def attempt(target: Target) -> str:
+            limiter = await _acquire_slot(target)
+            started = time.monotonic()
+            target.begin()
+            try:
+                result = await target.provider.complete(target.model, prompt, **params)
+            except asyncio.CancelledError:
+                target.record_cancel()
+                observe_llm(target.provider.name, target.model, "complete", "cancelled", time.monotonic() - started)
+                raise
+            except Exception:
+                target.record_failure()
+                observe_llm(target.provider.name, target.model, "complete", "error", time.monotonic() - started)
+                raise
+            finally:
+                _release_slot(limiter, started)
+            latency = time.monotonic() - started
+            target.record_success("complete", latency)
+            _observe_latency(target, "complete", latency)
+            observe_llm(target.provider.name, target.model, "complete", "ok", latency, estimate_tokens(prompt), estimate_tokens(result))
+            return result
+        with stage("llm"):
+            return await self._run("complete", attempt, simple=is_simple_query(route_hint))
+
+    async def stream(self, prompt: str, route_hint: str | None = None, **params) -> AsyncIterator[str]:
+        async def attempt(target: Target) -> tuple[Target, AsyncIterator[str], str, float, AdaptiveLimiter | None]:
+            # The slot is held until the stream is closed
+            limiter = await _acquire_slot(target)
+            started = time.monotonic()
+            target.begin()
+            chunks = target.provider.stream(target.model, prompt, **params)
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = ""
+            except asyncio.CancelledError:
+                target.record_cancel()
+                observe_llm(target.provider.name, target.model, "stream", "cancelled", time.monotonic() - started)
+                await chunks.aclose()
+                _release_slot(limiter, started)
+                raise
+            except Exception:
+                target.record_failure()
+                observe_llm(target.provider.name, target.model, "stream", "error", time.monotonic() - started)
+                await chunks.aclose()
+                _release_slot(limiter, started)
+                raise
+            latency = time.monotonic() - started
+            target.record_success("stream", latency)
+            _observe_latency(target, "stream", latency)
+            observe_first_token(target.provider.name, target.model, latency)
+            return target, chunks, first, started, limiter
+
+        async def discard(opened):
+            try:
+                await opened[1].aclose()
+            finally:
+                _release_slot(opened[4], opened[3])
+
+        with stage("llm_first_token"):
+            target, chunks, first, started, limiter = await self._run("stream", attempt, discard, simple=is_simple_query(route_hint))
+        produced = [first]
+        outcome = "cancelled"
+        try:
+            if first:
+                yield first
+            async for chunk in chunks:
+                produced.append(chunk)
+                yield chunk
+            outcome = "ok"
+        except Exception:
+            target.record_failure()
+            outcome = "error"
+            raise
+        finally:
+            try:
+                await chunks.aclose()
+            finally:
+                _release_slot(limiter, started)
+            tokens = (estimate_tokens(prompt), estimate_tokens("".join(produced))) if outcome == "ok" else (0, 0)
+            observe_llm(target.provider.name, target.model, "stream", outcome, time.monotonic() - started, *tokens)
+
+    def stats(self) -> dict:
+        return {
+            "targets": {target.name: target.stats() for target in self.targets},
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "local_routed": self.local_routed,
+        }
+
+    def _rank(self, kind: str, simple: bool = False) -> list[Target]:
+        healthy = [target for target in self.targets if target.accepts()]
+        slow_after = settings.router_slow_p95_ms / 1000
+        fast = [t for t in healthy if (t.percentile(kind, 95) or 0.0) <= slow_after]
+        slow = sorted((t for t in healthy if t not in fast), key=lambda t: t.percentile(kind, 95))
+        ranked = fast + slow
+        local = [t for t in ranked if t.provider.local]
+        remote = [t for t in ranked if not t.provider.local]
+        return local + remote if simple else remote + local
+
+    async def _run(self, kind: str, attempt: Callable[[Target], Awaitable[Any]], discard: Callable[[Any], Awaitable[None]] | None = None, simple: bool = False) -> Any:
+        ranked = self._rank(kind, simple)
+        if not ranked:
+            raise RuntimeError(f"No healthy {self.name} provider is available.")
+        if ranked[0].provider.local:
+            self.local_routed += 1
+        tried: set[Target] = set()
+        try:
+            return await self._hedged(kind, ranked, attempt, discard, tried)
+        except Exception as e:
+            error = e
+        # Fail over through the remaining targets, best first
+        while (backup := next((t for t in self._rank(kind, simple) if t not in tried), None)) is not None:
+            tried.add(backup)
+            backup.claim()
+            self.failovers += 1
+            logger.warning(f"{self.name} request failed, failing over to {backup.name}: {error}")
+            try:
+                return await attempt(backup)
+            except Exception as e:
+                error = e
+        raise error
+
+    async def _hedged(self, kind: str, ranked: list[Target], attempt, discard, tried: set[Target]) -> Any:
+        primary = ranked[0]
+        tried.add(primary)
+        primary.claim()
+        first = asyncio.create_task(attempt(primary))
+        delay = None
+        if settings.router_hedge_enabled:
+            delay = primary.percentile(kind, settings.router_hedge_percentile)
+        if delay is None:
+            return await first
+
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=max(delay, settings.router_hedge_min_delay_ms / 1000))
+            if not done:
+                backup = ranked[1] if len(ranked) > 1 else primary
+                tried.add(backup)
+                backup.claim()
+                self.hedges += 1
+                pending.add(asyncio.create_task(attempt(backup)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                if winners:
+                    if winners[0] is not first:
+                        self.hedge_wins += 1
+                    for extra in winners[1:]:
+                        if discard is not None:
+                            await discard(extra.result())
+                    return winners[0].result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+async def _acquire_slot(target: Target) -> AdaptiveLimiter | None:
+    # A local model generates one request at a time under its own lock
+    if not settings.rate_limit_enabled or target.provider.local:
+        return None
+    try:
+        return await acquire_slot(target.provider.name)
+    except BaseException:
+        # A shed attempt never started: give back a claimed probe
+        target.record_cancel()
+        raise
+
+def _release_slot(limiter: AdaptiveLimiter | None, started: float):
+    if limiter is not None:
+        limiter.release(time.monotonic() - started)
+
+def _observe_latency(target: Target, kind: str, latency: float):
+    # Upstream call latency, not endpoint latency, drives the provider's
+    # concurrency limit: replies served without a call never reach here
+    if settings.rate_limit_enabled and not target.provider.local:
+        get_provider_limiter(target.provider.name).observe(latency, f"{target.model}:{kind}")
+
+def is_simple_query(query: str | None) -> bool:
+    """Short questions without code blocks or pasted traces are answered well by a small local model."""
+    return bool(query) and estimate_tokens(query) <= settings.local_max_query_tokens and "```" not in query and query.count("\n") < 3
+
+def _parse_targets(spec: str, default: list[str]) -> list[Target]:
+    targets = []
+    for entry in [item.strip() for item in spec.split(",") if item.strip()] or default:
+        provider, _, model = entry.partition(":")
+        if provider not in PROVIDERS or not model:
+            raise ValueError(f"Invalid provider target '{entry}'; expected provider:model with provider in {sorted(PROVIDERS)}.")
+        targets.append(Target(PROVIDERS[provider], model))
+    # A configured local model joins every router unless it is listed explicitly
+    if settings.local_model_path and not any(t.provider.local for t in targets):
+        targets.append(Target(PROVIDERS["local"], os.path.splitext(os.path.basename(settings.local_model_path))[0]))
+    return targets
+
+tutor_router = ProviderRouter("tutor", _parse_targets(settings.tutor_targets, [f"together:{settings.tutor_model}"]))
+debugger_router = ProviderRouter(
+    "debugger",
+    _parse_targets(settings.debugger_targets, [f"gemini:{settings.default_model}", f"gemini:{FALLBACK_MODEL}"]),
+)
@@ -1,9 +1,353 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import AsyncIterator, Iterator
+import numpy as np
+from app.config import settings
 from app.logger import logger
+from app.services.embeddings import get_embedder
+from app.services.lexical_index import LexicalIndex
+from app.services.reranker import get_reranker
+from app.services.vector_index import VectorIndex
 
-async def query_rag(query: str) -> list:
-    logger.info(f"RAG service queried with: '{query}'")
-    # Placeholder for actual RAG logic (e.g., querying a vector database)
-    return [
-        {"source": "doc/placeholder.txt", "content": "This is a placeholder RAG result."}
+# --- Chunking ---
+def chunk_text(text: str, size: int, overlap: int) -> list[str]:
+    """
+    Splits text into chunks of at most `size` characters.
+    Paragraphs are packed together where they fit; longer paragraphs are
+    split into overlapping windows.
+    """
+    chunks, current = [], ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(current) + len(paragraph) + 2 <= size:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+            continue
+        if current:
+            chunks.append(current)
+            current = ""
+        if len(paragraph) <= size:
+            current = paragraph
+        else:
+            step = max(1, size - overlap)
+            chunks.extend(paragraph[i:i + size] for i in range(0, len(paragraph) - overlap, step))
+    if current:
+        chunks.append(current)
+    return chunks
+
+# --- Chunk storage ---
+class ChunkStore:
+    """
+    Read-only chunk records in a JSON-lines file, addressed by byte offset.
+    The file is memory-mapped so only the records actually returned are read.
+    """
+
+    def __init__(self, path: str):
+        self._offsets = np.load(os.path.join(path, "chunk_offsets.npy"))
+        self._file = open(os.path.join(path, "chunks.jsonl"), "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if len(self._offsets) > 1 else b""
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def get(self, chunk_id: int) -> dict:
+        return json.loads(self._data[self._offsets[chunk_id]:self._offsets[chunk_id + 1]])
+
+    @staticmethod
+    def write(path: str, records: list[dict]):
+        os.makedirs(path, exist_ok=True)
+        offsets = [0]
+        with open(os.path.join(path, "chunks.jsonl"), "wb") as f:
+            for record in records:
+                line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(os.path.join(path, "chunk_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+# --- Ingestion ---
+# The index directory holds one sub-directory per generation plus a CURRENT
+# file naming the live one. Each ingest writes a complete new generation and
+# then replaces CURRENT atomically, so queries keep using the previous
+# generation until the swap.
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+def _scan_sources(source_dir: str) -> dict[str, str]:
+    """Returns {relative path: sha256 of contents} for every ingestible file."""
+    extensions = tuple(settings.rag_file_extensions.split(","))
+    hashes = {}
+    for root, _, files in os.walk(source_dir):
+        for name in sorted(files):
+            if name.endswith(extensions):
+                path = os.path.join(root, name)
+                with open(path, "rb") as f:
+                    hashes[os.path.relpath(path, source_dir)] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+def embed_in_batches(texts: list[str]) -> np.ndarray:
+    embedder = get_embedder()
+    batch_size = settings.embedding_batch_size
+    vectors = np.empty((len(texts), embedder.dim), dtype=np.float32)
+    for start in range(0, len(texts), batch_size):
+        vectors[start:start + batch_size] = embedder.embed(texts[start:start + batch_size])
+    return vectors
+
+def _process_file(source_dir: str, source: str) -> tuple[str, list[dict], np.ndarray]:
+    """Chunks and embeds one file. Runs in the ingestion process pool."""
+    with open(os.path.join(source_dir, source), encoding="utf-8", errors="replace") as f:
+        chunks = chunk_text(f.read(), settings.rag_chunk_size, settings.rag_chunk_overlap)
+    records = [{"source": source, "chunk": position, "content": chunk} for position, chunk in enumerate(chunks)]
+    return source, records, embed_in_batches(chunks)
+
+def current_generation(index_dir: str) -> str | None:
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def build_index(source_dir: str, index_dir: str | None = None, workers: int | None = None) -> Iterator[dict]:
+    """
+    Incrementally rebuilds the index for source_dir, yielding progress events.
+    Only files whose content hash changed are re-chunked and re-embedded,
+    in a process pool; vectors of deleted files are dropped.
+    """
+    index_dir = index_dir or settings.rag_index_dir
+    workers = workers or settings.rag_ingest_workers
+    started = time.perf_counter()
+
+    previous = current_generation(index_dir)
+    old_manifest, old_index, old_chunks, old_lexical = {}, None, None, None
+    if previous:
+        previous_dir = os.path.join(index_dir, previous)
+        with open(os.path.join(previous_dir, MANIFEST_FILE)) as f:
+            old_manifest = json.load(f)
+        if old_manifest.get("dim") == get_embedder().dim:
+            old_index, old_chunks = VectorIndex.load(previous_dir), ChunkStore(previous_dir)
+            old_lexical = LexicalIndex.load(previous_dir)
+        else:
+            old_manifest = {}
+
+    hashes = _scan_sources(source_dir)
+    old_files = old_manifest.get("files", {})
+    changed = [source for source, digest in hashes.items() if old_files.get(source, {}).get("hash") != digest]
+    deleted = [source for source in old_files if source not in hashes]
+    yield {"stage": "scan", "files": len(hashes), "changed": len(changed), "deleted": len(deleted)}
+
+    # Chunk and embed changed files in parallel
+    processed: dict[str, tuple[list[dict], np.ndarray]] = {}
+    if changed:
+        if workers > 1 and len(changed) > 1:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                futures = [pool.submit(_process_file, source_dir, source) for source in changed]
+                for future in as_completed(futures):
+                    source, records, vectors = future.result()
+                    processed[source] = (records, vectors)
+                    yield {"stage": "embed", "done": len(processed), "total": len(changed), "source": source}
+        else:
+            for source in changed:
+                _, records, vectors = _process_file(source_dir, source)
+                processed[source] = (records, vectors)
+                yield {"stage": "embed", "done": len(processed), "total": len(changed), "source": source}
+
+    # Assemble the new generation, reusing stored vectors and postings of unchanged files
+    records, vector_parts, files = [], [], {}
+    new_texts: dict[int, str] = {}
+    doc_map = np.full(len(old_chunks) if old_chunks else 0, -1, dtype=np.int64)
+    for source in sorted(hashes):
+        if source in processed:
+            file_records, file_vectors = processed[source]
+            new_texts.update((len(records) + i, record["content"]) for i, record in enumerate(file_records))
+        else:
+            entry = old_files[source]
+            chunk_ids = np.arange(entry["start"], entry["end"])
+            file_records = [old_chunks.get(int(chunk_id)) for chunk_id in chunk_ids]
+            file_vectors = old_index.get_vectors(chunk_ids)
+            doc_map[chunk_ids] = np.arange(len(records), len(records) + len(chunk_ids))
+        files[source] = {"hash": hashes[source], "start": len(records), "end": len(records) + len(file_records)}
+        records.extend(file_records)
+        vector_parts.append(file_vectors)
+
+    dim = get_embedder().dim
+    vectors = np.concatenate(vector_parts) if vector_parts else np.empty((0, dim), dtype=np.float32)
+    yield {"stage": "index", "chunks": len(records)}
+
+    # Keep the trained lists unless the corpus size changed substantially
+    centroids = None
+    if old_index is not None and len(records) and 0.5 <= len(records) / max(1, len(old_index)) <= 2:
+        centroids = old_index.centroids
+    generation = f"gen-{time.time_ns()}"
+    generation_dir = os.path.join(index_dir, generation)
+    if len(records):
+        VectorIndex.build(vectors, np.arange(len(records)), centroids=centroids).save(generation_dir)
+    else:
+        VectorIndex(np.zeros((1, dim), dtype=np.float32), np.zeros(2, dtype=np.int64), vectors, np.empty(0, dtype=np.int64)).save(generation_dir)
+    LexicalIndex.build(len(records), new_texts, old_lexical, doc_map).save(generation_dir)
+    ChunkStore.write(generation_dir, records)
+    with open(os.path.join(generation_dir, MANIFEST_FILE), "w") as f:
+        json.dump({"dim": dim, "files": files}, f)
+
+    _swap_generation(index_dir, generation)
+    _prune_generations(index_dir, keep={generation, previous})
+
+    summary = {
+        "stage": "done",
+        "generation": generation,
+        "files": len(hashes),
+        "changed": len(changed),
+        "deleted": len(deleted),
+        "chunks": len(records),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+    logger.info(f"Built RAG index generation {generation}: {summary}")
+    yield summary
+
+def _swap_generation(index_dir: str, generation: str):
+    tmp_path = os.path.join(index_dir, f"{CURRENT_FILE}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(generation)
+    os.replace(tmp_path, os.path.join(index_dir, CURRENT_FILE))
+
+def _prune_generations(index_dir: str, keep: set):
+    # Workers that still map an old generation keep their open files on POSIX
+    for name in os.listdir(index_dir):
+        if name.startswith("gen-") and name not in keep:
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+
+_ingest_lock = threading.Lock()
+
+def ingest_running() -> bool:
+    return _ingest_lock.locked()
+
+def start_ingest(source_dir: str | None = None) -> AsyncIterator[dict] | None:
+    """
+    Starts build_index in a worker thread and returns an iterator over its
+    progress events, or None if an ingestion is already running. The worker
+    holds the ingestion lock and loads the new generation itself, so the
+    build finishes even if no one listens.
+    """
+    if not _ingest_lock.acquire(blocking=False):
+        return None
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def run():
+        try:
+            for event in build_index(source_dir or settings.rag_source_dir):
+                if event["stage"] == "done":
+                    load_index()
+                loop.call_soon_threadsafe(events.put_nowait, event)
+        except Exception as e:
+            logger.error(f"RAG ingestion failed: {e}", exc_info=True)
+            loop.call_soon_threadsafe(events.put_nowait, {"stage": "error", "detail": "Ingestion failed."})
+        finally:
+            _ingest_lock.release()
+            loop.call_soon_threadsafe(events.put_nowait, None)
+
+    loop.run_in_executor(None, run)
+    return _relay(events)
+
+async def _relay(events: asyncio.Queue) -> AsyncIterator[dict]:
+    while (event := await events.get()) is not None:
+        yield event
+
+# --- Query ---
+_index: VectorIndex | None = None
+_lexical: LexicalIndex | None = None
+_chunks: ChunkStore | None = None
+_generation: str | None = None
+_checked_at = 0.0
+# Searches run in worker threads; one of them loads a new generation at a time
+_load_lock = threading.Lock()
+
+def load_index(index_dir: str | None = None) -> bool:
+    """
+    Memory-maps the current generation if it changed since the last load.
+    Returns False if no index has been built yet.
+    """
+    global _index, _lexical, _chunks, _generation
+    index_dir = index_dir or settings.rag_index_dir
+    generation = current_generation(index_dir)
+    if generation is None:
+        return False
+    with _load_lock:
+        if generation != _generation:
+            generation_dir = os.path.join(index_dir, generation)
+            # Swapped in one assignment, so a concurrent search sees one generation
+            _index, _chunks, _lexical, _generation = (
+                VectorIndex.load(generation_dir), ChunkStore(generation_dir), LexicalIndex.load(generation_dir), generation
+            )
+    return True
+
+def loaded_generation() -> str | None:
+    """The index generation this worker has mapped, or None before the first load."""
+    return _generation
+
+def _refresh_index() -> bool:
+    """Picks up a generation swapped in by another process, at most once a second."""
+    global _checked_at
+    now = time.monotonic()
+    if _index is None or now - _checked_at >= 1.0:
+        _checked_at = now
+        return load_index()
+    return True
+
+def search(query: str, k: int, rerank: bool = True) -> list[dict]:
+    """
+    Hybrid retrieval: vector and BM25 candidates are merged with reciprocal
+    rank fusion, then optionally re-ranked by a cross-encoder within
+    rag_rerank_budget_ms.
+    """
+    if not _refresh_index():
+        return []
+    index, lexical, chunks = _index, _lexical, _chunks
+    candidates = max(k, settings.rag_candidates)
+
+    query_vector = get_embedder().embed([query])[0]
+    rankings = {"vector": index.search(query_vector, candidates, settings.rag_nprobe)}
+    if lexical is not None:
+        rankings["bm25"] = lexical.search(query, candidates)
+
+    fused: dict[int, dict] = {}
+    for name, (ids, scores) in rankings.items():
+        for rank, (chunk_id, score) in enumerate(zip(ids.tolist(), scores.tolist())):
+            entry = fused.setdefault(chunk_id, {"score": 0.0})
+            entry["score"] += 1.0 / (settings.rag_rrf_k + rank + 1)
+            entry[f"{name}_score"] = round(score, 4)
+
+    ranked = sorted(fused.items(), key=lambda item: item[1]["score"], reverse=True)
+    reranker = get_reranker() if rerank else None
+    limit = candidates if reranker else k
+    results = [
+        {**chunks.get(chunk_id), **entry, "score": round(entry["score"], 5)}
+        for chunk_id, entry in ranked[:limit]
     ]
+    if reranker:
+        results = reranker.rerank(query, results, settings.rag_rerank_budget_ms)
+    return results[:k]
+
+async def query_rag(query: str, k: int | None = None) -> list:
+    logger.debug("RAG service queried (%d chars)", len(query))
+    # Embedding, the index scans and re-ranking are CPU-bound; keep them off the event loop
+    return await asyncio.to_thread(search, query, k or settings.rag_top_k)
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally build the RAG index from a directory of documents.")
+    parser.add_argument("source_dir", nargs="?", default=settings.rag_source_dir)
+    parser.add_argument("--index-dir", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    for event in build_index(args.source_dir, args.index_dir, args.workers):
+        print(json.dumps(event))
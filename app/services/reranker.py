@@ -0,0 +1,52 @@
+import threading
+import time
+from app.config import settings
+from app.logger import logger
+
+class CrossEncoderReranker:
+    """
+    Re-scores (query, passage) pairs with a local sentence-transformers
+    cross-encoder on CPU, in small batches, until a latency budget is spent.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 8):
+        from sentence_transformers import CrossEncoder
+        self._model = CrossEncoder(model_name, device="cpu")
+        self._batch_size = batch_size
+
+    def rerank(self, query: str, results: list[dict], budget_ms: float) -> list[dict]:
+        """
+        Returns results re-ordered by cross-encoder score. Candidates that
+        were not scored before the budget ran out keep their order after
+        the scored ones.
+        """
+        deadline = time.perf_counter() + budget_ms / 1000
+        scored = []
+        for start in range(0, len(results), self._batch_size):
+            if time.perf_counter() >= deadline:
+                break
+            batch = results[start:start + self._batch_size]
+            scores = self._model.predict([(query, result["content"]) for result in batch])
+            scored.extend({**result, "rerank_score": round(float(score), 4)} for result, score in zip(batch, scores))
+        scored.sort(key=lambda result: result["rerank_score"], reverse=True)
+        return scored + results[len(scored):]
+
+_reranker = None
+_reranker_loaded = False
+_reranker_lock = threading.Lock()
+
+def get_reranker() -> CrossEncoderReranker | None:
+    """Returns the configured cross-encoder, or None if re-ranking is disabled or unavailable."""
+    global _reranker, _reranker_loaded
+    if not _reranker_loaded:
+        # Retrieval runs in worker threads: load the model once
+        with _reranker_lock:
+            if not _reranker_loaded:
+                if settings.rag_reranker_model:
+                    try:
+                        _reranker = CrossEncoderReranker(settings.rag_reranker_model)
+                        logger.info(f"Loaded re-ranking model: {settings.rag_reranker_model}")
+                    except ImportError:
+                        logger.warning("sentence-transformers is not installed; re-ranking is disabled.")
+                _reranker_loaded = True
+    return _reranker
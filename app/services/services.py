@@ -1,7 +1,15 @@
 # This file is for any common utility functions that might be shared
 # across different services, such as text cleaning, data formatting, etc.
+import orjson
 
 def sanitize_input(text: str) -> str:
     """A simple example of a shared utility function."""
     return text.strip()
 
+# Headers for Server-Sent-Events responses; disables proxy buffering so
+# events reach the client as soon as they are yielded.
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def format_sse(event: str, data) -> str:
+    """Formats one Server-Sent-Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
@@ -0,0 +1,128 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable
+from app.logger import logger
+
+class _StreamFlight:
+    """One shared upstream token stream, the tokens it has produced so far and how far each subscriber has read."""
+
+    def __init__(self):
+        self.tokens: list[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Event()
+        self.consumed = asyncio.Event()
+        self.positions: dict[object, int] = {}
+        self.task: asyncio.Task | None = None
+
+    @property
+    def subscribers(self) -> int:
+        return len(self.positions)
+
+    def lag(self) -> int:
+        """Tokens produced that the slowest subscriber has not read yet."""
+        return len(self.tokens) - min(self.positions.values(), default=len(self.tokens))
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into one upstream call.
+    The first caller for a key (the leader) starts the call; callers that
+    arrive while it is in flight wait for the same result. Streams are fanned
+    out: every subscriber receives all tokens from the start, and the upstream
+    stream is closed once the last subscriber leaves. The upstream is read at
+    most read_ahead tokens ahead of the slowest subscriber, so a slow client
+    still applies backpressure to a shared stream.
+    Keys are only shared while a call is in flight; completed results are the
+    response cache's job.
+    """
+
+    def __init__(self, name: str, read_ahead: int = 32):
+        self.name = name
+        self.read_ahead = read_ahead
+        self._calls: dict[str, asyncio.Future] = {}
+        self._streams: dict[str, _StreamFlight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = self._calls[key] = asyncio.ensure_future(factory())
+            task.add_done_callback(lambda t: self._finish_call(key, t))
+        else:
+            self.coalesced += 1
+            logger.debug("Coalesced request onto in-flight %s call", self.name)
+        # A cancelled or timed-out waiter must not cancel the shared call
+        return await asyncio.shield(task)
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        flight = self._streams.get(key)
+        if flight is None:
+            self.leaders += 1
+            flight = self._streams[key] = _StreamFlight()
+            flight.task = asyncio.create_task(self._pump(key, flight, factory))
+        else:
+            self.coalesced += 1
+            logger.debug("Attached subscriber to in-flight %s stream", self.name)
+
+        subscriber = object()
+        flight.positions[subscriber] = position = 0
+        try:
+            while True:
+                while position < len(flight.tokens):
+                    yield flight.tokens[position]
+                    # The caller came back for the next token: this one is consumed
+                    position += 1
+                    flight.positions[subscriber] = position
+                    flight.consumed.set()
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                flight.changed.clear()
+                await flight.changed.wait()
+        finally:
+            del flight.positions[subscriber]
+            flight.consumed.set()
+            if flight.subscribers == 0 and not flight.done:
+                self._drop_stream(key, flight)
+                flight.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight_calls": len(self._calls),
+            "in_flight_streams": len(self._streams),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+    async def _pump(self, key: str, flight: _StreamFlight, factory: Callable[[], AsyncIterator[str]]):
+        tokens = factory()
+        try:
+            async for token in tokens:
+                flight.tokens.append(token)
+                flight.changed.set()
+                # Pull the next token only once the slowest subscriber is close enough
+                while flight.lag() >= self.read_ahead:
+                    flight.consumed.clear()
+                    await flight.consumed.wait()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.changed.set()
+            self._drop_stream(key, flight)
+            await tokens.aclose()
+
+    def _drop_stream(self, key: str, flight: _StreamFlight):
+        if self._streams.get(key) is flight:
+            del self._streams[key]
+
+    def _finish_call(self, key: str, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved when every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+llm_flights = SingleFlight("llm")
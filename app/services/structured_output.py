@@ -0,0 +1,220 @@
+import re
+from typing import Annotated
+import orjson
+from pydantic import BeforeValidator, TypeAdapter, ValidationError
+from app.logger import logger
+
+# --- Tutor response schema ---
+def _string_list(value):
+    # Models sometimes send one string, or objects, where a list of strings is asked for
+    if isinstance(value, str):
+        return [value] if value.strip() else []
+    if isinstance(value, list):
+        return [item if isinstance(item, str) else orjson.dumps(item).decode() for item in value]
+    return value
+
+StringList = Annotated[list[str], BeforeValidator(_string_list)]
+
+# Validators are built once at import; each field is checked as soon as it is complete
+TUTOR_FIELDS = {
+    "explanation": TypeAdapter(str),
+    "stepsToFix": TypeAdapter(StringList),
+    "resources": TypeAdapter(StringList),
+}
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_FENCE_RE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+
+class TutorResponseParser:
+    """
+    Incremental parser for the tutor's JSON answer, fed as chunks arrive.
+
+    A small scanner tracks the JSON structure, skipping any text or code
+    fence before the first "{" and everything after the object closes. Each
+    top-level field is parsed and validated against the schema as soon as its
+    value is complete, so at the end of a stream only the last, possibly
+    truncated, field is left: its open strings and brackets are closed in
+    place instead of re-querying the model.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._started = False
+        self._done = False
+        self._preamble = False
+        self._stack: list[str] = []
+        self._expect: list[str] = []  # per open container: key, colon, value or comma
+        self._in_string = False
+        self._string_is_key = False
+        self._string_start = 0
+        self._escape = False
+        self._in_literal = False
+        self._key: str | None = None
+        self._value_start: int | None = None
+        self.fields: dict = {}
+        self.violations: list[str] = []
+
+    def feed(self, chunk: str):
+        self._text += chunk
+        text, i = self._text, self._pos
+        while i < len(text) and not self._done:
+            if not self._started:
+                brace = text.find("{", i)
+                if brace < 0:
+                    self._preamble = self._preamble or bool(text[i:].strip())
+                    i = len(text)
+                    break
+                self._preamble = self._preamble or bool(text[i:brace].strip())
+                self._started = True
+                self._stack.append("{")
+                self._expect.append("key")
+                i = brace + 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    i += 1
+                    continue
+                match = _STRING_SPECIAL.search(text, i)
+                if match is None:
+                    i = len(text)
+                    break
+                i = match.start()
+                if text[i] == "\\":
+                    self._escape = True
+                    i += 1
+                    continue
+                self._in_string = False
+                if self._string_is_key:
+                    if len(self._stack) == 1:
+                        self._key = _loads_or_none(text[self._string_start:i + 1])
+                    self._expect[-1] = "colon"
+                else:
+                    self._value_done(i + 1)
+                i += 1
+                continue
+
+            char = text[i]
+            if self._in_literal:
+                if char in ",}] \t\r\n":
+                    self._in_literal = False
+                    self._value_done(i)
+                else:
+                    i += 1
+                    continue
+            if char in " \t\r\n":
+                pass
+            elif char == '"':
+                self._in_string = True
+                self._string_is_key = self._stack[-1] == "{" and self._expect[-1] == "key"
+                self._string_start = i
+                if not self._string_is_key:
+                    self._value_begins(i)
+            elif char in "{[":
+                self._value_begins(i)
+                self._stack.append(char)
+                self._expect.append("key" if char == "{" else "value")
+            elif char in "}]":
+                self._stack.pop()
+                self._expect.pop()
+                if not self._stack:
+                    self._done = True
+                else:
+                    self._value_done(i + 1)
+            elif char == ",":
+                self._expect[-1] = "key" if self._stack[-1] == "{" else "value"
+            elif char == ":":
+                self._expect[-1] = "value"
+            else:
+                self._value_begins(i)
+                self._in_literal = True
+            i += 1
+        self._pos = i
+
+    def result(self) -> tuple[dict | None, str]:
+        """
+        Returns the validated response and whether it was "valid" as sent or
+        "repaired" (fenced, wrapped in prose, or truncated), or (None,
+        "invalid") when no explanation could be recovered.
+        """
+        fields = dict(self.fields)
+        if not self._done and self._key in TUTOR_FIELDS and self._key not in fields and self._value_start is not None:
+            value = self._close_partial_value()
+            if value is not None:
+                self._validate_field(self._key, value, fields)
+        if "explanation" not in fields:
+            return None, "invalid"
+        response = {"explanation": fields["explanation"], "stepsToFix": fields.get("stepsToFix", []), "resources": fields.get("resources", [])}
+        repaired = self._preamble or not self._done or bool(self.violations)
+        return response, "repaired" if repaired else "valid"
+
+    def _value_begins(self, index: int):
+        if len(self._stack) == 1 and self._expect[-1] == "value":
+            self._value_start = index
+        self._expect[-1] = "comma"
+
+    def _value_done(self, end: int):
+        self._expect[-1] = "comma"
+        if len(self._stack) == 1 and self._value_start is not None:
+            key, start = self._key, self._value_start
+            self._key, self._value_start = None, None
+            if key in TUTOR_FIELDS:
+                try:
+                    value = orjson.loads(self._text[start:end])
+                except orjson.JSONDecodeError:
+                    self.violations.append(f"{key}: not valid JSON")
+                    return
+                self._validate_field(key, value, self.fields)
+
+    def _validate_field(self, key: str, value, fields: dict):
+        try:
+            fields[key] = TUTOR_FIELDS[key].validate_python(value)
+        except ValidationError as e:
+            self.violations.append(f"{key}: {e.errors()[0]['msg']}")
+
+    def _close_partial_value(self):
+        # Close the open string and containers of the truncated last field
+        text = self._text[self._value_start:]
+        if self._in_string and len(self._stack) > 1:
+            # A cut-off list item (a half URL) is dropped rather than kept
+            text = text[:self._string_start - self._value_start]
+        elif self._in_string:
+            if self._escape:
+                text = text[:-1]
+            text = re.sub(r"\\u[0-9a-fA-F]{0,3}$", "", text) + '"'
+        elif self._in_literal:
+            return None
+        closers = "".join("}" if opener == "{" else "]" for opener in reversed(self._stack[1:]))
+        text = text.rstrip().rstrip(",")
+        if text.endswith(":"):
+            return None
+        return _loads_or_none(text + closers)
+
+def _loads_or_none(text: str):
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return None
+
+def parse_tutor_response(text: str) -> tuple[dict | None, str]:
+    """Parses a complete tutor answer; see TutorResponseParser.result."""
+    # Most answers are well-formed: one orjson call, then the field validators
+    value = _loads_or_none(text)
+    if isinstance(value, dict) and isinstance(value.get("explanation"), str):
+        try:
+            response = {key: TUTOR_FIELDS[key].validate_python(value.get(key, [])) for key in TUTOR_FIELDS}
+            return response, "valid"
+        except ValidationError:
+            pass
+    parser = TutorResponseParser()
+    parser.feed(text)
+    result, outcome = parser.result()
+    if parser.violations:
+        logger.debug("Tutor response schema violations: %s", parser.violations)
+    return result, outcome
+
+def fallback_response(text: str) -> dict:
+    """Keeps an answer that is not JSON at all as the explanation, rather than discarding it."""
+    return {"explanation": _FENCE_RE.sub("", text).strip(), "stepsToFix": [], "resources": []}
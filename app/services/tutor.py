@@ -1,48 +1,157 @@
-import json
-from app.logger import logger
-from app.memory import pop_error_context
-from app.model_loader import get_together_ai_client
-
-# Prompt templates from the VS Code backend
-DEBUG_PROMPT = """You are an AI coding tutor helping a user with a specific error.
-Format your response as a valid JSON object with ONLY the following keys: "explanation", "stepsToFix" (as an array of strings), and "resources" (as an array of relevant URLs).
-ERROR CONTEXT: {error_context}
-USER QUESTION: {question}"""
-
-TUTOR_PROMPT = """You are an AI coding tutor answering a general question.
-Format your response as a valid JSON object with ONLY the following keys: "explanation", "stepsToFix" (as an empty array), and "resources" (as an array of relevant URLs).
-USER QUESTION: {question}"""
-
-async def get_tutor_response(session_id: str, question: str) -> dict:
-    error_context = pop_error_context(session_id)
-    
-    if error_context:
-        prompt = DEBUG_PROMPT.format(
-            error_context=json.dumps(error_context, indent=2),
-            question=question
-        )
-    else:
-        prompt = TUTOR_PROMPT.format(question=question)
-        
-    return await _call_llm(prompt)
-
-async def _call_llm(prompt: str) -> dict:
-    client = get_together_ai_client()
-    if not client:
-        return {
-            "explanation": "Mock response: AI Tutor is not configured.",
-            "stepsToFix": ["Set TOGETHER_API_KEY in .env"],
-            "resources": []
-        }
-    
-    try:
-        response = client.chat.completions.create(
-            model="mistralai/Mixtral-8x7B-Instruct-v0.1",
-            messages=[{"role": "user", "content": prompt}],
-            response_format={"type": "json_object"},
-        )
-        return json.loads(response.choices[0].message.content)
-    except Exception as e:
-        logger.error(f"Error calling Together AI: {e}", exc_info=True)
-        raise Exception("Failed to communicate with the Tutor AI model.") from e
-
+import json
+from typing import AsyncIterator
+from app.config import settings
+from app.logger import logger
+from app.memory import pop_error_context
+from app.metrics import observe_structured_output, stage
+from app.model_loader import register_prompt_prefix
+from app.services.cache import response_cache
+from app.services.fix_index import error_signature, fix_index
+from app.services.limiter import AdmissionRejected
+from app.services.prompt_builder import fetch_context, token_budget
+from app.services.provider_router import tutor_router
+from app.services.single_flight import llm_flights
+from app.services.structured_output import TutorResponseParser, fallback_response, parse_tutor_response
+
+# Prompt templates from the VS Code backend
+DEBUG_PROMPT = """You are an AI coding tutor helping a user with a specific error.
+Format your response as a valid JSON object with ONLY the following keys: "explanation", "stepsToFix" (as an array of strings), and "resources" (as an array of relevant URLs).
+ERROR CONTEXT: {error_context}
+{reference}USER QUESTION: {question}"""
+
+TUTOR_PROMPT = """You are an AI coding tutor answering a general question.
+Format your response as a valid JSON object with ONLY the following keys: "explanation", "stepsToFix" (as an empty array), and "resources" (as an array of relevant URLs).
+{reference}USER QUESTION: {question}"""
+
+# The static heads of the templates stay warm in the local model's KV cache
+register_prompt_prefix(DEBUG_PROMPT.split("{")[0])
+register_prompt_prefix(TUTOR_PROMPT.split("{")[0])
+
+MOCK_RESPONSE = {
+    "explanation": "Mock response: AI Tutor is not configured.",
+    "stepsToFix": ["Set TOGETHER_API_KEY in .env"],
+    "resources": []
+}
+
+async def _error_context(session_id: str, question: str) -> tuple[dict | None, str | None]:
+    """Pops the session's error context and returns it with the fix index signature of it and the question."""
+    with stage("memory"):
+        error_context = await pop_error_context(session_id)
+    return error_context, error_signature(error_context, question) if error_context else None
+
+async def _build_prompt(question: str, error_context: dict | None) -> tuple[str, str | None]:
+    """
+    Returns the prompt and the text used for similarity caching.
+    Prompts with an error context are only cached by exact match.
+    """
+    context = await fetch_context(question, int(token_budget(settings.tutor_model) * settings.prompt_context_share))
+    reference = f"REFERENCE MATERIAL:\n{context}\n" if context else ""
+    
+    with stage("prompt"):
+        if error_context:
+            prompt = DEBUG_PROMPT.format(
+                error_context=json.dumps(error_context, indent=2),
+                reference=reference,
+                question=question
+            )
+            return prompt, None
+        return TUTOR_PROMPT.format(reference=reference, question=question), question
+
+async def get_tutor_response(session_id: str, question: str, use_cache: bool = True) -> dict:
+    error_context, signature = await _error_context(session_id, question)
+    # A known error is answered from the fix index, before retrieval and the model
+    if signature is not None and use_cache:
+        known = await fix_index.lookup(signature)
+        if known is not None:
+            return known
+    prompt, similar_text = await _build_prompt(question, error_context)
+    return await _call_llm(prompt, use_cache, similar_text, signature)
+
+async def stream_tutor_response(session_id: str, question: str, parser: TutorResponseParser | None = None) -> AsyncIterator[str]:
+    """
+    Yields the raw JSON text of the tutor response as it is generated, and
+    feeds it to parser. Concurrent streams for the same prompt share one
+    upstream stream. A known error's fix is sent whole, without the model.
+    """
+    parser = parser if parser is not None else TutorResponseParser()
+    error_context, signature = await _error_context(session_id, question)
+    if signature is not None:
+        known = await fix_index.lookup(signature)
+        if known is not None:
+            text = json.dumps(known)
+            parser.feed(text)
+            yield text
+            return
+
+    prompt, similar_text = await _build_prompt(question, error_context)
+    if not tutor_router.available():
+        text = json.dumps(MOCK_RESPONSE)
+        parser.feed(text)
+        yield text
+        return
+
+    key = response_cache.make_key("tutor", settings.tutor_model, prompt)
+    async for token in llm_flights.stream(key, lambda: _stream_llm(prompt, similar_text)):
+        parser.feed(token)
+        yield token
+    if signature is not None:
+        result, _ = parser.result()
+        if result is not None:
+            await fix_index.record(signature, result)
+
+async def _stream_llm(prompt: str, route_hint: str | None) -> AsyncIterator[str]:
+    try:
+        async for token in tutor_router.stream(prompt, route_hint, json_mode=True):
+            yield token
+    except AdmissionRejected:
+        # Shed by the provider's concurrency limiter; answered with a 503
+        raise
+    except Exception as e:
+        logger.error(f"Error streaming from the tutor provider: {e}", exc_info=True)
+        raise Exception("Failed to communicate with the Tutor AI model.") from e
+
+async def _call_llm(prompt: str, use_cache: bool = True, similar_text: str | None = None, signature: str | None = None) -> dict:
+    if not tutor_router.available():
+        return dict(MOCK_RESPONSE)
+
+    # Cached responses are stored already parsed
+    use_cache = use_cache and settings.response_cache_enabled
+    if use_cache:
+        cached = await response_cache.aget("tutor", settings.tutor_model, prompt, similar_text)
+        if cached is not None:
+            return cached
+    else:
+        response_cache.record_bypass()
+
+    # Identical prompts already in flight share one upstream call
+    key = response_cache.make_key("tutor", settings.tutor_model, prompt)
+    return await llm_flights.do(key, lambda: _complete(prompt, use_cache, similar_text, signature))
+
+async def _complete(prompt: str, use_cache: bool, similar_text: str | None, signature: str | None) -> dict:
+    try:
+        retries = settings.tutor_parse_retries
+        while True:
+            content = await tutor_router.complete(prompt, similar_text, json_mode=True)
+            with stage("parse"):
+                result, outcome = parse_tutor_response(content)
+            if result is not None or retries <= 0:
+                break
+            # Only an answer that cannot be repaired locally costs another upstream call
+            retries -= 1
+            observe_structured_output("retried")
+            logger.warning("Tutor response had no recoverable JSON answer; requesting it again.")
+        if result is None:
+            result, outcome = fallback_response(content), "fallback"
+        observe_structured_output(outcome)
+        if use_cache and outcome != "fallback":
+            await response_cache.aset("tutor", settings.tutor_model, prompt, result, similar_text)
+        # Only answers that passed schema validation are indexed
+        if signature is not None and outcome != "fallback":
+            await fix_index.record(signature, result)
+        return result
+    except AdmissionRejected:
+        # Shed by the provider's concurrency limiter; answered with a 503
+        raise
+    except Exception as e:
+        logger.error(f"Error calling the tutor provider: {e}", exc_info=True)
+        raise Exception("Failed to communicate with the Tutor AI model.") from e
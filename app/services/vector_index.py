@@ -0,0 +1,118 @@
+import json
+import os
+import numpy as np
+from app.logger import logger
+
+class VectorIndex:
+    """
+    Inverted-file (IVF) approximate nearest-neighbour index over unit vectors.
+
+    Vectors are partitioned into clusters with k-means and stored contiguously
+    by cluster, so searching the nprobe closest clusters only touches a few
+    contiguous slices. All arrays are saved as .npy files and opened with
+    mmap_mode="r": workers share one copy through the page cache and loading
+    does not read the vectors up front.
+    """
+
+    FILES = ("centroids.npy", "offsets.npy", "vectors.npy", "ids.npy")
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, vectors: np.ndarray, ids: np.ndarray):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.ids = ids
+        self._positions: np.ndarray | None = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, ids: np.ndarray, nlist: int | None = None, centroids: np.ndarray | None = None, seed: int = 0) -> "VectorIndex":
+        """
+        Builds an index over vectors. Passing the centroids of a previous
+        index skips k-means training and only reassigns vectors to lists.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n = len(vectors)
+        if centroids is None:
+            if nlist is None:
+                nlist = int(np.clip(np.sqrt(n), 1, 4096))
+            centroids = _kmeans(vectors, max(1, min(nlist, n)), seed=seed)
+        nlist = len(centroids)
+
+        assignments = _assign(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nlist)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(centroids, offsets, vectors[order], np.asarray(ids, dtype=np.int64)[order])
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        for name, array in zip(self.FILES, (self.centroids, self.offsets, self.vectors, self.ids)):
+            np.save(os.path.join(path, name), array)
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump({"count": len(self), "nlist": len(self.centroids), "dim": self.centroids.shape[1]}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex":
+        arrays = [np.load(os.path.join(path, name), mmap_mode="r") for name in cls.FILES]
+        # Centroids and offsets are tiny and read on every query; keep them in RAM
+        arrays[0] = np.array(arrays[0])
+        arrays[1] = np.array(arrays[1])
+        index = cls(*arrays)
+        logger.info(f"Loaded vector index from {path} ({len(index)} vectors, {len(index.centroids)} lists)")
+        return index
+
+    def get_vectors(self, ids: np.ndarray) -> np.ndarray:
+        """Returns the stored vectors for the given ids, in the same order."""
+        # The id -> position map is built on the first call; an index is never modified
+        if self._positions is None:
+            self._positions = np.empty(int(self.ids.max()) + 1 if len(self.ids) else 0, dtype=np.int64)
+            self._positions[self.ids] = np.arange(len(self.ids))
+        return np.asarray(self.vectors[self._positions[np.asarray(ids, dtype=np.int64)]])
+
+    def search(self, query: np.ndarray, k: int, nprobe: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns (ids, scores) of the top-k vectors by dot product, best first."""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        nprobe = min(nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+
+        best_ids, best_scores = [], []
+        for cluster in probe:
+            start, end = self.offsets[cluster], self.offsets[cluster + 1]
+            if start == end:
+                continue
+            scores = self.vectors[start:end] @ query
+            top = min(k, len(scores))
+            local = np.argpartition(-scores, top - 1)[:top]
+            best_scores.append(scores[local])
+            best_ids.append(self.ids[start:end][local])
+        if not best_scores:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        scores = np.concatenate(best_scores)
+        ids = np.concatenate(best_ids)
+        top = np.argsort(-scores)[:k]
+        return ids[top], scores[top]
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        assignments[start:start + batch_size] = np.argmax(vectors[start:start + batch_size] @ centroids.T, axis=1)
+    return assignments
+
+def _kmeans(vectors: np.ndarray, k: int, iterations: int = 10, sample_size: int = 50_000, seed: int = 0) -> np.ndarray:
+    """Spherical k-means trained on a random sample of the vectors."""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(sample_size, len(vectors)), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = np.bincount(assignments, minlength=k) == 0
+        sums[empty] = centroids[empty]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
@@ -0,0 +1,69 @@
+import asyncio
+import time
+from app.config import settings
+from app.logger import logger
+from app.model_loader import PROVIDERS, get_batch_client, get_local_model, get_together_ai_client, model_registry
+from app.services import debugger, rag
+from app.services.embeddings import get_embedder
+from app.services.provider_router import debugger_router, tutor_router
+from app.services.reranker import get_reranker
+
+def _gemini_models() -> list[str]:
+    return sorted({
+        target.model
+        for router in (tutor_router, debugger_router)
+        for target in router.targets
+        if target.provider.name == "gemini"
+    })
+
+def _load_gemini_models():
+    for model in _gemini_models():
+        model_registry.get_model(model)
+
+def _load_retrieval():
+    rag.load_index()
+    get_embedder().embed(["warm-up"])
+    get_reranker()
+
+async def _open_clients():
+    if PROVIDERS["together"].available:
+        get_together_ai_client()
+    if PROVIDERS["batch"].available:
+        get_batch_client()
+
+async def _load_local_model():
+    model = await get_local_model()
+    await asyncio.to_thread(model.warm_prefixes)
+
+async def _timed(name: str, step):
+    started = time.perf_counter()
+    try:
+        await step
+    except Exception as e:
+        # The request path loads the same things lazily, so a failed step only costs latency
+        logger.warning(f"Warm-up of {name} failed: {e}")
+        return
+    logger.info(f"Warmed up {name} in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+async def warm_up():
+    """
+    Startup hook that loads everything the first requests would otherwise
+    load lazily: provider SDKs and clients, the debugger chain, the RAG index
+    mapping and models, and the local model with its prefix caches. Steps run
+    concurrently, the blocking ones in threads, and the server starts
+    accepting requests once they are done.
+    """
+    if not settings.warmup_enabled:
+        return
+    started = time.perf_counter()
+    steps = {
+        "provider clients": _open_clients(),
+        "debugger chain": asyncio.to_thread(debugger.get_chain),
+        "retrieval": asyncio.to_thread(_load_retrieval),
+    }
+    if PROVIDERS["gemini"].available:
+        steps["Gemini models"] = asyncio.to_thread(_load_gemini_models)
+    if PROVIDERS["local"].available:
+        steps["local model"] = _load_local_model()
+    await asyncio.gather(*(_timed(name, step) for name, step in steps.items()))
+    logger.info(f"Warm-up finished in {(time.perf_counter() - started) * 1000:.0f} ms")
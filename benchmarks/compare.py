@@ -0,0 +1,74 @@
+"""
+Diffs two benchmarks.load_test result files.
+
+Every numeric metric under operations, overall and server is compared.
+throughput_rps is better when higher; latencies, errors, RSS and loop lag
+are better when lower, and request counts are shown but not judged. A
+metric regresses when it is worse by more than --threshold (relative) and
+by more than --min-delta (absolute, to ignore noise on tiny values). Exits
+with status 1 if anything regressed, so it can gate CI.
+
+Usage:
+    python -m benchmarks.compare baseline.json current.json [--threshold 0.1] [--min-delta 1.0]
+"""
+import argparse
+import json
+import sys
+
+HIGHER_IS_BETTER = {"throughput_rps"}
+INFORMATIONAL = {"requests"}
+
+def _flatten(result: dict) -> dict[str, float]:
+    metrics = {}
+    for section in ("operations", "overall", "server"):
+        stack = [(section, result.get(section, {}))]
+        while stack:
+            prefix, node = stack.pop()
+            for key, value in node.items():
+                if isinstance(value, dict):
+                    stack.append((f"{prefix}.{key}", value))
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metrics[f"{prefix}.{key}"] = float(value)
+    return metrics
+
+def compare(baseline: dict, current: dict, threshold: float, min_delta: float) -> tuple[list[tuple], list[str]]:
+    before, after = _flatten(baseline), _flatten(current)
+    rows, regressions = [], []
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        metric = name.rsplit(".", 1)[1]
+        change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+        status = ""
+        if metric not in INFORMATIONAL:
+            worse = old - new if metric in HIGHER_IS_BETTER else new - old
+            if worse > min_delta and (not old or worse / abs(old) > threshold):
+                status = "REGRESSED"
+                regressions.append(name)
+            elif -worse > min_delta and (not old or -worse / abs(old) > threshold):
+                status = "improved"
+        rows.append((name, old, new, change, status))
+    return rows, regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--min-delta", type=float, default=1.0)
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows, regressions = compare(baseline, current, args.threshold, args.min_delta)
+    width = max((len(row[0]) for row in rows), default=10)
+    print(f"{'metric':<{width}}  {'baseline':>10}  {'current':>10}  {'change':>8}")
+    for name, old, new, change, status in rows:
+        print(f"{name:<{width}}  {old:>10.1f}  {new:>10.1f}  {change:>+8.1%}  {status}")
+    for meta in ("commit", "rps", "seconds", "workers"):
+        if baseline.get("meta", {}).get(meta) != current.get("meta", {}).get(meta):
+            print(f"note: {meta} differs ({baseline['meta'].get(meta)} -> {current['meta'].get(meta)})")
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
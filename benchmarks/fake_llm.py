@@ -0,0 +1,138 @@
+"""
+Stand-in LLM server for load tests.
+
+Speaks the OpenAI-compatible API the backend uses for Together AI
+(/v1/chat/completions, streaming and not) and for batch servers
+(/v1/completions with a list of prompts). Every request waits a lognormal
+time-to-first-token around --ttft-ms, then produces --output-tokens tokens
+at --tokens-per-second; --error-rate of requests fail with a 500 and
+--overload-rate with a 429. JSON-mode requests get a valid tutor object.
+
+With --tls-cert and --tls-key it serves HTTPS, so the backend's upstream
+transport (TLS, connection reuse) can be tested locally by pointing
+UPSTREAM_CA_BUNDLE at the certificate. A self-signed one:
+    openssl req -x509 -newkey rsa:2048 -nodes -days 1 -subj /CN=localhost \
+        -addext subjectAltName=DNS:localhost,IP:127.0.0.1 -keyout key.pem -out cert.pem
+
+Usage:
+    python -m benchmarks.fake_llm [--port 9100] [--ttft-ms 300] [--tokens-per-second 80] [--error-rate 0.01]
+    python -m benchmarks.fake_llm --tls-cert cert.pem --tls-key key.pem
+"""
+import argparse
+import asyncio
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = "the error means a value was used before it was assigned so check the branch that sets it first".split()
+
+class Script:
+    def __init__(self, ttft_ms: float, tokens_per_second: float, output_tokens: int, error_rate: float, overload_rate: float, seed: int):
+        self.ttft_ms = ttft_ms
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.overload_rate = overload_rate
+        self._rng = random.Random(seed)
+        self.requests = 0
+        self.prompts = 0
+
+    def failure(self) -> JSONResponse | None:
+        roll = self._rng.random()
+        if roll < self.overload_rate:
+            return JSONResponse(status_code=429, content={"error": "rate limited"})
+        if roll < self.overload_rate + self.error_rate:
+            return JSONResponse(status_code=500, content={"error": "injected failure"})
+        return None
+
+    def first_token_delay(self) -> float:
+        return self._rng.lognormvariate(0, 0.3) * self.ttft_ms / 1000
+
+    def tokens(self, json_mode: bool) -> list[str]:
+        words = [self._rng.choice(WORDS) + " " for _ in range(self.output_tokens)]
+        if not json_mode:
+            return words
+        # Split the JSON text into as many pieces as there are tokens
+        text = json.dumps({"explanation": "".join(words).strip(), "stepsToFix": [], "resources": []})
+        size = max(1, len(text) // self.output_tokens)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    async def generate(self, json_mode: bool):
+        await asyncio.sleep(self.first_token_delay())
+        tokens = self.tokens(json_mode)
+        yield tokens[0]
+        interval = len(tokens) / self.tokens_per_second / max(1, len(tokens) - 1)
+        for token in tokens[1:]:
+            await asyncio.sleep(interval)
+            yield token
+
+def _json_mode(payload: dict) -> bool:
+    return payload.get("response_format", {}).get("type") == "json_object"
+
+def _sse(chunks, wrap) -> StreamingResponse:
+    async def events():
+        async for chunk in chunks:
+            yield f"data: {json.dumps(wrap(chunk))}\n\n"
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def create_app(script: Script) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        script.requests += 1
+        script.prompts += 1
+        failure = script.failure()
+        if failure is not None:
+            return failure
+        chunks = script.generate(_json_mode(payload))
+        if payload.get("stream"):
+            return _sse(chunks, lambda text: {"choices": [{"index": 0, "delta": {"content": text}}]})
+        content = "".join([chunk async for chunk in chunks])
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+
+    @app.post("/v1/completions")
+    async def completions(request: Request):
+        payload = await request.json()
+        prompts = payload["prompt"] if isinstance(payload["prompt"], list) else [payload["prompt"]]
+        script.requests += 1
+        script.prompts += len(prompts)
+        failure = script.failure()
+        if failure is not None:
+            return failure
+        json_mode = _json_mode(payload)
+        if payload.get("stream"):
+            return _sse(script.generate(json_mode), lambda text: {"choices": [{"index": 0, "text": text}]})
+        # A batch costs one generation; the server decodes the prompts together
+        await asyncio.sleep(script.first_token_delay() + script.output_tokens / script.tokens_per_second)
+        return {"choices": [{"index": i, "text": "".join(script.tokens(json_mode))} for i in range(len(prompts))]}
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": script.requests, "prompts": script.prompts}
+
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--output-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--overload-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tls-cert", help="serve HTTPS with this PEM certificate")
+    parser.add_argument("--tls-key", help="private key of --tls-cert")
+    args = parser.parse_args()
+    script = Script(args.ttft_ms, args.tokens_per_second, args.output_tokens, args.error_rate, args.overload_rate, args.seed)
+    uvicorn.run(
+        create_app(script), host=args.host, port=args.port, log_level="warning",
+        ssl_certfile=args.tls_cert, ssl_keyfile=args.tls_key,
+    )
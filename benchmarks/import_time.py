@@ -0,0 +1,101 @@
+"""
+Import-time profile of the backend.
+
+Imports --module (app.main by default) in fresh interpreters with
+`python -X importtime`, --runs times, and reports the median wall time of
+the import, the packages whose import chains cost the most, and which of
+the modules that should only load on first use (--lazy) were imported
+anyway. Cold container starts pay this before the first request.
+
+With --output the profile is written as JSON; --max-ms exits non-zero when
+the median import takes longer, so CI can hold the line.
+
+Usage:
+    python -m benchmarks.import_time [--runs 5] [--top 15] [--output import_profile.json] [--max-ms 1500]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Modules the request path loads on first use; importing app.main must not pull them in
+LAZY_MODULES = [
+    "google.generativeai",
+    "langchain_core.runnables.history",
+    "langchain_core.prompts.chat",
+    "motor.motor_asyncio",
+    "llama_cpp",
+    "sentence_transformers",
+    "redis",
+    "opentelemetry.sdk",
+]
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def profile_once(module: str, workdir: str) -> tuple[float, list[tuple[str, int, int]]]:
+    """Returns the import's wall time in ms and (name, self_us, cumulative_us) per imported module."""
+    code = f"import time; started = time.perf_counter(); import {module}; print((time.perf_counter() - started) * 1000)"
+    env = {**os.environ, "LOG_FILE": os.path.join(workdir, "import_time.log")}
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env, check=True
+    )
+    modules = []
+    for line in completed.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            modules.append((match.group(4), int(match.group(1)), int(match.group(2))))
+    return float(completed.stdout.strip().splitlines()[-1]), modules
+
+def heaviest_packages(modules: list[tuple[str, int, int]], exclude: str, top: int) -> list[dict]:
+    """The costliest import chain per top-level package, slowest first."""
+    best: dict[str, tuple[str, int]] = {}
+    for name, _, cumulative in modules:
+        root = name.split(".")[0]
+        if root == exclude or root.startswith("_"):
+            continue
+        if root not in best or cumulative > best[root][1]:
+            best[root] = (name, cumulative)
+    ranked = sorted(best.values(), key=lambda item: item[1], reverse=True)[:top]
+    return [{"module": name, "cumulative_ms": round(cumulative / 1000, 1)} for name, cumulative in ranked]
+
+def run(args):
+    walls, profiles = [], []
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(args.runs):
+            wall, modules = profile_once(args.module, workdir)
+            walls.append(wall)
+            profiles.append(modules)
+
+    # Report the run closest to the median so the breakdown matches the headline number
+    median = statistics.median(walls)
+    modules = profiles[min(range(len(walls)), key=lambda i: abs(walls[i] - median))]
+    imported = {name for name, _, _ in modules}
+    result = {
+        "module": args.module,
+        "runs": args.runs,
+        "import_ms": {"median": round(median, 1), "min": round(min(walls), 1), "max": round(max(walls), 1)},
+        "modules_imported": len(modules),
+        "heaviest": heaviest_packages(modules, args.module.split(".")[0], args.top),
+        "eager_lazy_modules": [name for name in args.lazy if name in imported],
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"Median import time {median:.0f} ms exceeds the {args.max_ms:.0f} ms budget")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--lazy", nargs="*", default=LAZY_MODULES)
+    parser.add_argument("--max-ms", type=float, default=None)
+    parser.add_argument("--output")
+    run(parser.parse_args())
@@ -0,0 +1,76 @@
+"""
+Load test for request coalescing (single-flight) in the LLM service.
+
+Fires bursts of identical tutor requests from different sessions against a
+fake Together AI client and counts upstream calls. With coalescing each
+burst should cost one upstream call, for both /chat and /chat/stream.
+The response cache is disabled so only coalescing is measured.
+
+Usage:
+    python -m benchmarks.llm_coalescing [--burst 50] [--bursts 5] [--latency 0.5]
+"""
+import argparse
+import asyncio
+import time
+
+from app.config import settings
+from app import model_loader
+from app.services import llm_service
+from app.services.single_flight import llm_flights
+
+class FakeTogetherClient:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def chat_completion(self, model, messages, timeout=None, **params) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return '{"explanation": "ok", "stepsToFix": [], "resources": []}'
+
+    async def stream_chat_completion(self, model, messages, timeout=None, **params):
+        self.calls += 1
+        for token in ('{"explanation": ', '"ok", ', '"stepsToFix": [], ', '"resources": []}'):
+            await asyncio.sleep(self.latency / 4)
+            yield token
+
+async def burst(size: int, question: str, stream: bool) -> list[float]:
+    async def one(i: int) -> float:
+        started = time.perf_counter()
+        if stream:
+            frames = [frame async for frame in llm_service.stream_llm(question, "tutor", f"student-{i}")]
+            assert frames[-1].startswith("event: done"), frames[-1]
+        else:
+            await llm_service.query_llm(question, "tutor", f"student-{i}")
+        return time.perf_counter() - started
+    return await asyncio.gather(*(one(i) for i in range(size)))
+
+async def run(burst_size: int, bursts: int, latency: float) -> dict:
+    settings.response_cache_enabled = False
+    settings.together_api_key = "fake"
+    client = FakeTogetherClient(latency)
+    model_loader.get_together_ai_client = lambda: client
+
+    result = {"burst": burst_size, "bursts": bursts}
+    for stream in (False, True):
+        client.calls = 0
+        latencies = []
+        for b in range(bursts):
+            latencies += await burst(burst_size, f"Why does my loop raise IndexError? (burst {b})", stream)
+        latencies.sort()
+        name = "stream" if stream else "chat"
+        result[f"{name}_requests"] = burst_size * bursts
+        result[f"{name}_upstream_calls"] = client.calls
+        result[f"{name}_p50_ms"] = round(latencies[len(latencies) // 2] * 1000, 1)
+        result[f"{name}_max_ms"] = round(latencies[-1] * 1000, 1)
+    result["single_flight"] = llm_flights.stats()
+    print(result)
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, default=50)
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(run(args.burst, args.bursts, args.latency))
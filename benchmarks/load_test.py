@@ -0,0 +1,354 @@
+"""
+End-to-end load test of the backend against the fake LLM server.
+
+Starts benchmarks.fake_llm and `uvicorn app.main:app` as subprocesses. The
+backend reaches the fake through TOGETHER_BASE_URL, and DEBUGGER_TARGETS
+routes the debugger there as well, so no real provider is called. An
+open-loop mix of tutor, debugger and RAG requests is then sent at a fixed
+--rps for --seconds; requests are fired on schedule whether or not earlier
+ones have answered, so queueing in the backend shows up as latency.
+
+Reported per operation: latency p50/p95/p99 and, for streams, time to first
+token; overall: throughput and errors; server: peak RSS of the backend
+process tree and event-loop lag from its /metrics. With --output the
+results are written as JSON for benchmarks.compare.
+
+--env KEY=VALUE overrides backend settings; "{fake}" expands to the fake
+server's /v1 URL, e.g. --env TUTOR_TARGETS=batch:fake --env BATCH_BASE_URL={fake}.
+With --tls-cert and --tls-key the fake serves HTTPS and the backend trusts
+the certificate; the report then also shows how many upstream requests
+reused a pooled connection.
+
+Usage:
+    python -m benchmarks.load_test [--rps 50] [--seconds 30] [--mix tutor=4,tutor_stream=2,debugger=2,debugger_stream=1,rag=1] [--output bench.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+import numpy as np
+
+QUESTIONS = [
+    "Why does my for loop never stop?",
+    "What does 'NoneType object is not subscriptable' mean?",
+    "How do I read a file line by line?",
+    "Explain list comprehensions with an example.",
+    "Why is my async function never awaited?",
+    "How do I fix an IndexError in a while loop?",
+]
+
+# --- Backend and fake provider processes ---
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _rss_mb(pid: int) -> float | None:
+    """Resident memory of a process and its children (uvicorn workers), from /proc."""
+    total, pending = 0, [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+    except (OSError, StopIteration):
+        if total == 0:
+            return None
+    return total / 1024
+
+async def _wait_ready(client: httpx.AsyncClient, url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(url)).status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+def _start_servers(args, workdir: str) -> tuple[subprocess.Popen, subprocess.Popen, str]:
+    fake_port, backend_port = _free_port(), _free_port()
+    tls = ["--tls-cert", args.tls_cert, "--tls-key", args.tls_key] if args.tls_cert else []
+    fake_url = f"{'https' if tls else 'http'}://127.0.0.1:{fake_port}/v1"
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_llm", "--port", str(fake_port),
+         "--ttft-ms", str(args.ttft_ms), "--tokens-per-second", str(args.tokens_per_second),
+         "--output-tokens", str(args.output_tokens), "--error-rate", str(args.error_rate),
+         "--overload-rate", str(args.overload_rate), *tls],
+    )
+    env = {
+        **os.environ,
+        "TOGETHER_API_KEY": "fake",
+        "TOGETHER_BASE_URL": fake_url,
+        "GOOGLE_API_KEY": "",
+        "TUTOR_TARGETS": "together:fake-tutor",
+        "DEBUGGER_TARGETS": "together:fake-debugger",
+        "RATE_LIMIT_ENABLED": "false",
+        "METRICS_ENABLED": "true",
+        "LOG_FILE": os.path.join(workdir, "backend.log"),
+    }
+    if tls:
+        env["UPSTREAM_CA_BUNDLE"] = args.tls_cert
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value.replace("{fake}", fake_url)
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(backend_port),
+         "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+        env=env, stdout=subprocess.DEVNULL,
+    )
+    return fake, backend, f"http://127.0.0.1:{backend_port}"
+
+# --- Workload ---
+def _question(i: int, rng: random.Random, repeat_rate: float) -> str:
+    base = rng.choice(QUESTIONS)
+    # Repeated questions can be answered from the response cache
+    return base if rng.random() < repeat_rate else f"{base} (case {i})"
+
+async def _post(client: httpx.AsyncClient, path: str, payload: dict) -> dict:
+    started = time.perf_counter()
+    response = await client.post(path, json=payload)
+    return {"ok": response.status_code == 200, "latency": time.perf_counter() - started, "ttft": None}
+
+async def _stream(client: httpx.AsyncClient, path: str, payload: dict) -> dict:
+    started = time.perf_counter()
+    ttft, ok = None, False
+    async with client.stream("POST", path, json=payload) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("event: token") and ttft is None:
+                ttft = time.perf_counter() - started
+            elif line.startswith("event: done"):
+                ok = response.status_code == 200
+            elif line.startswith("event: error"):
+                break
+    return {"ok": ok, "latency": time.perf_counter() - started, "ttft": ttft}
+
+async def _rag(client: httpx.AsyncClient, question: str) -> dict:
+    started = time.perf_counter()
+    response = await client.get("/api/rag/query", params={"q": question})
+    return {"ok": response.status_code == 200, "latency": time.perf_counter() - started, "ttft": None}
+
+OPERATIONS = {
+    "tutor": lambda client, payload: _post(client, "/api/tutor/chat", payload),
+    "tutor_stream": lambda client, payload: _stream(client, "/api/tutor/chat/stream", payload),
+    "debugger": lambda client, payload: _post(client, "/api/debugger/chat", payload),
+    "debugger_stream": lambda client, payload: _stream(client, "/api/debugger/chat/stream", payload),
+    "rag": lambda client, payload: _rag(client, payload["query"]),
+}
+
+def _parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}'; expected one of {sorted(OPERATIONS)}.")
+        mix[name] = float(weight or 1)
+    return mix
+
+async def _drive(client: httpx.AsyncClient, args, mix: dict[str, float]) -> tuple[list[dict], float]:
+    rng = random.Random(args.seed)
+    names, weights = list(mix), list(mix.values())
+    loop = asyncio.get_running_loop()
+
+    async def one(op: str, payload: dict) -> dict:
+        try:
+            sample = await OPERATIONS[op](client, payload)
+        except httpx.HTTPError:
+            sample = {"ok": False, "latency": None, "ttft": None}
+        return {"op": op, **sample}
+
+    tasks = []
+    started = loop.time()
+    for i in range(int(args.rps * args.seconds)):
+        await asyncio.sleep(max(0.0, started + i / args.rps - loop.time()))
+        payload = {"query": _question(i, rng, args.repeat_rate), "session_id": f"bench-{rng.randrange(args.sessions)}"}
+        tasks.append(asyncio.create_task(one(rng.choices(names, weights)[0], payload)))
+    samples = await asyncio.gather(*tasks)
+    return samples, loop.time() - started
+
+# --- Server-side measurements ---
+_SAMPLE_RE = re.compile(r'^event_loop_lag_seconds_(bucket|sum|count)(?:\{le="([^"]+)"\})? (\S+)$', re.MULTILINE)
+_UPSTREAM_RE = re.compile(r'^upstream_http_(requests|connections_opened)_total\{[^}]*\} (\S+)$', re.MULTILINE)
+
+async def _metrics(client: httpx.AsyncClient) -> str | None:
+    try:
+        response = await client.get("/metrics")
+    except httpx.HTTPError:
+        return None
+    return response.text if response.status_code == 200 else None
+
+def _loop_lag(metrics: str | None) -> dict | None:
+    """Cumulative event_loop_lag_seconds histogram of the worker that answers /metrics."""
+    if metrics is None:
+        return None
+    histogram = {"buckets": {}}
+    for kind, le, value in _SAMPLE_RE.findall(metrics):
+        if kind == "bucket":
+            histogram["buckets"][float(le)] = float(value)
+        else:
+            histogram[kind] = float(value)
+    return histogram if "count" in histogram else None
+
+def _upstream_summary(metrics: str | None) -> dict:
+    """Upstream requests and new connections of the worker that answers /metrics, over all hosts."""
+    totals = {"requests": 0.0, "connections_opened": 0.0}
+    for kind, value in _UPSTREAM_RE.findall(metrics or ""):
+        totals[kind] += float(value)
+    requests = totals["requests"]
+    return {
+        "upstream_requests": int(requests),
+        "upstream_connections_opened": int(totals["connections_opened"]),
+        "upstream_connection_reuse": round(1 - totals["connections_opened"] / requests, 3) if requests else None,
+    }
+
+def _lag_summary(before: dict | None, after: dict | None) -> dict:
+    if not before or not after or after["count"] <= before["count"]:
+        return {"loop_lag_mean_ms": None, "loop_lag_p99_ms": None}
+    count = after["count"] - before["count"]
+    # p99 is reported as the upper bound of the histogram bucket it falls in
+    p99 = next(
+        (le for le in sorted(after["buckets"]) if after["buckets"][le] - before["buckets"].get(le, 0.0) >= 0.99 * count),
+        None,
+    )
+    return {
+        "loop_lag_mean_ms": round((after["sum"] - before["sum"]) / count * 1000, 2),
+        "loop_lag_p99_ms": None if p99 in (None, float("inf")) else p99 * 1000,
+    }
+
+async def _sample_rss(pid: int | None, peaks: list[float], stop: asyncio.Event):
+    while pid is not None and not stop.is_set():
+        rss = _rss_mb(pid)
+        if rss is not None:
+            peaks.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=0.5)
+        except asyncio.TimeoutError:
+            pass
+
+# --- Report ---
+def _percentiles(values: list[float], prefix: str = "") -> dict:
+    if not values:
+        return {f"{prefix}p50_ms": None, f"{prefix}p95_ms": None, f"{prefix}p99_ms": None}
+    p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+    return {f"{prefix}p50_ms": round(p50, 1), f"{prefix}p95_ms": round(p95, 1), f"{prefix}p99_ms": round(p99, 1)}
+
+def _report(samples: list[dict], elapsed: float) -> dict:
+    operations = {}
+    for op in sorted({s["op"] for s in samples}):
+        group = [s for s in samples if s["op"] == op]
+        ok = [s for s in group if s["ok"]]
+        operations[op] = {
+            "requests": len(group),
+            "errors": len(group) - len(ok),
+            **_percentiles([s["latency"] for s in ok]),
+        }
+        ttfts = [s["ttft"] for s in ok if s["ttft"] is not None]
+        if ttfts:
+            operations[op].update(_percentiles(ttfts, "ttft_"))
+    ok = [s for s in samples if s["ok"]]
+    return {
+        "operations": operations,
+        "overall": {
+            "requests": len(samples),
+            "errors": len(samples) - len(ok),
+            "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+            **_percentiles([s["latency"] for s in ok]),
+        },
+    }
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args):
+    mix = _parse_mix(args.mix)
+    processes = []
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.target:
+            base_url, backend_pid = args.target, None
+        else:
+            fake, backend, base_url = _start_servers(args, workdir)
+            processes, backend_pid = [backend, fake], backend.pid
+        try:
+            limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+            async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+                await _wait_ready(client, "/api/admin/health")
+                lag_before = _loop_lag(await _metrics(client))
+                peaks, stop = [], asyncio.Event()
+                sampler = asyncio.create_task(_sample_rss(backend_pid, peaks, stop))
+                samples, elapsed = await _drive(client, args, mix)
+                stop.set()
+                await sampler
+                metrics_after = await _metrics(client)
+                lag_after = _loop_lag(metrics_after)
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait(timeout=10)
+
+    result = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "rps": args.rps,
+            "seconds": args.seconds,
+            "mix": mix,
+            "workers": args.workers,
+            "fake": {
+                "ttft_ms": args.ttft_ms,
+                "tokens_per_second": args.tokens_per_second,
+                "output_tokens": args.output_tokens,
+                "error_rate": args.error_rate,
+                "overload_rate": args.overload_rate,
+            },
+            "env": args.env,
+        },
+        **_report(samples, elapsed),
+        "server": {
+            "rss_peak_mb": round(max(peaks), 1) if peaks else None,
+            **_lag_summary(lag_before, lag_after),
+            **_upstream_summary(metrics_after),
+        },
+    }
+    print(json.dumps({key: result[key] for key in ("operations", "overall", "server")}, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=50.0)
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--mix", default="tutor=4,tutor_stream=2,debugger=2,debugger_stream=1,rag=1")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--repeat-rate", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--output-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--overload-rate", type=float, default=0.0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--target", help="URL of an already running backend; no servers are started")
+    parser.add_argument("--tls-cert", help="serve the fake over HTTPS with this PEM certificate")
+    parser.add_argument("--tls-key")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    asyncio.run(run(parser.parse_args()))
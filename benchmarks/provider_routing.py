@@ -0,0 +1,114 @@
+"""
+Fake-provider harness for the provider router.
+
+Two fake providers answer with injected latency: a lognormal body around
+--latency-ms plus a --stall-rate chance of a --stall-ms stall. The same
+request sequence is run without and with hedging and the latency
+percentiles are compared. A second scenario makes the preferred target fail
+and checks that its circuit opens and traffic moves to the backup.
+
+Usage:
+    python -m benchmarks.provider_routing [--requests 2000] [--concurrency 20] [--hedge-percentile 90]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+
+from app.config import settings
+from app.services.provider_router import ProviderRouter, Target
+
+class FakeProvider:
+    def __init__(self, name: str, latency_ms: float, stall_rate: float, stall_ms: float, seed: int, error_rate: float = 0.0):
+        self.name = name
+        self.available = True
+        self.local = False
+        self.latency_ms = latency_ms
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+        self.error_rate = error_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+
+    async def complete(self, model: str, prompt: str, **params) -> str:
+        self.calls += 1
+        if self._rng.random() < self.error_rate:
+            await asyncio.sleep(0.005)
+            raise RuntimeError(f"{self.name} is failing")
+        delay = self._rng.lognormvariate(0, 0.25) * self.latency_ms
+        if self._rng.random() < self.stall_rate:
+            delay += self.stall_ms
+        await asyncio.sleep(delay / 1000)
+        return f"{self.name}:{model}"
+
+    async def stream(self, model: str, prompt: str, **params):
+        yield await self.complete(model, prompt, **params)
+
+async def drive(router: ProviderRouter, requests: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await router.complete(f"question {i}")
+            except Exception:
+                errors += 1
+                return
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+        "errors": errors,
+    }
+
+def providers(args, error_rate: float = 0.0) -> tuple[FakeProvider, FakeProvider]:
+    return (
+        FakeProvider("primary", args.latency_ms, args.stall_rate, args.stall_ms, seed=1, error_rate=error_rate),
+        FakeProvider("backup", args.latency_ms * 1.2, args.stall_rate, args.stall_ms, seed=2),
+    )
+
+async def run(args) -> dict:
+    settings.router_hedge_percentile = args.hedge_percentile
+    result = {}
+    for hedged in (False, True):
+        settings.router_hedge_enabled = hedged
+        primary, backup = providers(args)
+        router = ProviderRouter("bench", [Target(primary, "a"), Target(backup, "b")])
+        stats = await drive(router, args.requests, args.concurrency)
+        stats["upstream_calls"] = primary.calls + backup.calls
+        stats["hedges"] = router.hedges
+        stats["hedge_wins"] = router.hedge_wins
+        result["hedged" if hedged else "baseline"] = stats
+
+    # Failing primary: its circuit should open and requests go to the backup
+    settings.router_hedge_enabled = False
+    primary, backup = providers(args, error_rate=1.0)
+    router = ProviderRouter("bench", [Target(primary, "a"), Target(backup, "b")])
+    stats = await drive(router, args.requests // 4, args.concurrency)
+    stats["primary_calls"] = primary.calls
+    stats["backup_calls"] = backup.calls
+    stats["primary_state"] = router.targets[0].state
+    stats["failovers"] = router.failovers
+    result["failing_primary"] = stats
+
+    for name, stats in result.items():
+        print(name, stats)
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--stall-rate", type=float, default=0.05)
+    parser.add_argument("--stall-ms", type=float, default=1000.0)
+    parser.add_argument("--hedge-percentile", type=float, default=90.0)
+    asyncio.run(run(parser.parse_args()))
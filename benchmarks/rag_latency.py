@@ -0,0 +1,76 @@
+"""
+Query latency benchmark for the RAG vector index.
+
+Builds an IVF index over synthetic clustered unit vectors, saves it, reopens
+it memory-mapped the way workers do, and reports p50/p99 search latency.
+
+Usage:
+    python -m benchmarks.rag_latency [--chunks 1000000] [--dim 512] [--queries 1000]
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+
+from app.config import settings
+from app.services.vector_index import VectorIndex
+
+def synthetic_vectors(n: int, dim: int, topics: int, rng) -> np.ndarray:
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 100_000):
+        end = min(n, start + 100_000)
+        vectors[start:end] = centers[rng.integers(0, topics, end - start)]
+        vectors[start:end] += 0.8 * rng.standard_normal((end - start, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def run(chunks: int, dim: int, queries: int, k: int, nprobe: int) -> dict:
+    rng = np.random.default_rng(0)
+    vectors = synthetic_vectors(chunks, dim, topics=2000, rng=rng)
+
+    started = time.perf_counter()
+    index = VectorIndex.build(vectors, np.arange(chunks))
+    build_seconds = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as path:
+        index.save(path)
+        del index
+        started = time.perf_counter()
+        index = VectorIndex.load(path)
+        load_ms = (time.perf_counter() - started) * 1000
+
+        probes = vectors[rng.integers(0, chunks, queries)]
+        latencies, recall = [], 0
+        for query in probes:
+            started = time.perf_counter()
+            ids, _ = index.search(query, k, nprobe)
+            latencies.append((time.perf_counter() - started) * 1000)
+        # Recall@k against exact search on a subset of queries
+        for query in probes[:50]:
+            exact = set(np.argsort(-(vectors @ query))[:k])
+            recall += len(exact & set(index.search(query, k, nprobe)[0].tolist())) / k
+
+    result = {
+        "chunks": chunks,
+        "dim": dim,
+        "nlist": int(len(index.centroids)),
+        "nprobe": nprobe,
+        "build_seconds": round(build_seconds, 1),
+        "load_ms": round(load_ms, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "recall_at_k": round(recall / min(50, queries), 3),
+    }
+    print(result)
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=settings.embedding_dim)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=settings.rag_top_k)
+    parser.add_argument("--nprobe", type=int, default=settings.rag_nprobe)
+    args = parser.parse_args()
+    run(args.chunks, args.dim, args.queries, args.k, args.nprobe)
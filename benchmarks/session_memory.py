@@ -0,0 +1,154 @@
+"""
+Memory benchmark for the in-process session store.
+
+Creates synthetic sessions with a few chat turns each and reports traced
+heap size as the session count grows. With the bounded store the heap
+should stay flat once session_max_count is reached.
+
+With --compare, builds the same synthetic conversations in each history
+representation instead: LangChain message objects (the previous store),
+the compact turn buffers, and compact buffers with cold turns compressed.
+It reports heap per session and per message, and the time to build the
+prompt window, so the representations can be weighed against each other.
+
+Usage:
+    python -m benchmarks.session_memory [--sessions 100000] [--turns 4]
+    python -m benchmarks.session_memory --compare [--sessions 2000] [--turns 40] [--output memory.json]
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+import uuid
+
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app import memory
+from app.services.prompt_builder import fit_history
+
+def run(sessions: int, turns: int, report_every: int) -> list[dict]:
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    samples = []
+    for i in range(1, sessions + 1):
+        history = memory.get_session_history(str(uuid.uuid4()))
+        for t in range(turns):
+            history.add_message(HumanMessage(content=f"Why does line {t} raise a NullPointerException?"))
+            history.add_message(AIMessage(content="Because the reference is null when it is dereferenced. " * 4))
+        if i % report_every == 0:
+            gc.collect()
+            current = tracemalloc.get_traced_memory()[0] - baseline
+            stats = memory.get_session_stats()
+            samples.append({
+                "sessions_created": i,
+                "live_sessions": stats["sessions"],
+                "heap_mb": round(current / 2**20, 1),
+            })
+            print(f"{i:>8} created  {stats['sessions']:>7} live  {current / 2**20:8.1f} MiB")
+    tracemalloc.stop()
+    return samples
+
+# --- Representation comparison ---
+_WORDS = (
+    "the reference is null when it is dereferenced so check the variable before use and "
+    "initialize it in the constructor a list index out of range means the loop runs one "
+    "step too far use len minus one or iterate over the items directly instead"
+).split()
+
+class _LangChainHistory(InMemoryChatMessageHistory):
+    """The previous representation: a list of LangChain message objects, with the fields fit_history reads."""
+    dropped: int = 0
+    summary: str = ""
+    summary_upto: int = 0
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def turn(self, index: int) -> tuple[str, str]:
+        message = self.messages[index]
+        return message.type, str(message.content)
+
+    def message_range(self, start: int, stop: int | None = None) -> list:
+        return self.messages[start:stop]
+
+STORES = {
+    "langchain": lambda: _LangChainHistory(),
+    "compact": lambda: memory.BoundedChatMessageHistory(max_messages=10**6, max_bytes=2**31),
+    "compressed": lambda: memory.BoundedChatMessageHistory(max_messages=10**6, max_bytes=2**31, hot_messages=8),
+}
+
+def _conversation(rng: random.Random, turns: int) -> list[tuple[type, bytes]]:
+    messages = []
+    for _ in range(turns):
+        question = " ".join(rng.choices(_WORDS, k=rng.randint(8, 25)))
+        answer = " ".join(rng.choices(_WORDS, k=rng.randint(60, 200)))
+        messages += [(HumanMessage, f"{question}?".encode("utf-8")), (AIMessage, answer.encode("utf-8"))]
+    return messages
+
+def compare(sessions: int, turns: int, budget: int, seed: int) -> dict:
+    # Conversations are generated up front so only the stores are traced
+    conversations = [_conversation(random.Random(seed + i), turns) for i in range(sessions)]
+    text_bytes = sum(len(text) for conversation in conversations for _, text in conversation)
+    results = {}
+    for name, factory in STORES.items():
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        histories = []
+        for conversation in conversations:
+            history = factory()
+            # Each message is decoded afresh, as it would arrive in a request
+            for message_type, text in conversation:
+                history.add_message(message_type(content=text.decode("utf-8")))
+            histories.append(history)
+        gc.collect()
+        heap = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+
+        # Steady state: the summary is already built, so this times the window
+        sample = histories[:500]
+        for history in sample:
+            fit_history(history, budget)
+        started = time.perf_counter()
+        for history in sample:
+            fit_history(history, budget)
+        fit_ms = (time.perf_counter() - started) * 1000 / len(sample)
+
+        results[name] = {
+            "heap_mb": round(heap / 2**20, 2),
+            "bytes_per_session": round(heap / sessions),
+            "bytes_per_message": round(heap / (sessions * turns * 2), 1),
+            "overhead_ratio": round(heap / text_bytes, 2),
+            "fit_history_ms": round(fit_ms, 3),
+        }
+        del histories
+        print(f"{name:>10}  {heap / 2**20:8.1f} MiB  {heap / (sessions * turns * 2):8.1f} B/message  {fit_ms:7.3f} ms/fit")
+    return {
+        "sessions": sessions,
+        "turns": turns,
+        "text_mb": round(text_bytes / 2**20, 2),
+        "prompt_budget": budget,
+        "stores": results,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=None)
+    parser.add_argument("--turns", type=int, default=None)
+    parser.add_argument("--report-every", type=int, default=10_000)
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--budget", type=int, default=2000, help="prompt token budget for the fit_history timing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    if args.compare:
+        result = compare(args.sessions or 2000, args.turns or 40, args.budget, args.seed)
+        print(json.dumps(result, indent=2))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+    else:
+        run(args.sessions or 100_000, args.turns or 4, args.report_every)
@@ -0,0 +1,92 @@
+"""
+Throughput vs. added latency of tutor micro-batching.
+
+Drives the BatchScheduler with an open-loop Poisson load against a fake
+batch server that costs --base-ms + --per-item-ms per prompt and runs at
+most --server-slots batches at once (the scheduler is given the same
+concurrency). Each window/size setting reports the
+completed throughput, latency percentiles and the average batch size;
+max size 1 is the unbatched baseline.
+
+Usage:
+    python -m benchmarks.tutor_batching [--rate 400] [--seconds 5] [--configs 0:1,2:8,5:32,10:64]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+
+from app.services.batcher import BatchScheduler
+
+class FakeBatchServer:
+    def __init__(self, base_ms: float, per_item_ms: float, slots: int):
+        self.base_ms = base_ms
+        self.per_item_ms = per_item_ms
+        self._slots = asyncio.Semaphore(slots)
+        self.calls = 0
+
+    async def send_batch(self, prompts: list[str], timeout: float) -> list[str]:
+        async with self._slots:
+            self.calls += 1
+            await asyncio.sleep((self.base_ms + self.per_item_ms * len(prompts)) / 1000)
+        return [f"answer to {prompt}" for prompt in prompts]
+
+async def run_config(window_ms: float, max_size: int, args) -> dict:
+    server = FakeBatchServer(args.base_ms, args.per_item_ms, args.server_slots)
+    scheduler = BatchScheduler("bench", server.send_batch, window_ms, max_size, args.server_slots)
+    rng = random.Random(0)
+    latencies, timeouts = [], 0
+
+    async def one(i: int):
+        nonlocal timeouts
+        started = time.perf_counter()
+        try:
+            await scheduler.submit(f"question {i}", args.timeout)
+        except asyncio.TimeoutError:
+            timeouts += 1
+            return
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    tasks = []
+    started = time.perf_counter()
+    i = 0
+    while time.perf_counter() - started < args.seconds:
+        tasks.append(asyncio.create_task(one(i)))
+        i += 1
+        await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "window_ms": window_ms,
+        "max_size": max_size,
+        "offered_rps": round(i / args.seconds, 1),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1) if latencies else None,
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1) if latencies else None,
+        "timeouts": timeouts,
+        "upstream_calls": server.calls,
+        "avg_batch_size": scheduler.stats()["avg_batch_size"],
+    }
+
+async def run(args) -> list[dict]:
+    results = []
+    for config in args.configs.split(","):
+        window_ms, max_size = config.split(":")
+        result = await run_config(float(window_ms), int(max_size), args)
+        print(result)
+        results.append(result)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=400.0, help="offered requests per second")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--base-ms", type=float, default=40.0)
+    parser.add_argument("--per-item-ms", type=float, default=1.0)
+    parser.add_argument("--server-slots", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    parser.add_argument("--configs", default="0:1,2:8,5:32,10:64")
+    asyncio.run(run(parser.parse_args()))
@@ -1,13 +1,22 @@
 // src/api.ts
-import { fetch } from 'undici';
+import { Agent, fetch } from 'undici';
 
 const BACKEND_URL = process.env.BACKEND_URL || 'http://127.0.0.1:8000'; // or read from extension settings later
 
+// One keep-alive pool for every backend call, so each user action reuses a
+// warm connection instead of paying a new TCP handshake
+const pool = new Agent({ connections: 8, keepAliveTimeout: 30_000, keepAliveMaxTimeout: 600_000 });
+
+export async function closeBackendPool(): Promise<void> {
+  await pool.close();
+}
+
 export async function askBackend(sessionId: string, query: string, mode = 'tutor'): Promise<string> {
-  const url = `${BACKEND_URL}/api/query`;
-  const body = { session_id: sessionId, query, mode };
+  const url = `${BACKEND_URL}/api/${mode}/chat`;
+  const body = { session_id: sessionId, query };
 
   const res = await fetch(url, {
+    dispatcher: pool,
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
     body: JSON.stringify(body)
@@ -19,16 +28,183 @@ export async function askBackend(sessionId: string, query: string, mode = 'tutor
   }
 
   const data = await res.json();
-  // adapt to your backend response shape - try these keys in order
-  return data.answer || data.reply || data.explanation || (data.text ? data.text : JSON.stringify(data));
+  return replyText(data);
+}
+
+// adapt to your backend response shape - try these keys in order
+export function replyText(data: any): string {
+  return data.answer || data.reply || data.explanation || data.response || (data.text ? data.text : JSON.stringify(data));
+}
+
+/**
+ * Streams a chat reply over Server-Sent Events from /api/{mode}/chat/stream.
+ * onToken is called for every text chunk as it arrives; the promise resolves
+ * with the final assembled response (the structured JSON for the tutor).
+ */
+export async function streamBackend(
+  sessionId: string,
+  query: string,
+  mode: 'tutor' | 'debugger' = 'tutor',
+  onToken: (text: string) => void = () => {}
+): Promise<any> {
+  const url = `${BACKEND_URL}/api/${mode}/chat/stream`;
+  const res = await fetch(url, {
+    dispatcher: pool,
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+    body: JSON.stringify({ session_id: sessionId, query })
+  });
+
+  if (!res.ok || !res.body) {
+    const text = await res.text();
+    throw new Error(`Backend error ${res.status}: ${text}`);
+  }
+
+  let result: any;
+  let received = false;
+  await readSse(res.body, frame => {
+    if (frame.event === 'token') {
+      onToken(frame.data.text);
+    } else if (frame.event === 'done') {
+      result = frame.data;
+      received = true;
+      return true;
+    } else if (frame.event === 'error') {
+      throw new Error(`Backend stream error: ${frame.data.detail}`);
+    }
+    return false;
+  });
+  if (!received) throw new Error('Backend stream ended before the final frame');
+  return result;
+}
+
+export interface BatchQuery {
+  query: string;
+  mode?: 'tutor' | 'debugger';
+  id?: string;
+  no_cache?: boolean;
+  // append the question and reply to the session history
+  record?: boolean;
+}
+
+export interface BatchResult {
+  id: string;
+  status: number;
+  response?: any;
+  detail?: string;
+}
+
+export interface SessionMessage {
+  role: 'user' | 'bot' | 'system';
+  content: string;
+}
+
+/**
+ * Runs several queries (and optional message appends, applied first) in one
+ * request to /api/batch; the backend runs the queries concurrently and
+ * returns one result per query, in order.
+ */
+export async function askBatch(sessionId: string, queries: BatchQuery[], messages: SessionMessage[] = []): Promise<BatchResult[]> {
+  const res = await fetch(`${BACKEND_URL}/api/batch`, {
+    dispatcher: pool,
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ session_id: sessionId, queries, messages })
+  });
+  if (!res.ok) {
+    const text = await res.text();
+    throw new Error(`Backend error ${res.status}: ${text}`);
+  }
+  const data: any = await res.json();
+  return data.results;
+}
+
+/**
+ * Streams a batch from /api/batch/stream. onToken gets (id, text) for every
+ * chunk of every query as it arrives, in whatever order the queries produce
+ * them; the promise resolves with the results keyed by query id.
+ */
+export async function streamBatch(
+  sessionId: string,
+  queries: BatchQuery[],
+  onToken: (id: string, text: string) => void = () => {},
+  messages: SessionMessage[] = []
+): Promise<Map<string, BatchResult>> {
+  const res = await fetch(`${BACKEND_URL}/api/batch/stream`, {
+    dispatcher: pool,
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+    body: JSON.stringify({ session_id: sessionId, queries, messages })
+  });
+  if (!res.ok || !res.body) {
+    const text = await res.text();
+    throw new Error(`Backend error ${res.status}: ${text}`);
+  }
+
+  const results = new Map<string, BatchResult>();
+  let finished = false;
+  await readSse(res.body, frame => {
+    if (frame.event === 'token') {
+      onToken(frame.data.id, frame.data.text);
+    } else if (frame.event === 'result' || frame.event === 'error') {
+      results.set(frame.data.id, frame.data);
+    } else if (frame.event === 'done') {
+      finished = true;
+      return true;
+    }
+    return false;
+  });
+  if (!finished) throw new Error('Backend stream ended before the final frame');
+  return results;
+}
+
+/** Reads SSE frames until onFrame returns true or the stream ends. */
+async function readSse(body: any, onFrame: (frame: { event: string; data: any }) => boolean): Promise<void> {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  try {
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // SSE frames are separated by a blank line
+      let sep: number;
+      while ((sep = buffer.indexOf('\n\n')) !== -1) {
+        const frame = parseSseFrame(buffer.slice(0, sep));
+        buffer = buffer.slice(sep + 2);
+        if (onFrame(frame)) return;
+      }
+    }
+  } finally {
+    // releases the connection if we stop reading early
+    reader.cancel().catch(() => {});
+  }
+}
+
+function parseSseFrame(frame: string): { event: string; data: any } {
+  let event = 'message';
+  const dataLines: string[] = [];
+  for (const line of frame.split('\n')) {
+    if (line.startsWith('event:')) event = line.slice(6).trim();
+    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+  }
+  return { event, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : null };
+}
+
+export async function appendSessionMessage(sessionId: string, role: SessionMessage['role'], content: string) {
+  await appendSessionMessages(sessionId, [{ role, content }]);
 }
 
-export async function appendSessionMessage(sessionId: string, role: 'user' | 'bot' | 'system', content: string) {
+/** Appends several messages to the session store in one request. */
+export async function appendSessionMessages(sessionId: string, messages: SessionMessage[]) {
   const url = `${BACKEND_URL}/api/sessions/${encodeURIComponent(sessionId)}/messages`;
   const res = await fetch(url, {
+    dispatcher: pool,
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ role, content })
+    body: JSON.stringify({ messages })
   });
   if (!res.ok) {
     const text = await res.text();
@@ -1,6 +1,6 @@
 // src/extension.ts
 import * as vscode from 'vscode';
-import { askBackend, appendSessionMessage } from './api';
+import { streamBatch, replyText, closeBackendPool } from './api';
 import { v4 as uuidv4 } from 'uuid';
 import * as path from 'path';
 import * as fs from 'fs';
@@ -36,14 +36,17 @@ export function activate(context: vscode.ExtensionContext) {
     // Optimistic: show user's message in panel
     panel.webview.postMessage({ type: 'userMessage', payload: { content: selection } });
 
-    // append user message to backend session store
-    appendSessionMessage(sessionId, 'user', selection).catch(e => console.warn('append user failed', e));
-
-    // call backend
+    // call backend: one request asks the question and records both turns in the session store
     try {
-      const reply = await askBackend(sessionId, selection, 'tutor');
-      // append bot reply to backend session store
-      appendSessionMessage(sessionId, 'bot', reply).catch(e => console.warn('append bot failed', e));
+      // stream tokens into the panel as they arrive, then replace with the final reply
+      const results = await streamBatch(sessionId, [{ id: 'reply', query: selection, mode: 'tutor', record: true }], (_id, text) => {
+        panel?.webview.postMessage({ type: 'botToken', payload: { content: text } });
+      });
+      const result = results.get('reply');
+      if (!result || result.status !== 200) {
+        throw new Error(result?.detail || 'no reply');
+      }
+      const reply = replyText(result.response);
       // send reply to webview
       panel.webview.postMessage({ type: 'botReply', payload: { content: reply } });
     } catch (err: any) {
@@ -81,4 +84,6 @@ function getOrCreatePanel(context: vscode.ExtensionContext, existing?: vscode.We
   return panel;
 }
 
-export function deactivate() {}
+export function deactivate() {
+  return closeBackendPool();
+}
@@ -0,0 +1,30 @@
+import pytest
+from app import model_loader
+from app.config import settings
+
+@pytest.fixture
+def isolated_settings(monkeypatch):
+    """Turns off the caches, retrieval and rate limits, so each test sees only the path it exercises."""
+    monkeypatch.setattr(settings, "response_cache_enabled", False)
+    monkeypatch.setattr(settings, "fix_index_enabled", False)
+    monkeypatch.setattr(settings, "rag_context_enabled", False)
+    monkeypatch.setattr(settings, "rate_limit_enabled", False)
+    monkeypatch.setattr(settings, "router_hedge_enabled", False)
+    return settings
+
+@pytest.fixture
+def together_client(monkeypatch, isolated_settings):
+    """Installs a Together AI client built on the transport the test passes in."""
+    monkeypatch.setattr(settings, "together_api_key", "test-key")
+
+    def install(transport):
+        client = model_loader.TogetherAIClient(
+            api_key="test-key",
+            base_url="https://together.test/v1",
+            timeout=10.0,
+            max_concurrency=settings.llm_max_concurrency,
+            transport=transport,
+        )
+        monkeypatch.setattr(model_loader, "_together_client", client)
+        return client
+    return install
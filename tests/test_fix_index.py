@@ -0,0 +1,38 @@
+from app.services.fix_index import error_signature, fingerprint
+
+def _signature(message: str, question: str | None = "How do I fix this?") -> str:
+    return error_signature({"language": "python", "message": message}, question)
+
+def test_same_error_from_different_projects_matches():
+    first = {
+        "message": "ZeroDivisionError: division by zero",
+        "stack": 'File "/home/ana/shop/cart.py", line 42, in total\n  return price / 0',
+    }
+    second = {
+        "message": "ZeroDivisionError: division by zero",
+        "stack": 'File "C:\\Users\\raj\\proj\\cart.py", line 7, in total\n  return price / 0',
+    }
+    assert error_signature(first, "why?") == error_signature(second, "why?")
+
+def test_missing_modules_are_different_errors():
+    numpy = _signature("ModuleNotFoundError: No module named 'numpy'")
+    pandas = _signature("ModuleNotFoundError: No module named 'pandas'")
+    assert numpy != pandas
+    assert "'numpy'" in numpy
+
+def test_http_status_codes_are_kept():
+    not_found = _signature("requests.exceptions.HTTPError: 404 Client Error: Not Found for url: https://api.test/items/17")
+    server_error = _signature("requests.exceptions.HTTPError: 500 Server Error: Internal Server Error for url: https://api.test/items/17")
+    assert not_found != server_error
+    assert _signature("Request failed with status code 404") != _signature("Request failed with status code 500")
+    assert _signature("HTTP 404") != _signature("HTTP 500")
+
+def test_literal_values_and_other_numbers_are_placeholders():
+    assert _signature("ValueError: invalid literal for int() with base 10: '12a'") == \
+        _signature("ValueError: invalid literal for int() with base 10: 'x y'")
+    assert _signature("IndexError: list index 3 out of range") == _signature("IndexError: list index 12 out of range")
+
+def test_question_is_part_of_the_fingerprint():
+    message = "KeyError: 'user_id'"
+    assert fingerprint(_signature(message, "What does this mean?")) != fingerprint(_signature(message, "How do I avoid it?"))
+    assert fingerprint(_signature(message, "What does this   mean?")) == fingerprint(_signature(message, "What does this mean?"))
@@ -0,0 +1,35 @@
+import asyncio
+import pytest
+from app import model_loader
+from app.config import settings
+
+genai = pytest.importorskip("google.generativeai")
+glm = pytest.importorskip("google.ai.generativelanguage")
+
+def test_gemini_models_share_the_sdk_client_and_its_channel(monkeypatch):
+    monkeypatch.setattr(settings, "google_api_key", "test-key")
+    monkeypatch.setattr(model_loader, "_genai", None)
+    monkeypatch.setattr(model_loader, "model_registry", model_loader.ModelRegistry("gemini-a"))
+    callers = []
+
+    async def stream_generate_content(self, request, **kwargs):
+        callers.append(self)
+
+        async def chunks():
+            yield glm.GenerateContentResponse(candidates=[{"content": {"role": "model", "parts": [{"text": request.model}]}}])
+        return chunks()
+
+    # Stands in for the RPC; the client and its channel are the SDK's own
+    monkeypatch.setattr(glm.GenerativeServiceAsyncClient, "stream_generate_content", stream_generate_content)
+    provider = model_loader.GeminiProvider()
+
+    async def run():
+        replies = [await provider.complete(model, "hi") for model in ("gemini-a", "gemini-b", "gemini-a")]
+        return replies, provider.stats()
+
+    replies, stats = asyncio.run(run())
+    assert replies == ["models/gemini-a", "models/gemini-b", "models/gemini-a"]
+    # Both models sent through the one client the provider reports on
+    assert len(callers) == 3 and all(caller is provider._client for caller in callers)
+    assert stats["requests"] == 3
+    assert stats["channel"] in ("IDLE", "CONNECTING", "READY", "TRANSIENT_FAILURE")
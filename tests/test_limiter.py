@@ -0,0 +1,226 @@
+import asyncio
+import time
+import httpx
+import pytest
+from fastapi import FastAPI
+from app.config import settings
+from app.middleware import LimiterMiddleware
+from app.services import limiter
+from app.services.provider_router import ProviderRouter, Target
+
+class FakeProvider:
+    """Upstream provider whose calls take `latency` seconds; records the slots held during them."""
+
+    local = False
+    available = True
+
+    def __init__(self, name: str, latency: float = 0.02):
+        self.name = name
+        self.latency = latency
+        self.calls = 0
+        self.held: list[int] = []
+
+    async def complete(self, model: str, prompt: str, **params) -> str:
+        self.calls += 1
+        self.held.append(limiter.get_provider_limiter(self.name).in_flight)
+        await asyncio.sleep(self.latency)
+        return f"{self.name}: {prompt}"
+
+    async def stream(self, model: str, prompt: str, **params):
+        self.calls += 1
+        self.held.append(limiter.get_provider_limiter(self.name).in_flight)
+        for word in prompt.split():
+            await asyncio.sleep(self.latency)
+            yield word
+
+@pytest.fixture
+def limits(monkeypatch, isolated_settings):
+    """Rate limiting on, with fresh per-provider limiters."""
+    monkeypatch.setattr(settings, "rate_limit_enabled", True)
+    monkeypatch.setattr(settings, "llm_max_concurrency", 8)
+    monkeypatch.setattr(settings, "limiter_min_concurrency", 1)
+    monkeypatch.setattr(settings, "limiter_latency_tolerance", 4.0)
+    monkeypatch.setattr(settings, "limiter_backoff", 0.5)
+    monkeypatch.setattr(limiter, "_limiters", {})
+    return settings
+
+def test_routed_calls_hold_and_adapt_their_own_providers_limit(limits):
+    provider = FakeProvider("batch")
+    router = ProviderRouter("tutor", [Target(provider, "m")])
+    batch = limiter.get_provider_limiter("batch")
+
+    async def run():
+        for _ in range(5):
+            await router.complete("fast")
+        assert batch.limit == 8.0
+
+        # A call well over the baseline latency halves the limit
+        provider.latency = 0.2
+        await router.complete("slow")
+        assert batch.limit == 4.0
+
+        # Fast calls grow it back by about one per round trip
+        provider.latency = 0.02
+        for _ in range(8):
+            await router.complete("fast")
+        assert 5.0 < batch.limit < 8.0
+
+        assert [word async for word in router.stream("a streamed reply")] == ["a", "streamed", "reply"]
+
+    asyncio.run(run())
+    # Every call held a slot of the limiter it fed, released when it finished
+    assert provider.held == [1] * provider.calls
+    assert batch.in_flight == 0
+    assert batch.admitted == provider.calls
+    assert set(limiter._limiters) == {"batch"}
+
+def test_shed_call_fails_over_without_opening_the_circuit(limits, monkeypatch):
+    monkeypatch.setattr(settings, "llm_max_concurrency", 1)
+    monkeypatch.setattr(settings, "limiter_queue_timeout_seconds", 0.05)
+    busy, idle = FakeProvider("together"), FakeProvider("gemini")
+    router = ProviderRouter("debugger", [Target(busy, "m"), Target(idle, "m")])
+
+    async def run():
+        together = limiter.get_provider_limiter("together")
+        assert await together.acquire("other", time.monotonic() + 1)
+        started = time.monotonic()
+        result = await router.complete("hello")
+        together.release()
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(run())
+    assert result == "gemini: hello"
+    assert busy.calls == 0
+    assert router.failovers == 1
+    assert router.targets[0].state == "closed" and router.targets[0].failures == 0
+    assert elapsed < 0.5
+
+def test_request_shed_by_every_target_is_rejected_with_503(limits, monkeypatch):
+    monkeypatch.setattr(settings, "llm_max_concurrency", 1)
+    monkeypatch.setattr(settings, "limiter_queue_timeout_seconds", 0.05)
+    router = ProviderRouter("tutor", [Target(FakeProvider("together"), "m")])
+
+    async def run():
+        assert await limiter.get_provider_limiter("together").acquire("other", time.monotonic() + 1)
+        await router.complete("hello")
+
+    with pytest.raises(limiter.AdmissionRejected) as rejected:
+        asyncio.run(run())
+    assert rejected.value.status_code == 503
+
+def test_limit_grows_additively_and_halves_at_most_once_per_round_trip():
+    adaptive = limiter.AdaptiveLimiter("test", min_limit=1, max_limit=10, latency_tolerance=2.0, backoff=0.5)
+    for _ in range(5):
+        adaptive.observe(0.1)
+    assert adaptive.limit == 10.0
+
+    adaptive.observe(1.0)
+    assert adaptive.limit == 5.0
+    # A second slow call within the same round trip does not halve it again
+    adaptive.observe(1.0)
+    assert adaptive.limit == 5.0
+
+    adaptive.observe(0.1)
+    assert adaptive.limit == pytest.approx(5.2)
+    # Baselines are kept per kind: a slower model is not judged by a faster one
+    adaptive.observe(1.0, "slow-model")
+    assert adaptive.limit == pytest.approx(5.2 + 1 / 5.2)
+
+def test_upstream_overloads_lower_the_limit_to_its_floor():
+    adaptive = limiter.AdaptiveLimiter("test", min_limit=2, max_limit=8, latency_tolerance=2.0, backoff=0.5)
+    for _ in range(5):
+        adaptive.record_overload()
+    assert adaptive.limit == 2.0
+    assert adaptive.overloads == 5
+
+def test_waiting_calls_are_served_round_robin_by_client():
+    adaptive = limiter.AdaptiveLimiter("test", min_limit=1, max_limit=1, latency_tolerance=2.0, backoff=0.5)
+    served = []
+
+    async def call(key: str):
+        assert await adaptive.acquire(key, time.monotonic() + 1)
+        served.append(key)
+        await asyncio.sleep(0)
+        adaptive.release()
+
+    async def run():
+        assert await adaptive.acquire("busy", time.monotonic() + 1)
+        calls = [asyncio.create_task(call(key)) for key in ("a", "a", "a", "b", "c")]
+        await asyncio.sleep(0)
+        assert adaptive.waiting == 5
+        adaptive.release()
+        await asyncio.gather(*calls)
+
+    asyncio.run(run())
+    assert served == ["a", "b", "c", "a", "a"]
+    assert adaptive.in_flight == 0
+
+def test_calls_that_cannot_start_before_their_deadline_are_shed():
+    adaptive = limiter.AdaptiveLimiter("test", min_limit=1, max_limit=1, latency_tolerance=2.0, backoff=0.5)
+
+    async def run():
+        assert await adaptive.acquire("a", time.monotonic() + 1)
+        # No service time yet: the call waits out its deadline, then is shed
+        started = time.monotonic()
+        assert not await adaptive.acquire("b", started + 0.05)
+        assert 0.04 < time.monotonic() - started < 0.5
+        assert adaptive.waiting == 0
+
+        # Once calls are known to hold a slot for 1 s, a 0.2 s deadline is shed at once
+        adaptive.release(held=1.0)
+        assert await adaptive.acquire("a", time.monotonic() + 1)
+        started = time.monotonic()
+        assert not await adaptive.acquire("b", started + 0.2)
+        assert time.monotonic() - started < 0.05
+
+        # A cancelled waiter leaves the queue
+        waiter = asyncio.create_task(adaptive.acquire("c", time.monotonic() + 5))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert adaptive.waiting == 0
+        adaptive.release()
+
+    asyncio.run(run())
+    assert adaptive.shed == 2
+    assert adaptive.in_flight == 0
+
+@pytest.fixture
+def rate_limited_app(limits, monkeypatch):
+    """An app behind LimiterMiddleware with a burst of one request per client, refilled every 10 s."""
+    monkeypatch.setattr(settings, "limiter_backend", "memory")
+    monkeypatch.setattr(settings, "rate_limit_per_minute", 6.0)
+    monkeypatch.setattr(settings, "rate_limit_burst", 1)
+    monkeypatch.setattr(limiter, "_bucket_store", None)
+    app = FastAPI()
+
+    @app.post("/api/tutor/chat")
+    async def chat(body: dict):
+        return {"key": limiter.admission_key.get()}
+
+    @app.post("/api/other")
+    async def other():
+        return {}
+
+    app.add_middleware(LimiterMiddleware, prefixes=("/api/tutor/",))
+    return app
+
+def test_middleware_rejects_over_the_rate_with_429_and_retry_after(rate_limited_app):
+    async def run():
+        transport = httpx.ASGITransport(app=rate_limited_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = await client.post("/api/tutor/chat", json={"session_id": "s1"})
+            second = await client.post("/api/tutor/chat", json={"session_id": "s1"})
+            other_session = await client.post("/api/tutor/chat", json={"session_id": "s2"})
+            unlimited = [await client.post("/api/other") for _ in range(3)]
+            return first, second, other_session, unlimited
+
+    first, second, other_session, unlimited = asyncio.run(run())
+    assert first.status_code == 200
+    # The request's upstream calls queue under its session
+    assert first.json() == {"key": "session:s1"}
+    assert second.status_code == 429
+    assert second.headers["Retry-After"] == "10"
+    assert second.json() == {"detail": "Too many requests; slow down."}
+    assert other_session.status_code == 200
+    assert [response.status_code for response in unlimited] == [200, 200, 200]
@@ -0,0 +1,31 @@
+import sys
+import pytest
+from app import logger as app_logger
+from app.config import settings
+
+@pytest.fixture
+def lone_process(monkeypatch):
+    monkeypatch.setattr(settings, "log_rotation", "auto")
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    monkeypatch.setattr(sys, "argv", ["uvicorn", "app.main:app"])
+
+def test_lone_process_rotates_its_own_log(lone_process):
+    assert app_logger._rotates_in_process()
+
+@pytest.mark.parametrize("setup", [
+    lambda monkeypatch: monkeypatch.setenv("WEB_CONCURRENCY", "4"),
+    lambda monkeypatch: monkeypatch.setattr(sys, "argv", ["/usr/local/bin/gunicorn", "app.main:app"]),
+    lambda monkeypatch: monkeypatch.setattr(settings, "log_rotation", "external"),
+])
+def test_worker_processes_leave_rotation_to_an_external_tool(lone_process, monkeypatch, setup):
+    setup(monkeypatch)
+    assert not app_logger._rotates_in_process()
+
+def test_size_rotation_can_be_forced(lone_process, monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    monkeypatch.setattr(settings, "log_rotation", "size")
+    assert app_logger._rotates_in_process()
+
+def test_stdout_only_logging_has_no_files_to_tail(monkeypatch):
+    monkeypatch.setattr(settings, "log_file", "")
+    assert app_logger.tail_logs(10) == {"logs": [], "next_cursor": None}
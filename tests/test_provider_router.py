@@ -0,0 +1,183 @@
+import asyncio
+import time
+import pytest
+from app.config import settings
+from app.services.provider_router import ProviderRouter, Target
+
+class FakeProvider:
+    """Upstream provider that answers after `latency` seconds, or fails while `failing` is set."""
+
+    local = False
+    available = True
+
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self.failing = False
+        self.calls = 0
+        self.cancelled = 0
+        self.closed = 0
+
+    async def complete(self, model: str, prompt: str, **params) -> str:
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.failing:
+            raise ConnectionError(f"{self.name} is down")
+        return f"{self.name}: {prompt}"
+
+    async def stream(self, model: str, prompt: str, **params):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.latency)
+            if self.failing:
+                raise ConnectionError(f"{self.name} is down")
+            for word in prompt.split():
+                yield f"{self.name}:{word}"
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.closed += 1
+
+@pytest.fixture
+def breaker(monkeypatch, isolated_settings):
+    """Circuits that open after two failures and are probed again after 0.1 s."""
+    monkeypatch.setattr(settings, "router_failure_threshold", 2)
+    monkeypatch.setattr(settings, "model_fallback_ttl_seconds", 0.1)
+    return settings
+
+def test_failed_request_fails_over_to_the_next_target(breaker):
+    primary, backup = FakeProvider("primary"), FakeProvider("backup")
+    primary.failing = True
+    router = ProviderRouter("test", [Target(primary, "m"), Target(backup, "m")])
+
+    assert asyncio.run(router.complete("hello")) == "backup: hello"
+    assert router.failovers == 1
+    # One failure is below the threshold: the circuit stays closed
+    assert router.targets[0].failures == 1
+    assert router.targets[0].state == "closed"
+
+def test_streams_fail_over_before_their_first_chunk(breaker):
+    primary, backup = FakeProvider("primary"), FakeProvider("backup")
+    primary.failing = True
+    router = ProviderRouter("test", [Target(primary, "m"), Target(backup, "m")])
+
+    async def run():
+        return [chunk async for chunk in router.stream("a b")]
+
+    assert asyncio.run(run()) == ["backup:a", "backup:b"]
+    assert primary.closed == 1
+
+def test_circuit_opens_then_closes_after_a_successful_probe(breaker):
+    primary, backup = FakeProvider("primary"), FakeProvider("backup")
+    target = Target(primary, "m")
+    router = ProviderRouter("test", [target, Target(backup, "m")])
+
+    async def run():
+        primary.failing = True
+        await router.complete("one")
+        await router.complete("two")
+        assert target.state == "open"
+
+        # Open: the target is skipped without a call
+        calls = primary.calls
+        assert await router.complete("three") == "backup: three"
+        assert primary.calls == calls
+
+        await asyncio.sleep(0.12)
+        assert target.state == "half_open"
+        primary.failing = False
+        assert await router.complete("four") == "primary: four"
+        assert target.state == "closed"
+
+    asyncio.run(run())
+
+def test_failed_probe_reopens_the_circuit_and_only_one_probe_runs(breaker):
+    primary, backup = FakeProvider("primary", latency=0.05), FakeProvider("backup")
+    target = Target(primary, "m")
+    router = ProviderRouter("test", [target, Target(backup, "m")])
+
+    async def run():
+        primary.failing = True
+        for _ in range(2):
+            await router.complete("down")
+        assert target.state == "open"
+        await asyncio.sleep(0.12)
+
+        # Concurrent requests while half-open: one probes, the others skip the target
+        calls = primary.calls
+        results = await asyncio.gather(*(router.complete(f"q{i}") for i in range(3)))
+        assert primary.calls == calls + 1
+        assert results == ["backup: q0", "backup: q1", "backup: q2"]
+        assert target.state == "open"
+
+    asyncio.run(run())
+
+@pytest.fixture
+def hedging(monkeypatch, breaker):
+    monkeypatch.setattr(settings, "router_hedge_enabled", True)
+    monkeypatch.setattr(settings, "router_hedge_percentile", 95.0)
+    monkeypatch.setattr(settings, "router_hedge_min_delay_ms", 20.0)
+    return settings
+
+async def _warm(router: ProviderRouter, kind: str):
+    # Hedging starts once the primary has enough latency samples
+    for _ in range(Target.MIN_SAMPLES):
+        if kind == "complete":
+            await router.complete("warm")
+        else:
+            [chunk async for chunk in router.stream("warm")]
+
+def test_hedged_request_wins_on_the_backup_and_cancels_the_slow_primary(hedging):
+    primary, backup = FakeProvider("primary", latency=0.01), FakeProvider("backup", latency=0.01)
+    router = ProviderRouter("test", [Target(primary, "m"), Target(backup, "m")])
+
+    async def run():
+        await _warm(router, "complete")
+        assert backup.calls == 0
+
+        primary.latency = 1.0
+        started = time.monotonic()
+        result = await router.complete("hello")
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(run())
+    assert result == "backup: hello"
+    assert elapsed < 0.5
+    assert router.hedges == 1 and router.hedge_wins == 1
+    assert primary.cancelled == 1
+    # A cancelled loser is not a failure
+    assert router.targets[0].failures == 0
+    assert router.targets[0].state == "closed"
+
+def test_hedge_is_cancelled_when_the_primary_answers_first(hedging):
+    primary, backup = FakeProvider("primary", latency=0.01), FakeProvider("backup", latency=1.0)
+    router = ProviderRouter("test", [Target(primary, "m"), Target(backup, "m")])
+
+    async def run():
+        await _warm(router, "complete")
+        primary.latency = 0.05
+        return await router.complete("hello")
+
+    assert asyncio.run(run()) == "primary: hello"
+    assert router.hedges == 1 and router.hedge_wins == 0
+    assert backup.calls == 1 and backup.cancelled == 1
+
+def test_hedged_stream_closes_the_losing_stream(hedging):
+    primary, backup = FakeProvider("primary", latency=0.01), FakeProvider("backup", latency=0.01)
+    router = ProviderRouter("test", [Target(primary, "m"), Target(backup, "m")])
+
+    async def run():
+        await _warm(router, "stream")
+        primary.latency = 1.0
+        return [chunk async for chunk in router.stream("a b")]
+
+    assert asyncio.run(run()) == ["backup:a", "backup:b"]
+    assert router.hedge_wins == 1
+    assert primary.cancelled == 1
+    # Every stream opened, including the loser, was closed
+    assert primary.closed == primary.calls and backup.closed == backup.calls
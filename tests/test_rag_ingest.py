@@ -0,0 +1,37 @@
+import asyncio
+import threading
+import httpx
+from fastapi import FastAPI
+from app.routers import rag_router
+from app.services import rag
+
+def test_concurrent_ingest_is_rejected_before_the_stream_starts(monkeypatch):
+    release = threading.Event()
+    loaded = []
+
+    def build_index(source_dir):
+        yield {"stage": "scan", "files": 1}
+        release.wait(5)
+        yield {"stage": "done", "generation": "gen-1"}
+
+    monkeypatch.setattr(rag, "build_index", build_index)
+    monkeypatch.setattr(rag, "load_index", lambda: loaded.append(True))
+    app = FastAPI()
+    app.include_router(rag_router.router, prefix="/api/rag")
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            first = asyncio.create_task(client.post("/api/rag/ingest"))
+            while not rag.ingest_running():
+                await asyncio.sleep(0.01)
+            second = await client.post("/api/rag/ingest")
+            release.set()
+            return await first, second
+
+    first, second = asyncio.run(run())
+    assert second.status_code == 409
+    assert first.status_code == 200
+    assert "event: done" in first.text
+    # The worker loaded the new generation and gave the lock back
+    assert loaded == [True]
+    assert not rag.ingest_running()
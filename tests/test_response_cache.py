@@ -0,0 +1,36 @@
+import asyncio
+import threading
+import numpy as np
+from app.services import cache
+from app.services.cache import ResponseCache
+
+class RecordingEmbedder:
+    """Embeds every text to the same vector and records the thread it ran on."""
+
+    dim = 4
+
+    def __init__(self):
+        self.threads = []
+
+    def embed(self, texts):
+        self.threads.append(threading.get_ident())
+        return np.ones((len(texts), self.dim), dtype=np.float32) / 2
+
+def test_exact_tier_keeps_case_and_ignores_whitespace():
+    assert ResponseCache.make_key("debugger", "m", "x = Foo()") != ResponseCache.make_key("debugger", "m", "x = foo()")
+    assert ResponseCache.make_key("debugger", "m", "WHERE x IS NULL") != ResponseCache.make_key("debugger", "m", "where x is null")
+    assert ResponseCache.make_key("debugger", "m", "  x = Foo()\n") == ResponseCache.make_key("debugger", "m", "x  =  Foo()")
+
+def test_similarity_lookups_embed_off_the_event_loop(monkeypatch):
+    embedder = RecordingEmbedder()
+    monkeypatch.setattr(cache, "get_embedder", lambda: embedder)
+    response_cache = ResponseCache(max_entries=10, ttl_seconds=60.0, similarity_threshold=0.9)
+
+    async def run():
+        await response_cache.aset("tutor", "m", "prompt one", {"explanation": "a"}, "what is a list")
+        return await response_cache.aget("tutor", "m", "prompt two", "what is a list?"), threading.get_ident()
+
+    value, loop_thread = asyncio.run(run())
+    assert value == {"explanation": "a"}
+    assert response_cache.similar_hits == 1
+    assert len(embedder.threads) == 2 and loop_thread not in embedder.threads
@@ -0,0 +1,114 @@
+import time
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from app.memory import COLD_BLOCK_SIZE, BoundedChatMessageHistory, SessionStore
+
+def _fill(history: BoundedChatMessageHistory, count: int, text: str = "turn {i}"):
+    for i in range(count):
+        history.add_message((HumanMessage if i % 2 == 0 else AIMessage)(content=text.format(i=i)))
+
+def _contents(history: BoundedChatMessageHistory) -> list[str]:
+    return [message.content for message in history.messages]
+
+def test_store_evicts_the_least_recently_used_entry():
+    evicted = []
+    store = SessionStore("test", max_entries=2, ttl_seconds=60.0, on_evict=lambda key, value: evicted.append((key, value)))
+    store.set("a", 1)
+    store.set("b", 2)
+    # Reading "a" makes "b" the least recently used
+    assert store.get("a") == 1
+    store.set("c", 3)
+
+    assert evicted == [("b", 2)]
+    assert "b" not in store and "a" in store and "c" in store
+    assert store.evictions == 1
+    assert len(store) == 2
+
+def test_store_expires_idle_entries_and_reads_refresh_them():
+    evicted = []
+    store = SessionStore("test", max_entries=10, ttl_seconds=0.1, on_evict=lambda key, value: evicted.append(key))
+    store.set("read", 1)
+    store.set("idle", 2)
+    time.sleep(0.06)
+    assert store.get("read") == 1
+    time.sleep(0.06)
+
+    assert "idle" not in store
+    assert "read" in store
+    assert evicted == ["idle"]
+    [(key, value, idle)] = list(store.items())
+    assert (key, value) == ("read", 1) and 0.05 < idle < 0.1
+
+def test_store_pop_does_not_count_as_eviction():
+    evicted = []
+    store = SessionStore("test", max_entries=10, ttl_seconds=60.0, on_evict=lambda key, value: evicted.append(key))
+    store.set("a", 1)
+    assert store.pop("a") == 1
+    assert store.pop("a", "gone") == "gone"
+    assert evicted == [] and store.evictions == 0
+
+def test_history_keeps_the_newest_max_messages():
+    history = BoundedChatMessageHistory(max_messages=3)
+    _fill(history, 5)
+    assert _contents(history) == ["turn 2", "turn 3", "turn 4"]
+    assert [message.type for message in history.messages] == ["human", "ai", "human"]
+    assert history.dropped == 2
+    assert len(history) == 3
+
+def test_history_keeps_within_max_bytes_but_never_drops_the_last_message():
+    history = BoundedChatMessageHistory(max_bytes=10)
+    _fill(history, 4, text="abc{i}")
+    assert _contents(history) == ["abc2", "abc3"]
+    assert history.size_bytes == 8
+
+    history.add_message(HumanMessage(content="x" * 50))
+    assert _contents(history) == ["x" * 50]
+
+def test_history_round_trips_roles_and_unicode():
+    history = BoundedChatMessageHistory()
+    history.add_messages([SystemMessage(content="Be brief."), HumanMessage(content="Ça marche? 🤔"), AIMessage(content="Да")])
+    assert [(m.type, m.content) for m in history.messages] == [("system", "Be brief."), ("human", "Ça marche? 🤔"), ("ai", "Да")]
+    assert history.size_bytes == sum(len(m.content.encode("utf-8")) for m in history.messages)
+    assert history.message_range(1, 2) == [HumanMessage(content="Ça marche? 🤔")]
+
+def test_history_rejects_unsupported_message_types():
+    class ToolMessage:
+        type = "tool"
+        content = "result"
+    with pytest.raises(ValueError):
+        BoundedChatMessageHistory().add_message(ToolMessage())
+
+def test_trimmed_turns_are_compacted_out_of_the_arena():
+    history = BoundedChatMessageHistory(max_messages=10)
+    _fill(history, 1000)
+    assert _contents(history) == [f"turn {i}" for i in range(990, 1000)]
+    # Trimmed turns are released once a block's worth has accumulated
+    assert len(history._roles) < len(history) + COLD_BLOCK_SIZE
+    assert history.resident_bytes < 1000
+
+def test_cold_turns_are_compressed_and_read_back_in_order():
+    hot = 4
+    history = BoundedChatMessageHistory(max_messages=100, hot_messages=hot)
+    text = "Traceback (most recent call last): line {i} " + "x" * 200
+    _fill(history, 2 * COLD_BLOCK_SIZE + hot, text=text)
+
+    assert len(history._cold) == 2
+    assert _contents(history) == [text.format(i=i) for i in range(2 * COLD_BLOCK_SIZE + hot)]
+    assert history.resident_bytes < history.size_bytes / 2
+
+def test_trimming_reaches_into_cold_blocks():
+    history = BoundedChatMessageHistory(max_messages=20, hot_messages=2)
+    _fill(history, 60)
+    assert _contents(history) == [f"turn {i}" for i in range(40, 60)]
+    assert history.dropped == 40
+    assert history.turn(0) == ("human", "turn 40")
+    with pytest.raises(IndexError):
+        history.turn(20)
+
+def test_clear_resets_turns_and_summary():
+    history = BoundedChatMessageHistory(hot_messages=2)
+    _fill(history, 40)
+    history.summary, history.summary_upto = "earlier turns", 10
+    history.clear()
+    assert len(history) == 0 and history.size_bytes == 0 and history.resident_bytes == 0
+    assert (history.summary, history.summary_upto) == ("", 0)
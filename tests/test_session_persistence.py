@@ -0,0 +1,194 @@
+import asyncio
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from app import memory
+from app.config import settings
+from app.database.batch_writer import BatchWriter
+from app.database.client import db_client
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Mongo session backend on an in-memory mongomock-motor client, with a fresh writer."""
+    client = mongomock_motor.AsyncMongoMockClient()
+    monkeypatch.setattr(db_client, "_client", client)
+    monkeypatch.setattr(settings, "session_backend", "mongo")
+    monkeypatch.setattr(memory, "_session_store", memory.SessionStore("sessions", 100, 3600.0))
+    writer = BatchWriter(lambda: memory._collection(memory.MESSAGES_COLLECTION), flush_interval=0.05, max_batch=3, max_pending=100)
+    monkeypatch.setattr(memory, "_history_writer", writer)
+    return client[settings.mongo_db_name][memory.MESSAGES_COLLECTION]
+
+def test_history_is_written_behind_and_reloaded(mongo):
+    async def run():
+        await memory.start_session_persistence()
+        history = memory.get_session_history("s1")
+        await history.aadd_messages([HumanMessage(content="hi"), AIMessage(content="hello")])
+        # Queued, not written inline
+        assert memory._history_writer.pending == 2
+        assert await mongo.count_documents({}) == 0
+        await asyncio.sleep(0.2)
+        assert memory._history_writer.pending == 0
+        assert await mongo.count_documents({"session_id": "s1"}) == 2
+
+        # A worker that has not seen the session loads it from the collection
+        memory._session_store.pop("s1")
+        reloaded = memory.get_session_history("s1")
+        await reloaded.aload()
+        assert [message.content for message in reloaded.messages] == ["hi", "hello"]
+        await memory.stop_session_persistence()
+    asyncio.run(run())
+
+def test_stop_flushes_queued_writes(mongo):
+    async def run():
+        await memory.start_session_persistence()
+        await memory.append_session_messages("s2", [("user", "q"), ("bot", "a")])
+        await memory.stop_session_persistence()
+        assert await mongo.count_documents({"session_id": "s2"}) == 2
+    asyncio.run(run())
+
+class _SlowCursor:
+    """Cursor whose results take a moment to arrive."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args):
+        return _SlowCursor(self.cursor.sort(*args))
+
+    def limit(self, n):
+        return _SlowCursor(self.cursor.limit(n))
+
+    async def to_list(self, length):
+        await asyncio.sleep(0.05)
+        return await self.cursor.to_list(length=length)
+
+def test_concurrent_first_reads_load_the_history_once(mongo, monkeypatch):
+    async def run():
+        await memory.start_session_persistence()
+        await memory.append_session_messages("s3", [("user", "q"), ("bot", "a")])
+        await memory._history_writer.flush()
+        memory._session_store.pop("s3")
+
+        # Slow the query down so the reads overlap
+        find = mongo.find
+        monkeypatch.setattr(type(mongo), "find", lambda self, *args, **kwargs: _SlowCursor(find(*args, **kwargs)))
+
+        history = memory.get_session_history("s3")
+        await asyncio.gather(
+            history.aload(),
+            history.aload(),
+            history.aadd_messages([HumanMessage(content="next")]),
+        )
+        assert [message.content for message in history.messages] == ["q", "a", "next"]
+        await memory.stop_session_persistence()
+    asyncio.run(run())
+
+class _DownCollection:
+    def __init__(self):
+        self.attempts = 0
+
+    async def insert_many(self, documents, ordered=True):
+        self.attempts += 1
+        raise ConnectionError("database unreachable")
+
+def test_writer_bounds_memory_and_backs_off_while_the_database_is_down():
+    collection = _DownCollection()
+    writer = BatchWriter(lambda: collection, flush_interval=0.05, max_batch=10, max_pending=50)
+
+    async def run():
+        writer.start()
+        for i in range(1000):
+            writer.add({"n": i})
+            await asyncio.sleep(0.0005)
+        await asyncio.sleep(0.3)
+        await writer.stop()
+
+    asyncio.run(run())
+    # The newest documents are kept and the rest counted as dropped
+    assert writer.pending == 50
+    assert writer.dropped == 950
+    # Retries back off instead of firing on every full batch
+    assert collection.attempts < 10
+
+def test_partially_written_batch_requeues_only_failed_documents():
+    from pymongo.errors import BulkWriteError
+
+    class PartialCollection:
+        def __init__(self):
+            self.stored = []
+            self.fail = True
+
+        async def insert_many(self, documents, ordered=True):
+            if self.fail:
+                self.fail = False
+                self.stored.extend(documents[:2])
+                raise BulkWriteError({"writeErrors": [{"index": 2, "code": 6, "errmsg": "network"}]})
+            self.stored.extend(documents)
+
+    collection = PartialCollection()
+    writer = BatchWriter(lambda: collection, flush_interval=0.0, max_batch=10, max_pending=50)
+    for i in range(3):
+        writer.add({"n": i})
+
+    async def run():
+        await writer.flush()
+        assert writer.pending == 1
+        await writer.flush()
+    asyncio.run(run())
+    assert [doc["n"] for doc in collection.stored] == [0, 1, 2]
+
+class _SlowCollection:
+    def __init__(self):
+        self.stored = []
+        self.started = asyncio.Event()
+
+    async def insert_many(self, documents, ordered=True):
+        self.started.set()
+        await asyncio.sleep(0.1)
+        self.stored.extend(documents)
+
+def test_stop_waits_for_a_write_in_progress():
+    collection = _SlowCollection()
+    writer = BatchWriter(lambda: collection, flush_interval=0.01, max_batch=2, max_pending=50)
+
+    async def run():
+        writer.start()
+        for i in range(3):
+            writer.add({"n": i})
+        await collection.started.wait()
+        await writer.stop()
+
+    asyncio.run(run())
+    assert sorted(doc["n"] for doc in collection.stored) == [0, 1, 2]
+    assert writer.pending == 0
+
+def test_cancelled_write_keeps_its_batch():
+    collection = _SlowCollection()
+    writer = BatchWriter(lambda: collection, flush_interval=0.01, max_batch=10, max_pending=50)
+    writer.add({"n": 0})
+
+    async def run():
+        flush = asyncio.create_task(writer.flush())
+        await collection.started.wait()
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+
+    asyncio.run(run())
+    assert writer.pending == 1
+
+def test_zero_flush_interval_still_backs_off():
+    collection = _DownCollection()
+    writer = BatchWriter(lambda: collection, flush_interval=0.0, max_batch=1, max_pending=50)
+
+    async def run():
+        writer.start()
+        for i in range(20):
+            writer.add({"n": i})
+            await asyncio.sleep(0.01)
+        await writer.stop()
+
+    asyncio.run(run())
+    # One failed write, then the final flush at stop
+    assert collection.attempts == 2
@@ -0,0 +1,152 @@
+import asyncio
+import pytest
+from app.services.single_flight import SingleFlight
+
+class FakeUpstream:
+    """Token stream that counts the tokens it produced and whether it was closed."""
+
+    def __init__(self, count: int, delay: float = 0.0):
+        self.count = count
+        self.delay = delay
+        self.calls = 0
+        self.produced = 0
+        self.closed = False
+
+    async def tokens(self):
+        self.calls += 1
+        try:
+            for i in range(self.count):
+                await asyncio.sleep(self.delay)
+                self.produced += 1
+                yield f"t{i}"
+        finally:
+            self.closed = True
+
+def test_identical_calls_share_one_upstream_call():
+    flights = SingleFlight("test")
+    calls = 0
+
+    async def complete():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def run():
+        results = await asyncio.gather(*(flights.do("k", complete) for _ in range(5)))
+        assert flights.stats()["in_flight_calls"] == 0
+        # Once it has finished, the next call goes upstream again
+        await flights.do("k", complete)
+        return results
+
+    assert asyncio.run(run()) == ["answer"] * 5
+    assert calls == 2
+    assert flights.leaders == 2 and flights.coalesced == 4
+
+def test_every_waiter_gets_the_shared_error():
+    flights = SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0.02)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        return await asyncio.gather(*(flights.do("k", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [str(e) for e in results] == ["upstream down"] * 3
+
+def test_cancelling_the_leader_does_not_cancel_the_shared_call():
+    flights = SingleFlight("test")
+    finished = False
+
+    async def complete():
+        nonlocal finished
+        await asyncio.sleep(0.05)
+        finished = True
+        return "answer"
+
+    async def run():
+        leader = asyncio.create_task(flights.do("k", complete))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("k", complete))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "answer"
+    assert finished
+
+def test_stream_subscribers_each_receive_every_token():
+    flights = SingleFlight("test")
+    upstream = FakeUpstream(5, delay=0.01)
+
+    async def read():
+        return [token async for token in flights.stream("k", upstream.tokens)]
+
+    async def run():
+        first = asyncio.create_task(read())
+        await asyncio.sleep(0.025)
+        # A late subscriber still starts from the first token
+        second = asyncio.create_task(read())
+        return await asyncio.gather(first, second)
+
+    expected = [f"t{i}" for i in range(5)]
+    assert asyncio.run(run()) == [expected, expected]
+    assert upstream.calls == 1
+    assert flights.coalesced == 1
+    assert flights.stats()["in_flight_streams"] == 0
+
+def test_slowest_subscriber_holds_back_the_shared_stream():
+    flights = SingleFlight("test", read_ahead=4)
+    upstream = FakeUpstream(50)
+
+    async def run():
+        fast = asyncio.create_task(_drain(flights.stream("k", upstream.tokens)))
+        slow = flights.stream("k", upstream.tokens)
+        assert await anext(slow) == "t0"
+        await asyncio.sleep(0.05)
+        # t0 counts as read only once the slow reader asks for t1, so the
+        # upstream stops read_ahead tokens past its start and the fast reader waits
+        assert upstream.produced == flights.read_ahead
+        assert not fast.done()
+
+        rest = await _drain(slow)
+        assert len(rest) == 49
+        assert len(await fast) == 50
+
+    asyncio.run(run())
+    assert upstream.produced == 50
+
+def test_stream_continues_when_the_leader_leaves_and_closes_with_the_last_subscriber():
+    flights = SingleFlight("test")
+    upstream = FakeUpstream(20, delay=0.005)
+
+    async def leave_after(count: int, upstream: FakeUpstream):
+        tokens = flights.stream("k", upstream.tokens)
+        read = [await anext(tokens) for _ in range(count)]
+        await tokens.aclose()
+        return read
+
+    async def run():
+        leader = asyncio.create_task(leave_after(2, upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(_drain(flights.stream("k", upstream.tokens)))
+        assert await leader == ["t0", "t1"]
+        assert len(await follower) == 20
+        assert upstream.closed
+
+        # With every subscriber gone, the upstream stream is closed early
+        abandoned = FakeUpstream(20, delay=0.005)
+        assert await leave_after(3, abandoned) == ["t0", "t1", "t2"]
+        await asyncio.sleep(0.02)
+        assert abandoned.closed
+        assert abandoned.produced < 20
+        assert flights.stats()["in_flight_streams"] == 0
+
+    asyncio.run(run())
+
+async def _drain(tokens) -> list[str]:
+    return [token async for token in tokens]
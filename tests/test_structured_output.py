@@ -0,0 +1,69 @@
+import pytest
+from app.services.structured_output import TutorResponseParser, fallback_response, parse_tutor_response
+
+ANSWER = '{"explanation": "Use a list.", "stepsToFix": ["Replace the tuple", "Rerun"], "resources": ["https://docs.python.org"]}'
+
+def test_well_formed_answer_is_valid():
+    response, outcome = parse_tutor_response(ANSWER)
+    assert outcome == "valid"
+    assert response == {
+        "explanation": "Use a list.",
+        "stepsToFix": ["Replace the tuple", "Rerun"],
+        "resources": ["https://docs.python.org"],
+    }
+
+@pytest.mark.parametrize("text", [
+    f"```json\n{ANSWER}\n```",
+    f"Here is the answer:\n{ANSWER}\nHope this helps!",
+])
+def test_fenced_or_wrapped_answer_is_repaired(text):
+    response, outcome = parse_tutor_response(text)
+    assert outcome == "repaired"
+    assert response == parse_tutor_response(ANSWER)[0]
+
+def test_truncated_explanation_is_closed_in_place():
+    response, outcome = parse_tutor_response('{"explanation": "A tuple cannot be chang')
+    assert outcome == "repaired"
+    assert response == {"explanation": "A tuple cannot be chang", "stepsToFix": [], "resources": []}
+
+@pytest.mark.parametrize("cut, explanation", [
+    ('{"explanation": "Escape it with \\', "Escape it with "),
+    ('{"explanation": "A dash \\u20', "A dash "),
+])
+def test_truncation_inside_an_escape_drops_the_partial_escape(cut, explanation):
+    response, outcome = parse_tutor_response(cut)
+    assert outcome == "repaired"
+    assert response["explanation"] == explanation
+
+def test_truncated_list_keeps_complete_items_and_drops_a_cut_one():
+    text = '{"explanation": "Use a list.", "stepsToFix": ["Replace the tuple"], "resources": ["https://docs.python.org", "https://exa'
+    response, outcome = parse_tutor_response(text)
+    assert outcome == "repaired"
+    assert response["stepsToFix"] == ["Replace the tuple"]
+    assert response["resources"] == ["https://docs.python.org"]
+
+def test_string_or_objects_where_a_list_is_expected_are_coerced():
+    response, _ = parse_tutor_response('{"explanation": "x", "stepsToFix": "Rerun the script", "resources": [{"url": "https://a.b"}]}')
+    assert response["stepsToFix"] == ["Rerun the script"]
+    assert response["resources"] == ['{"url":"https://a.b"}']
+
+def test_answer_without_an_explanation_is_invalid():
+    assert parse_tutor_response('{"stepsToFix": ["Rerun"]}') == (None, "invalid")
+    assert parse_tutor_response("I cannot help with that.") == (None, "invalid")
+    # An explanation of the wrong type is not recovered either
+    assert parse_tutor_response('{"explanation": 42}') == (None, "invalid")
+
+def test_chunked_feed_matches_the_whole_answer():
+    text = f"```json\n{ANSWER}\n```"
+    parser = TutorResponseParser()
+    for i in range(0, len(text), 3):
+        parser.feed(text[i:i + 3])
+    assert parser.result() == parse_tutor_response(text)
+
+def test_fields_are_validated_as_soon_as_they_are_complete():
+    parser = TutorResponseParser()
+    parser.feed('{"explanation": "Use a list.", "stepsToFix": ["Repl')
+    assert parser.fields == {"explanation": "Use a list."}
+
+def test_fallback_keeps_plain_text_as_the_explanation():
+    assert fallback_response("```\nJust rerun it.\n```") == {"explanation": "Just rerun it.", "stepsToFix": [], "resources": []}
@@ -0,0 +1,48 @@
+import asyncio
+import json
+import time
+import httpx
+from app.services import tutor
+
+DELAY = 0.3
+
+def _delayed_provider(calls: list):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(json.loads(request.content))
+        await asyncio.sleep(DELAY)
+        answer = {"explanation": "ok", "stepsToFix": [], "resources": []}
+        return httpx.Response(200, json={"choices": [{"index": 0, "message": {"role": "assistant", "content": json.dumps(answer)}}]})
+    return handler
+
+def test_concurrent_tutor_calls_overlap(together_client):
+    calls = []
+    together_client(httpx.MockTransport(_delayed_provider(calls)))
+
+    async def run(n: int) -> float:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(tutor.get_tutor_response(f"s{i}", f"question {i}") for i in range(n)))
+        assert all(result["explanation"] == "ok" for result in results)
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run(10))
+    assert len(calls) == 10
+    # Ten calls finish in about the time of one, not ten times as long
+    assert elapsed < DELAY * 2, elapsed
+
+def test_tutor_call_does_not_block_the_event_loop(together_client):
+    together_client(httpx.MockTransport(_delayed_provider([])))
+
+    async def run() -> int:
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        task = asyncio.create_task(ticker())
+        await tutor.get_tutor_response("s", "question")
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(run()) >= DELAY / 0.01 / 2
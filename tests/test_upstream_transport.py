@@ -0,0 +1,125 @@
+import asyncio
+import datetime
+import ipaddress
+import socket
+import ssl
+import threading
+import time
+import httpx
+import pytest
+import uvicorn
+from app import model_loader
+from app.http_transport import UpstreamTransport, _origin
+from benchmarks.fake_llm import Script, create_app
+
+x509 = pytest.importorskip("cryptography.x509")
+
+def _self_signed(directory) -> tuple[str, str]:
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = directory / "cert.pem", directory / "key.pem"
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return str(cert_path), str(key_path)
+
+@pytest.fixture(scope="module")
+def https_llm(tmp_path_factory):
+    """The benchmark's fake LLM served over HTTPS on a free local port; yields (base_url, cert path)."""
+    cert, key = _self_signed(tmp_path_factory.mktemp("tls"))
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    script = Script(ttft_ms=50, tokens_per_second=2000, output_tokens=20, error_rate=0.0, overload_rate=0.0, seed=0)
+    server = uvicorn.Server(uvicorn.Config(
+        create_app(script), host="127.0.0.1", port=port, log_level="warning", ssl_certfile=cert, ssl_keyfile=key,
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        assert time.monotonic() < deadline, "fake LLM server did not start"
+        time.sleep(0.05)
+    yield f"https://localhost:{port}/v1", cert
+    server.should_exit = True
+    thread.join(timeout=5)
+
+def _client(base_url: str, cert: str, pool_size: int) -> tuple[model_loader.TogetherAIClient, UpstreamTransport]:
+    transport = UpstreamTransport(
+        pool_size=pool_size, host_pool_sizes={}, keepalive_expiry=60.0, http2=False,
+        dns_ttl_seconds=300.0, verify=ssl.create_default_context(cafile=cert),
+    )
+    client = model_loader.TogetherAIClient(
+        api_key="test-key", base_url=base_url, timeout=10.0, max_concurrency=64, transport=transport,
+    )
+    return client, transport
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+def test_concurrent_requests_reuse_pooled_tls_connections(https_llm):
+    base_url, cert = https_llm
+    client, transport = _client(base_url, cert, pool_size=4)
+
+    async def run():
+        for _ in range(5):
+            await asyncio.gather(*(client.chat_completion("m", MESSAGES) for _ in range(8)))
+        stats = transport.stats()
+        await transport.close()
+        return stats
+
+    stats = asyncio.run(run())
+    host = stats["origins"][base_url.removesuffix("/v1")]
+    assert host["requests"] == 40
+    # Never more connections than the pool holds, however many requests
+    assert host["connections_opened"] <= 4
+    assert host["reuse_ratio"] >= 0.9
+    assert host["in_flight"] == 0
+    # One DNS lookup per host while the answer is cached
+    assert stats["dns_lookups"] == 1
+
+def test_streams_return_their_connection_to_the_pool(https_llm):
+    base_url, cert = https_llm
+    client, transport = _client(base_url, cert, pool_size=4)
+
+    async def run():
+        for _ in range(10):
+            text = "".join([token async for token in client.stream_chat_completion("m", MESSAGES)])
+            assert text
+        stats = transport.stats()
+        await transport.close()
+        return stats["origins"][base_url.removesuffix("/v1")]
+
+    host = asyncio.run(run())
+    # Each stream is read to the end of its body, so one connection serves all of them
+    assert host["requests"] == 10
+    assert host["connections_opened"] == 1
+
+def test_pools_are_kept_per_origin():
+    transport = UpstreamTransport(
+        pool_size=8, host_pool_sizes={"localhost:8001": 2, "localhost": 4}, keepalive_expiry=60.0, http2=False, dns_ttl_seconds=300.0,
+    )
+    # Pools are created on first use, before any connection is opened
+    for url in ("http://localhost:8001/v1", "http://localhost:8002/v1", "https://localhost/v1", "https://api.test/v1"):
+        transport._pool(_origin(httpx.URL(url)))
+    sizes = {origin: stats["max_connections"] for origin, stats in transport.stats()["origins"].items()}
+    assert sizes == {
+        "http://localhost:8001": 2,
+        "http://localhost:8002": 4,
+        "https://localhost:443": 4,
+        "https://api.test:443": 8,
+    }